@@ -0,0 +1,217 @@
+"""端到端的爬取性能测试
+
+生成合成网站和假CDX文件，在本地http服务器上端到端地运行一次main.py，统计：
+* 吞吐：每秒成功的页面数、每秒输出的元素数
+* 每个URL的耗时分位数 p50/p95/p99 (来自worker写出的 {worker}_outcomes.jsonl)
+* 每个worker进程树(包括它的chromedriver和Chrome)的RSS峰值
+* 输出目录写入的字节数
+* 开启了浏览器缓存(--profile_template、--disk_cache_mb)时，缓存的命中率、从缓存读取的字节数以及复制profile模板的开销
+结果保存为JSON，指定 --baseline 时与之前的结果比较，吞吐下降超过 --max_regression 时以非零状态退出。
+main.py的其它参数可以放在 -- 之后原样传入，例如 --engine cdp、--output_format tar。
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+from browser_pool import process_tree_rss
+from fixture_site import serve_directory, write_fake_cdx, write_site
+from output_writer import iter_shard_samples
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, q):
+    """最近秩法的分位数，values为空时返回None"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(values)))
+    return values[rank - 1]
+
+
+def run_main(main_args, poll_interval=0.5):
+    """运行main.py，返回 (耗时, 退出码, 每个worker进程的RSS峰值)"""
+    # main.py中的worker固定使用当前目录下的chromedriver，因此在仓库目录下运行
+    process = subprocess.Popen([sys.executable, 'main.py'] + main_args, cwd=REPO_DIR)
+    peak_rss = {}  # worker进程pid -> RSS峰值(字节)
+    start = time.monotonic()
+    while process.poll() is None:
+        try:
+            workers = psutil.Process(process.pid).children()
+        except psutil.NoSuchProcess:
+            workers = []
+        for worker in workers:
+            peak_rss[worker.pid] = max(peak_rss.get(worker.pid, 0), process_tree_rss(worker.pid))
+        time.sleep(poll_interval)
+    return time.monotonic() - start, process.returncode, list(peak_rss.values())
+
+
+def directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def output_bytes(out_dir):
+    """输出的大小：截图目录、tar分片和JSONL记录，不包括任务分片、进度日志、队列和统计文件，不同调度方式之间可以比较"""
+    total = 0
+    for name in os.listdir(out_dir):
+        path = os.path.join(out_dir, name)
+        if name.endswith('_images') or name.endswith('_shards'):
+            total += directory_bytes(path)
+        elif name.endswith('_out.txt'):
+            total += os.path.getsize(path)
+    return total
+
+
+def collect_outputs(out_dir):
+    """从输出目录中读出每个URL的结果和元素数"""
+    outcomes = []
+    num_elements = 0
+    for name in os.listdir(out_dir):
+        path = os.path.join(out_dir, name)
+        if name.endswith('_outcomes.jsonl'):
+            with open(path, 'r', encoding='utf-8') as file:
+                outcomes += [json.loads(line) for line in file if line.strip()]
+        elif name.endswith('_out.txt'):
+            with open(path, 'r', encoding='utf-8') as file:
+                num_elements += sum(1 for line in file if line.strip())
+        elif name.endswith('_shards'):
+            num_elements += sum(len(records) for _, _, _, records in iter_shard_samples(path))
+    return outcomes, num_elements
+
+
+def collect_cache_stats(out_dir):
+    """汇总各worker的 {worker}_cache_stats.json，没有开启缓存统计时返回None"""
+    totals = None
+    for name in os.listdir(out_dir):
+        if name.endswith('_cache_stats.json'):
+            with open(os.path.join(out_dir, name), 'r', encoding='utf-8') as file:
+                stats = json.load(file)
+            totals = totals or {"responses": 0, "from_cache": 0, "bytes_from_cache": 0, "bytes_network": 0,
+                                "profile_copies": 0, "profile_copy_bytes": 0, "profile_copy_seconds": 0}
+            for key in totals:
+                totals[key] += stats[key]
+    if totals is not None:
+        totals['hit_ratio'] = round(totals['from_cache'] / totals['responses'], 4) if totals['responses'] else 0
+    return totals
+
+
+def summarize(elapsed, outcomes, num_elements, peak_rss, bytes_written):
+    by_outcome = {}
+    for item in outcomes:
+        by_outcome[item['outcome']] = by_outcome.get(item['outcome'], 0) + 1
+    latencies = [item['elapsed_ms'] for item in outcomes
+                 if item['outcome'] == 'ok' and item['elapsed_ms'] is not None]
+    num_ok = by_outcome.get('ok', 0)
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "urls": len(outcomes),
+        "outcomes": by_outcome,
+        "pages_per_s": num_ok / elapsed if elapsed else 0,
+        "elements": num_elements,
+        "elements_per_s": num_elements / elapsed if elapsed else 0,
+        "latency_ms": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                       "p99": percentile(latencies, 99)},
+        "peak_rss_mb_per_worker": [rss >> 20 for rss in sorted(peak_rss, reverse=True)],
+        "bytes_written": bytes_written,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline, max_regression):
+    """打印与baseline的差异，吞吐下降超过max_regression(比例)时返回False"""
+    ok = True
+    for key in ('pages_per_s', 'elements_per_s'):
+        old, new = baseline['results'][key], result['results'][key]
+        change = (new - old) / old if old else 0
+        print(f"{key}: {old:.2f} -> {new:.2f} ({change:+.1%})")
+        if change < -max_regression:
+            ok = False
+    old_p95, new_p95 = baseline['results']['latency_ms']['p95'], result['results']['latency_ms']['p95']
+    print(f"p95 latency: {old_p95} -> {new_p95} ms")
+    return ok
+
+
+def main(args, main_extra_args):
+    site_config = {"num_pages": args.num_pages, "num_links": args.num_links, "num_buttons": args.num_buttons,
+                   "num_titled": args.num_titled, "dom_depth": args.dom_depth, "num_images": args.num_images,
+                   "image_kb": args.image_kb, "latency_ms": args.latency_ms}
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        site_dir = os.path.join(work_dir, 'site')
+        names = write_site(site_dir, args.num_pages, args.num_links, args.num_buttons, args.num_titled,
+                           args.dom_depth, args.num_images, args.image_kb)
+        server = serve_directory(site_dir, args.latency_ms / 1000)
+        base_url = f'http://127.0.0.1:{server.server_address[1]}/'
+        cdx_path = os.path.join(work_dir, 'fixture.cdx')
+        write_fake_cdx(cdx_path, base_url, names)
+        out_root = os.path.join(work_dir, 'out')
+        main_args = ['--cdx_file_path', cdx_path, '--out_root', out_root, '--num_workers', str(args.num_workers),
+                     '--num_urls', str(args.num_pages), '--worker_id', '0'] + main_extra_args
+        try:
+            elapsed, returncode, peak_rss = run_main(main_args)
+        finally:
+            server.shutdown()
+        out_dir = os.path.join(out_root, 'tasks0')
+        outcomes, num_elements = collect_outputs(out_dir)
+        result = {
+            "revision": git_revision(),
+            "site": site_config,
+            "num_workers": args.num_workers,
+            "main_args": main_extra_args,
+            "returncode": returncode,
+            "results": summarize(elapsed, outcomes, num_elements, peak_rss, output_bytes(out_dir)),
+        }
+        cache_stats = collect_cache_stats(out_dir)
+        if cache_stats is not None:
+            result['results']['cache'] = cache_stats
+    print(json.dumps(result['results'], indent=2))
+    if args.out_file:
+        with open(args.out_file, 'w', encoding='utf-8') as file:
+            json.dump(result, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        if not compare(result, baseline, args.max_regression):
+            print(f"throughput regressed by more than {args.max_regression:.0%}")
+            return 1
+    return 0 if returncode == 0 else returncode
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="在合成网站上端到端运行main.py并统计吞吐、延迟和资源占用")
+    parser.add_argument("--num_pages", type=int, default=200)
+    parser.add_argument("--num_links", type=int, default=200)
+    parser.add_argument("--num_buttons", type=int, default=50)
+    parser.add_argument("--num_titled", type=int, default=50)
+    parser.add_argument("--dom_depth", type=int, default=4)
+    parser.add_argument("--num_images", type=int, default=4)
+    parser.add_argument("--image_kb", type=int, default=64)
+    parser.add_argument("--latency_ms", type=int, default=50, help="每个请求的人为延迟(毫秒)")
+    parser.add_argument("--num_workers", type=int, default=4)
+    parser.add_argument("--work_dir", type=str, default=None, help="临时文件所在目录，默认为系统临时目录")
+    parser.add_argument("--out_file", type=str, default=None, help="把结果保存为JSON")
+    parser.add_argument("--baseline", type=str, default=None, help="之前保存的结果，用于比较")
+    parser.add_argument("--max_regression", type=float, default=0.1, help="允许的吞吐下降比例")
+    args, main_extra_args = parser.parse_known_args()
+    if args.dom_depth < 1:
+        parser.error("--dom_depth must be at least 1")
+    if main_extra_args and main_extra_args[0] == '--':
+        main_extra_args = main_extra_args[1:]
+    sys.exit(main(args, main_extra_args))
@@ -0,0 +1,70 @@
+"""对比逐元素提取(旧实现)和页面内一次性提取(新实现)的耗时与结果
+
+用fixture_site在本地生成若干测试页面(带重复元素和视口外元素)并提供访问，对每个页面分别用两种方式提取元素，
+输出每页耗时以及两种方式的结果是否一致。
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+
+from crawel import Crawler
+from fixture_site import serve_directory, write_site
+
+
+def timed_extract(crawler, fast_extract):
+    crawler.fast_extract = fast_extract
+    st = time.perf_counter()
+    results = crawler.extractElements()
+    return results, time.perf_counter() - st
+
+
+def main(args):
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger("benchmark_extract")
+    with tempfile.TemporaryDirectory() as work_dir:
+        site_dir = os.path.join(work_dir, 'site')
+        names = write_site(site_dir, args.num_pages, args.num_links, args.num_buttons, args.num_titled,
+                           edge_cases=True)
+        server = serve_directory(site_dir)
+        base_url = f'http://127.0.0.1:{server.server_address[1]}/'
+        crawler = Crawler(args.driver_path, os.path.join(work_dir, 'images'), args.width, args.height,
+                          args.wait_timeout, logger, scrape_hover=True, nogui=True)
+        rows = []
+        try:
+            for name in names:
+                crawler.accessURL(base_url + name)
+                slow_results, slow_time = timed_extract(crawler, False)
+                fast_results, fast_time = timed_extract(crawler, True)
+                same = json.dumps(slow_results, sort_keys=True) == json.dumps(fast_results, sort_keys=True)
+                rows.append({"page": name, "elements": len(slow_results), "slow": slow_time, "fast": fast_time,
+                             "identical": same})
+                print(f"{name}: elements={len(slow_results)} slow={slow_time:.3f}s fast={fast_time:.3f}s "
+                      f"speedup={slow_time / max(fast_time, 1e-9):.1f}x identical={same}")
+        finally:
+            crawler.quit()
+            server.shutdown()
+    slow_total = sum(row['slow'] for row in rows)
+    fast_total = sum(row['fast'] for row in rows)
+    print(f"total: slow={slow_total:.3f}s fast={fast_total:.3f}s speedup={slow_total / max(fast_total, 1e-9):.1f}x "
+          f"identical={sum(row['identical'] for row in rows)}/{len(rows)}")
+    if args.out_file:
+        with open(args.out_file, 'w', encoding='utf-8') as file:
+            json.dump(rows, file, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--driver_path", type=str, default="./chromedriver")
+    parser.add_argument("--num_pages", type=int, default=5)
+    parser.add_argument("--num_links", type=int, default=500)
+    parser.add_argument("--num_buttons", type=int, default=100)
+    parser.add_argument("--num_titled", type=int, default=100)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--wait_timeout", type=int, default=3)
+    parser.add_argument("--out_file", type=str, default=None)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,196 @@
+"""浏览器的HTTP缓存和预热的profile
+
+每次启动Chrome都使用一个全新的临时profile，回收浏览器时连同其中的HTTP缓存一起丢掉，
+所有worker因此反复下载同样的CDN资源(jQuery、Bootstrap、Google Fonts、图标库)，每次重启还要初始化一个冷的profile。
+
+Chrome的磁盘缓存不支持多个浏览器进程同时写入，因此这里的共享缓存是只读的：
+* 预先用 `python browser_cache.py --template_dir DIR --url_file popular.txt` 访问一批常见页面，
+  得到一个带有热缓存的profile模板，模板的缓存默认限制在256MB
+* 每次启动浏览器时把模板复制为该浏览器自己的profile，浏览器退出后删除；
+  --disk-cache-size 限制缓存大小，超过时由Chrome按LRU淘汰。复制的次数、字节数和耗时计入统计
+* Chrome 86之后HTTP缓存按顶层站点分区(SplitCacheByNetworkIsolationKey)，在A站缓存的jQuery在B站不会命中，
+  预热和爬取时都关闭这个特性，模板中的CDN资源才能被其它站点的页面用到
+CacheStats 根据Network事件统计每个页面从缓存得到的响应数和字节数，写入输出记录，并按worker汇总。
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter
+
+# 复制模板时跳过的文件：进程锁和上一次运行留下的调试端口
+PROFILE_IGNORE = shutil.ignore_patterns('Singleton*', 'DevToolsActivePort', 'lockfile')
+
+# 跨站点共享缓存需要关闭的特性
+DISABLED_FEATURES = ('SplitCacheByNetworkIsolationKey',)
+
+DEFAULT_TEMPLATE_CACHE_MB = 256
+
+
+def merge_feature_args(args):
+    """Chrome只认最后一个 --disable-features / --enable-features，把多个同名参数合并成一个"""
+    merged = []
+    features = {}
+    for arg in args:
+        name, sep, value = arg.partition('=')
+        if sep and name in ('--disable-features', '--enable-features'):
+            if name not in features:
+                features[name] = []
+                merged.append(name)
+            features[name] += [item for item in value.split(',') if item and item not in features[name]]
+        else:
+            merged.append(arg)
+    return [f"{arg}={','.join(features[arg])}" if arg in features else arg for arg in merged]
+
+
+def create_profile(template_dir=None, prefix='seeclick_profile_'):
+    """创建一个新的profile目录，指定了模板时复制模板的内容，返回 (目录, 复制的字节数)"""
+    profile_dir = tempfile.mkdtemp(prefix=prefix)
+    num_bytes = 0
+    if template_dir is not None:
+        def copy(src, dst):
+            nonlocal num_bytes
+            shutil.copy2(src, dst)
+            num_bytes += os.path.getsize(dst)
+
+        shutil.copytree(template_dir, profile_dir, ignore=PROFILE_IGNORE, copy_function=copy, dirs_exist_ok=True)
+    return profile_dir, num_bytes
+
+
+def release_profile(driver):
+    """删除driver使用的profile目录(由Crawler创建时才有)，需要在浏览器退出之后调用"""
+    profile_dir = getattr(driver, 'profile_dir', None)
+    if profile_dir is not None:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+
+class BrowserCache:
+    def __init__(self, profile_template=None, disk_cache_mb=0):
+        if profile_template is not None and not os.path.isdir(profile_template):
+            raise FileNotFoundError(f"profile template not found: {profile_template}")
+        self.profile_template = profile_template
+        self.disk_cache_mb = disk_cache_mb  # 每个浏览器的磁盘缓存上限(MB)，0表示使用Chrome的默认值
+        self.num_copies = 0
+        self.copy_bytes = 0
+        self.copy_seconds = 0
+
+    def chromeArgs(self):
+        args = [f"--disable-features={','.join(DISABLED_FEATURES)}"]
+        if self.disk_cache_mb:
+            args.append(f'--disk-cache-size={self.disk_cache_mb << 20}')
+        return args
+
+    def newProfile(self, prefix='seeclick_profile_'):
+        """创建一个新的profile目录，并记录复制模板的开销"""
+        start = time.monotonic()
+        profile_dir, num_bytes = create_profile(self.profile_template, prefix)
+        self.num_copies += 1
+        self.copy_bytes += num_bytes
+        self.copy_seconds += time.monotonic() - start
+        return profile_dir
+
+    def profileStats(self):
+        return {
+            "profile_copies": self.num_copies,
+            "profile_copy_bytes": self.copy_bytes,
+            "profile_copy_seconds": round(self.copy_seconds, 3),
+        }
+
+
+class CacheStats:
+    """根据Network事件统计缓存命中：磁盘缓存的命中在responseReceived中带有fromDiskCache，内存缓存的命中有单独的事件"""
+
+    def __init__(self):
+        self.counts = Counter()  # responses, from_cache, bytes_from_cache, bytes_network
+        self.cached = set()
+        self.data_length = Counter()
+
+    def onNetworkEvent(self, method, params):
+        request_id = params.get('requestId')
+        if method == 'Network.requestServedFromCache':
+            self.cached.add(request_id)
+        elif method == 'Network.responseReceived':
+            self.counts['responses'] += 1
+            response = params.get('response', {})
+            if response.get('fromDiskCache') or response.get('fromPrefetchCache') or request_id in self.cached:
+                self.cached.add(request_id)
+                self.counts['from_cache'] += 1
+        elif method == 'Network.dataReceived':
+            self.data_length[request_id] += params.get('dataLength', 0)
+        elif method == 'Network.loadingFinished':
+            # 从缓存读取的响应没有网络传输，字节数按解码后的数据长度计算
+            if request_id in self.cached:
+                self.counts['bytes_from_cache'] += self.data_length.get(request_id, 0)
+            else:
+                self.counts['bytes_network'] += int(params.get('encodedDataLength', 0))
+            self.data_length.pop(request_id, None)
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+
+    def report(self):
+        responses = self.counts['responses']
+        return {
+            "responses": responses,
+            "from_cache": self.counts['from_cache'],
+            "hit_ratio": round(self.counts['from_cache'] / responses, 4) if responses else 0,
+            "bytes_from_cache": self.counts['bytes_from_cache'],
+            "bytes_network": self.counts['bytes_network'],
+        }
+
+
+async def warm_template(chrome_path, template_dir, urls, disk_cache_mb=DEFAULT_TEMPLATE_CACHE_MB, nogui=True,
+                        load_timeout=30):
+    """依次访问urls，把资源写入template_dir中的HTTP缓存"""
+    from cdp_crawler import CDPConnection, CDPPage, ChromeProcess
+
+    os.makedirs(template_dir, exist_ok=True)
+    chrome = ChromeProcess(chrome_path, 1920, 1080, nogui, BrowserCache(None, disk_cache_mb).chromeArgs(),
+                           user_data_dir=template_dir)
+    connection = await CDPConnection.connect(await chrome.start())
+    num_loaded = 0
+    try:
+        for url in urls:
+            target = await connection.send("Target.createTarget", {"url": "about:blank"})
+            attached = await connection.send("Target.attachToTarget",
+                                             {"targetId": target['targetId'], "flatten": True})
+            page = CDPPage(connection, target['targetId'], attached['sessionId'])
+            loaded = asyncio.get_event_loop().create_future()
+
+            def onLoad(params, loaded=loaded):
+                if not loaded.done():
+                    loaded.set_result(True)
+
+            page.on("Page.loadEventFired", onLoad)
+            try:
+                await page.send("Page.enable")
+                await page.send("Page.navigate", url=url)
+                await asyncio.wait_for(loaded, load_timeout)
+                num_loaded += 1
+            except Exception as exp:
+                print(f"failed to load {url}: {exp}")
+            finally:
+                await page.close()
+    finally:
+        await connection.close()
+        await chrome.stop()
+    return num_loaded
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="访问一批常见页面，生成带有热HTTP缓存的profile模板")
+    parser.add_argument("--template_dir", type=str, required=True)
+    parser.add_argument("--url_file", type=str, required=True, help="每行一个URL，通常是使用了常见CDN资源的热门页面")
+    parser.add_argument("--chrome_path", type=str, default='google-chrome')
+    parser.add_argument("--disk_cache_mb", type=int, default=DEFAULT_TEMPLATE_CACHE_MB,
+                        help="模板中缓存的大小上限(MB)，每次启动浏览器都要复制整个模板，不宜过大")
+    parser.add_argument("--load_timeout", type=float, default=30)
+    args = parser.parse_args()
+    with open(args.url_file, 'r', encoding='utf-8') as url_file:
+        urls = [line.strip() for line in url_file if line.strip()]
+    loaded = asyncio.run(warm_template(args.chrome_path, args.template_dir, urls, args.disk_cache_mb,
+                                       load_timeout=args.load_timeout))
+    print(f"loaded {loaded}/{len(urls)} pages into {args.template_dir}")
@@ -0,0 +1,272 @@
+"""浏览器生命周期管理：根据健康状况回收浏览器，而不是每隔固定数量的URL重启一次
+
+每处理完一个URL检查一次：
+* Chrome进程树(chromedriver及其所有子进程)的RSS是否超过上限
+* 是否发生了renderer崩溃
+* 是否连续多个URL超时
+* (可选)单个浏览器处理的URL数是否达到上限
+* 看门狗是否因为单个URL超过总时间预算而杀掉了浏览器
+超过阈值时换上一个预先启动好的备用浏览器，旧浏览器在后台线程中退出，再在后台启动新的备用浏览器，
+因此回收浏览器时爬虫线程几乎不需要等待。
+
+WebDriver的调用卡住时(例如无限执行的脚本、永远不结束的响应)爬虫线程无法自己恢复，
+URLWatchdog 在另一个线程中计时，超过预算时直接杀掉chromedriver及Chrome的整个进程树，
+卡住的WebDriver调用随即抛出异常，之后由BrowserManager换上新的浏览器。
+"""
+import json
+import threading
+import time
+from collections import Counter
+
+import psutil
+from selenium.common.exceptions import ScriptTimeoutException, TimeoutException, WebDriverException
+
+from browser_cache import release_profile
+
+# renderer崩溃或浏览器失联时chromedriver返回的错误信息
+CRASH_MESSAGES = ('tab crashed', 'page crash', 'chrome not reachable', 'session deleted', 'disconnected',
+                  'invalid session id')
+
+OK = 'ok'
+TIMEOUT = 'timeout'
+CRASH = 'crash'
+ERROR = 'error'
+KILLED = 'killed'  # 超过单个URL的时间预算，被看门狗杀掉
+DUPLICATE = 'duplicate'  # 近似重复的页面，页面本身正常加载但没有保存
+
+
+def classify_exception(exp):
+    if isinstance(exp, (TimeoutException, ScriptTimeoutException)):
+        return TIMEOUT
+    if isinstance(exp, WebDriverException):
+        message = str(exp).lower()
+        if any(text in message for text in CRASH_MESSAGES):
+            return CRASH
+    return ERROR
+
+
+def process_tree_rss(pid):
+    """pid及其所有子进程的RSS之和(字节)"""
+    try:
+        root = psutil.Process(pid)
+        processes = [root] + root.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return total
+
+
+def driver_pid(driver):
+    return driver.service.process.pid
+
+
+def kill_process_tree(pid):
+    """杀掉pid及其所有子进程"""
+    try:
+        root = psutil.Process(pid)
+        processes = root.children(recursive=True) + [root]
+    except psutil.NoSuchProcess:
+        return
+    for process in processes:
+        try:
+            process.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+
+class URLWatchdog:
+    """单个URL的总时间预算：arm之后budget秒内没有disarm，就杀掉对应的浏览器进程树"""
+
+    def __init__(self, budget, logger=None):
+        self.budget = budget
+        self.logger = logger
+        self.condition = threading.Condition()
+        self.deadline = None
+        self.pid = None
+        self.fired = False
+        self.num_fired = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def arm(self, pid):
+        with self.condition:
+            self.deadline = time.monotonic() + self.budget
+            self.pid = pid
+            self.fired = False
+            self.condition.notify()
+
+    def disarm(self):
+        """停止计时，返回这段时间内看门狗是否杀掉了浏览器
+
+        看门狗可能在URL刚刚处理完、还没有disarm时超时，此时浏览器被杀掉但结果是完整的，
+        调用方应根据URL本身是否正常完成来判断结果，返回值只说明浏览器是否需要更换
+        """
+        with self.condition:
+            self.deadline = None
+            self.pid = None
+            return self.fired
+
+    def __run(self):
+        with self.condition:
+            while not self.closed:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = self.deadline - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                # 持有锁时杀进程，保证disarm返回时能看到fired
+                if self.logger:
+                    self.logger.warning(f"url budget of {self.budget}s exceeded, kill browser process tree {self.pid}")
+                kill_process_tree(self.pid)
+                self.deadline = None
+                self.fired = True
+                self.num_fired += 1
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+
+class OutcomeLog:
+    """逐行记录每个URL的处理结果(ok/timeout/killed/crash/error)和耗时"""
+
+    def __init__(self, path):
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def record(self, url, outcome, elapsed=None):
+        elapsed_ms = round(elapsed * 1000) if elapsed is not None else None
+        self.file.write(json.dumps({"url": url, "outcome": outcome, "elapsed_ms": elapsed_ms}) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class BrowserManager:
+    def __init__(self, crawler, max_rss_mb=2048, max_consecutive_timeouts=3, max_urls=1000, keep_spare=True,
+                 logger=None):
+        self.crawler = crawler
+        self.max_rss = max_rss_mb << 20
+        self.max_consecutive_timeouts = max_consecutive_timeouts
+        self.max_urls = max_urls  # 为0时不按URL数回收
+        self.keep_spare = keep_spare
+        self.logger = logger
+        self.consecutive_timeouts = 0
+        self.urls_on_browser = 0
+        self.last_rss = 0
+        self.restarts = Counter()
+        self.outcomes = Counter()
+        self.spare = None
+        self.spare_thread = None
+        if keep_spare:
+            self.__launchSpare()
+
+    def log(self, message):
+        if self.logger:
+            self.logger.info(message)
+        else:
+            print(message)
+
+    def __launchSpare(self):
+        def launch():
+            try:
+                self.spare = self.crawler.newDriver()
+            except Exception as exp:
+                self.spare = None
+                self.log(f"failed to launch spare browser: {exp}")
+
+        self.spare_thread = threading.Thread(target=launch, daemon=True)
+        self.spare_thread.start()
+
+    def __takeSpare(self):
+        if self.spare_thread is not None:
+            self.spare_thread.join()
+            self.spare_thread = None
+        spare, self.spare = self.spare, None
+        return spare
+
+    def afterURL(self, outcome, browser_killed=False):
+        """记录一个URL的处理结果，必要时回收浏览器，返回回收的原因(没有回收时返回None)
+
+        browser_killed表示看门狗已经杀掉了浏览器，此时即使URL已经正常完成也要换一个浏览器
+        """
+        self.outcomes[outcome] += 1
+        self.urls_on_browser += 1
+        if outcome == TIMEOUT:
+            self.consecutive_timeouts += 1
+        elif outcome in (OK, DUPLICATE):
+            self.consecutive_timeouts = 0
+
+        reason = None
+        if outcome == KILLED or browser_killed:
+            reason = 'killed'
+        elif outcome == CRASH:
+            reason = 'crash'
+        elif self.consecutive_timeouts >= self.max_consecutive_timeouts:
+            reason = 'timeouts'
+        elif self.max_urls and self.urls_on_browser >= self.max_urls:
+            reason = 'max_urls'
+        else:
+            self.last_rss = process_tree_rss(driver_pid(self.crawler.driver))
+            if self.last_rss > self.max_rss:
+                reason = 'rss'
+        if reason is not None:
+            self.recycle(reason)
+        return reason
+
+    def recycle(self, reason):
+        self.log(f"recycle browser, reason: {reason}, rss: {self.last_rss >> 20}MB, "
+                 f"urls on browser: {self.urls_on_browser}")
+        new_driver = self.__takeSpare() if self.keep_spare else None
+        if new_driver is None:
+            new_driver = self.crawler.newDriver()
+        old_driver = self.crawler.swapDriver(new_driver)
+        threading.Thread(target=self.__quitDriver, args=(old_driver,), daemon=True).start()
+        self.restarts[reason] += 1
+        self.consecutive_timeouts = 0
+        self.urls_on_browser = 0
+        if self.keep_spare:
+            self.__launchSpare()
+
+    @staticmethod
+    def __quitDriver(driver):
+        try:
+            root = psutil.Process(driver_pid(driver))
+            processes = root.children(recursive=True) + [root]
+        except psutil.NoSuchProcess:
+            processes = []
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        # 浏览器卡死时quit可能无法退出全部进程，把剩下的进程杀掉
+        for process in processes:
+            try:
+                if process.is_running():
+                    process.kill()
+            except psutil.NoSuchProcess:
+                pass
+        release_profile(driver)
+
+    def stats(self):
+        return {
+            "restarts": sum(self.restarts.values()),
+            "restart_reasons": dict(self.restarts),
+            "outcomes": dict(self.outcomes),
+            "rss_mb": self.last_rss >> 20,
+        }
+
+    def close(self):
+        spare = self.__takeSpare()
+        if spare is not None:
+            self.__quitDriver(spare)
@@ -0,0 +1,527 @@
+"""基于Chrome DevTools Protocol的异步爬虫引擎
+
+与 crawel.Crawler 不同，这里不经过chromedriver，而是直接通过websocket和Chrome通信。
+一个Chrome进程中同时打开多个tab，每个tab处理一个URL，由 max_tabs 控制并发的页面数。
+processURL 返回的结果与 Crawler.processURL 完全一致。
+"""
+import asyncio
+import base64
+import itertools
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import websockets
+
+from image_pipeline import ScreenshotWriter
+from extractor import build_extract_expression, build_extract_options, clickable_records, hover_records
+from readiness import NetworkTracker, ReadinessWaiter, build_probe_expression, build_strategies
+from resource_policy import BlockStats
+from metrics import PhaseTimer
+from near_dup import NearDuplicate, build_fingerprint_expression
+from browser_cache import CacheStats, create_profile, merge_feature_args
+from utils import generate_url_hash
+
+
+class CDPError(Exception):
+    pass
+
+
+class CDPConnection:
+    """一个到浏览器的websocket连接，使用flatten模式让所有tab共用这一个连接"""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._listeners = {}  # (session_id, method) -> [callback]
+        self._reader = asyncio.ensure_future(self._readLoop())
+
+    @classmethod
+    async def connect(cls, ws_url):
+        ws = await websockets.connect(ws_url, max_size=None, ping_interval=None)
+        return cls(ws)
+
+    async def _readLoop(self):
+        try:
+            async for raw in self.ws:
+                message = json.loads(raw)
+                if 'id' in message:
+                    future = self._pending.pop(message['id'], None)
+                    if future is None or future.done():
+                        continue
+                    if 'error' in message:
+                        future.set_exception(CDPError(message['error'].get('message', str(message['error']))))
+                    else:
+                        future.set_result(message.get('result', {}))
+                else:
+                    key = (message.get('sessionId'), message.get('method'))
+                    for callback in list(self._listeners.get(key, [])):
+                        callback(message.get('params', {}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(CDPError("connection closed"))
+            self._pending.clear()
+
+    async def send(self, method, params=None, session_id=None):
+        msg_id = next(self._ids)
+        message = {"id": msg_id, "method": method, "params": params or {}}
+        if session_id is not None:
+            message["sessionId"] = session_id
+        future = asyncio.get_event_loop().create_future()
+        self._pending[msg_id] = future
+        await self.ws.send(json.dumps(message))
+        return await future
+
+    def on(self, method, callback, session_id=None):
+        self._listeners.setdefault((session_id, method), []).append(callback)
+
+    def off(self, method, callback, session_id=None):
+        callbacks = self._listeners.get((session_id, method), [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self._listeners.pop((session_id, method), None)
+
+    @property
+    def closed(self):
+        # 读循环在websocket断开后结束
+        return self._reader.done()
+
+    def removeSession(self, session_id):
+        for key in [key for key in self._listeners if key[0] == session_id]:
+            del self._listeners[key]
+
+    async def close(self):
+        await self.ws.close()
+        await self._reader
+
+
+class CDPPage:
+    """一个tab对应的会话"""
+
+    def __init__(self, connection, target_id, session_id):
+        self.connection = connection
+        self.target_id = target_id
+        self.session_id = session_id
+
+    async def send(self, method, **params):
+        return await self.connection.send(method, params, session_id=self.session_id)
+
+    def on(self, method, callback):
+        self.connection.on(method, callback, session_id=self.session_id)
+
+    def off(self, method, callback):
+        self.connection.off(method, callback, session_id=self.session_id)
+
+    async def evaluate(self, expression):
+        result = await self.send("Runtime.evaluate", expression=expression, returnByValue=True, awaitPromise=True)
+        if 'exceptionDetails' in result:
+            raise CDPError(result['exceptionDetails'].get('text', 'evaluate failed'))
+        return result['result'].get('value')
+
+    async def close(self):
+        try:
+            await self.connection.send("Target.closeTarget", {"targetId": self.target_id})
+        finally:
+            self.connection.removeSession(self.session_id)
+
+
+class ChromeProcess:
+    """启动一个开启了远程调试端口的Chrome进程"""
+
+    def __init__(self, chrome_path, width, height, nogui=True, extra_args=None, browser_cache=None,
+                 user_data_dir=None):
+        self.chrome_path = chrome_path
+        self.width = width
+        self.height = height
+        self.nogui = nogui
+        self.extra_args = extra_args or []
+        self.browser_cache = browser_cache  # 指定时临时profile从预热的模板复制
+        self.persistent_dir = user_data_dir  # 指定时直接使用该目录，退出后保留(用于预热模板)
+        self.process = None
+        self.user_data_dir = None
+
+    async def start(self, startup_timeout=30):
+        if self.persistent_dir is not None:
+            self.user_data_dir = self.persistent_dir
+            # 上一次运行留下的端口文件会被误认为已经启动
+            if os.path.exists(os.path.join(self.user_data_dir, "DevToolsActivePort")):
+                os.remove(os.path.join(self.user_data_dir, "DevToolsActivePort"))
+        elif self.browser_cache is not None:
+            self.user_data_dir = self.browser_cache.newProfile(prefix="cdp_profile_")
+        else:
+            self.user_data_dir, _ = create_profile(prefix="cdp_profile_")
+        args = ["--remote-debugging-port=0", f"--user-data-dir={self.user_data_dir}",
+                "--no-first-run", "--no-default-browser-check", "--disable-extensions",
+                "--disable-background-networking", "--mute-audio",
+                f"--window-size={self.width},{self.height}"]
+        if self.nogui:
+            args += ["--headless=new", "--disable-gpu", "--no-sandbox", "--disable-dev-shm-usage"]
+        args = merge_feature_args(args + self.extra_args)
+        args.append("about:blank")
+        self.process = await asyncio.create_subprocess_exec(self.chrome_path, *args,
+                                                            stdout=asyncio.subprocess.DEVNULL,
+                                                            stderr=asyncio.subprocess.DEVNULL)
+        # Chrome启动后会把实际端口和browser的websocket路径写到DevToolsActivePort里
+        port_file = os.path.join(self.user_data_dir, "DevToolsActivePort")
+        deadline = time.monotonic() + startup_timeout
+        while time.monotonic() < deadline:
+            if os.path.exists(port_file):
+                with open(port_file, 'r', encoding='utf-8') as file:
+                    lines = file.read().split('\n')
+                if len(lines) >= 2 and lines[1]:
+                    return f"ws://127.0.0.1:{lines[0].strip()}{lines[1].strip()}"
+            if self.process.returncode is not None:
+                break
+            await asyncio.sleep(0.1)
+        await self.stop()
+        raise CDPError("chrome failed to start")
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def stop(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), 10)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+        if self.user_data_dir is not None and self.persistent_dir is None:
+            shutil.rmtree(self.user_data_dir, ignore_errors=True)
+        self.user_data_dir = None
+
+
+class AsyncCrawler:
+    def __init__(self, chrome_path, img_dir, width, height, wait_timeout, logger=None, draw_box=False,
+                 scrape_hover=False, nogui=True, max_tabs=8, readiness='sleep', readiness_deadline=10,
+                 image_format='png', image_quality=90, image_workers=2, output=None, resource_policy=None,
+                 page_load_timeout=None, url_budget=None, metrics=None, element_log_every=100, dedup=None,
+                 browser_cache=None, network_idle_inflight=2, network_idle_ms=500):
+        self.chrome_path = chrome_path
+        self.img_dir = img_dir
+        self.width = width
+        self.height = height
+        self.wait_timeout = wait_timeout
+        self.logger = logger
+        self.draw_box = draw_box
+        self.scrape_hover = scrape_hover
+        self.nogui = nogui
+        self.max_tabs = max_tabs
+        self.page_load_timeout = page_load_timeout or wait_timeout * 3  # 导航的超时(秒)
+        self.url_budget = url_budget  # 单个URL的总时间预算(秒)，超过后关闭tab，None表示不限制
+        os.makedirs(img_dir, exist_ok=True)
+        self.additional_timeout = 2
+        self.readiness = readiness
+        self.readiness_deadline = readiness_deadline
+        self.network_idle_inflight = network_idle_inflight
+        self.network_idle_ms = network_idle_ms
+        self.box_color = (255, 0, 0)
+        self.output = output
+        self.metrics = metrics
+        self.screenshot_writer = ScreenshotWriter(image_format, image_quality, num_workers=image_workers,
+                                                  logger=logger, sink=output.writeImage if output else None,
+                                                  metrics=metrics)
+        self.element_log_every = element_log_every  # 逐元素的日志抽样输出
+        self.num_elements_seen = 0
+        # near_dup.NearDupFilter；查询要在共享索引上加写锁，与其它worker竞争时可能等待很久，
+        # 放到单独的一个线程里调用，不阻塞事件循环，同时保证sqlite连接同一时间只被一个线程使用
+        self.dedup = dedup
+        self.dedup_executor = ThreadPoolExecutor(max_workers=1) if dedup is not None else None
+        self.resource_policy = resource_policy if resource_policy is not None and resource_policy.enabled else None
+        self.chrome_args = self.resource_policy.chromeArgs() if self.resource_policy else []
+        # 浏览器的profile从预热的模板复制，并统计缓存命中；cache_totals为所有页面的汇总
+        self.browser_cache = browser_cache
+        self.cache_totals = CacheStats()
+        if browser_cache is not None:
+            self.chrome_args = self.chrome_args + browser_cache.chromeArgs()
+        self.chrome = ChromeProcess(chrome_path, width, height, nogui, self.chrome_args, browser_cache)
+        self.connection = None
+        self.generation = 0  # 每重启一次浏览器加1
+        self.num_restarts = 0
+
+    def log(self, message):
+        if self.logger:
+            self.logger.info(message)
+        else:
+            print(message)
+
+    async def start(self):
+        ws_url = await self.chrome.start()
+        self.connection = await CDPConnection.connect(ws_url)
+
+    async def stop(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+        await self.chrome.stop()
+
+    async def quit(self):
+        await self.stop()
+        await asyncio.get_event_loop().run_in_executor(None, self.screenshot_writer.close)
+        if self.dedup_executor is not None:
+            self.dedup_executor.shutdown()
+
+    async def restart(self):
+        self.log("restart browser")
+        await self.stop()
+        self.chrome = ChromeProcess(self.chrome_path, self.width, self.height, self.nogui, self.chrome_args,
+                                    self.browser_cache)
+        await self.start()
+        self.generation += 1
+        self.num_restarts += 1
+
+    @property
+    def alive(self):
+        return self.connection is not None and not self.connection.closed and self.chrome.alive
+
+    async def recover(self, lock, generation):
+        """Chrome崩溃或者连接断开时重启浏览器；多个tab同时发现时，只有第一个重启"""
+        async with lock:
+            if self.generation == generation and not self.alive:
+                await self.restart()
+
+    async def newPage(self):
+        target = await self.connection.send("Target.createTarget", {"url": "about:blank"})
+        attached = await self.connection.send("Target.attachToTarget",
+                                              {"targetId": target['targetId'], "flatten": True})
+        page = CDPPage(self.connection, target['targetId'], attached['sessionId'])
+        await page.send("Page.enable")
+        await page.send("Emulation.setDeviceMetricsOverride", width=self.width, height=self.height,
+                        deviceScaleFactor=1, mobile=False)
+        return page
+
+    async def applyResourcePolicy(self, page, network, block_stats):
+        """在导航之前设置资源拦截：域名黑名单用Network.setBlockedURLs，资源类型和响应大小用Fetch拦截"""
+        policy = self.resource_policy
+        network.listeners.append(block_stats.onNetworkEvent)
+        domain_patterns = policy.domainPatterns()
+        if domain_patterns:
+            await page.send("Network.setBlockedURLs", urls=domain_patterns)
+        fetch_patterns = policy.fetchPatterns()
+        if not fetch_patterns:
+            return
+
+        async def handlePaused(params):
+            resource_type = params.get('resourceType')
+            try:
+                if 'responseStatusCode' not in params and 'responseErrorReason' not in params:
+                    # 请求阶段暂停的只有需要拦截的资源类型
+                    block_stats.add(resource_type)
+                    await page.send("Fetch.failRequest", requestId=params['requestId'], errorReason='BlockedByClient')
+                    return
+                too_large = policy.responseTooLarge(params.get('responseHeaders'))
+                if too_large is not None:
+                    block_stats.add(resource_type, too_large)
+                    await page.send("Fetch.failRequest", requestId=params['requestId'], errorReason='BlockedByClient')
+                else:
+                    await page.send("Fetch.continueRequest", requestId=params['requestId'])
+            except CDPError:
+                pass  # tab已经关闭
+
+        page.on("Fetch.requestPaused", lambda params: asyncio.ensure_future(handlePaused(params)))
+        await page.send("Fetch.enable", patterns=fetch_patterns)
+
+    async def accessURL(self, page, url):
+        self.log("access url: {}".format(url))
+        loaded = asyncio.get_event_loop().create_future()
+
+        def onLoad(params):
+            if not loaded.done():
+                loaded.set_result(True)
+
+        page.on("Page.loadEventFired", onLoad)
+        try:
+            result = await page.send("Page.navigate", url=url)
+            if result.get('errorText'):
+                raise CDPError(f"navigate to {url} failed: {result['errorText']}")
+            await loaded
+        finally:
+            page.off("Page.loadEventFired", onLoad)
+
+    async def waitForElement(self, page, xpath):
+        """等价于 WebDriverWait(...).until(presence_of_element_located(...))"""
+        expression = ("document.evaluate(%s, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null)"
+                      ".singleNodeValue !== null") % json.dumps(xpath)
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            if await page.evaluate(expression):
+                return
+            if time.monotonic() >= deadline:
+                raise asyncio.TimeoutError(f"no element matches {xpath}")
+            await asyncio.sleep(0.5)
+
+    def newReadinessWaiter(self):
+        # 每个tab各自维护策略状态，因此每个页面单独构造一个waiter
+        strategies = build_strategies(self.readiness, self.readiness_deadline, self.additional_timeout,
+                                      self.network_idle_inflight, self.network_idle_ms)
+        return ReadinessWaiter(strategies, deadline=self.readiness_deadline)
+
+    async def waitUntilReady(self, page, waiter, network):
+        waiter.begin()
+        probe = build_probe_expression()
+        while True:
+            snapshot = await page.evaluate(probe)
+            snapshot['inflight'] = network.count
+            if waiter.poll(snapshot):
+                return waiter.report()
+            await asyncio.sleep(waiter.poll_interval)
+
+    async def extractElements(self, page):
+        options = build_extract_options(self.width, self.height, self.scrape_hover)
+        extracted = await page.evaluate(build_extract_expression(options))
+        results = clickable_records(extracted['clickable'], self.width, self.height)
+        if self.scrape_hover:
+            results.extend(hover_records(extracted['titled'], self.width, self.height))
+        return results
+
+    async def processURL(self, url, save_name=None):
+        if save_name is None:
+            save_name = generate_url_hash(url)
+        if self.output is not None:
+            save_path = self.output.imagePath(save_name, self.screenshot_writer.extension)
+        else:
+            save_path = os.path.join(self.img_dir, save_name + self.screenshot_writer.extension)
+        page = await self.newPage()
+        waiter = self.newReadinessWaiter()
+        network = NetworkTracker()
+        block_stats = BlockStats() if self.resource_policy is not None else None
+        cache_stats = None
+        methods = ['Network.requestWillBeSent', 'Network.loadingFinished', 'Network.loadingFailed']
+        if self.browser_cache is not None:
+            cache_stats = CacheStats()
+            network.listeners.append(cache_stats.onNetworkEvent)
+            methods += ['Network.requestServedFromCache', 'Network.responseReceived', 'Network.dataReceived']
+        if waiter.needs_network or block_stats is not None or cache_stats is not None:
+            for method in methods:
+                page.on(method, lambda params, method=method: network.onEvent(method, params))
+            await page.send("Network.enable")
+        timer = PhaseTimer(self.metrics)
+        outcome = 'error'
+        try:
+            readiness, results = await self.loadAndCapture(page, url, save_path, waiter, network, block_stats,
+                                                           cache_stats, timer)
+            outcome = 'ok'
+        except NearDuplicate:
+            outcome = 'duplicate'
+            raise
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            # 导航超时，或者超过总时间预算被取消
+            outcome = 'timeout'
+            raise
+        finally:
+            # 失败和超时的URL也要计入各阶段的耗时
+            timings = timer.finish(outcome)
+        for result in results:
+            result['url'] = url
+            result['image_path'] = save_path
+            result['viewport'] = [self.width, self.height]
+            result['readiness'] = readiness
+            result['timings'] = timings
+            if block_stats is not None:
+                result['blocked'] = block_stats.report()
+            if cache_stats is not None:
+                result['cache'] = cache_stats.report()
+            self.num_elements_seen += 1
+            if self.logger and self.num_elements_seen % self.element_log_every == 0:
+                self.logger.debug(result)
+        return results
+
+    async def loadAndCapture(self, page, url, save_path, waiter, network, block_stats, cache_stats, timer):
+        """导航、等待就绪、提取元素并提交截图，返回 (就绪检测的结果, 元素记录)；结束时关闭tab"""
+        try:
+            if block_stats is not None:
+                await self.applyResourcePolicy(page, network, block_stats)
+            with timer.phase('navigate'):
+                # Selenium的driver.get会一直等到load事件，这里给导航加一个上限，避免tab一直被占用
+                await asyncio.wait_for(self.accessURL(page, url), self.page_load_timeout)
+                await self.waitForElement(page, "//div")
+            with timer.phase('readiness'):
+                readiness = await self.waitUntilReady(page, waiter, network)
+            if self.dedup is not None:
+                with timer.phase('dedup'):
+                    fingerprint = await page.evaluate(build_fingerprint_expression())
+                    await asyncio.get_event_loop().run_in_executor(self.dedup_executor, self.dedup.checkDom,
+                                                                   fingerprint, url)
+
+            with timer.phase('extract'):
+                results = await self.extractElements(page)
+
+            # 最后保存截图，防止保存到空白的
+            with timer.phase('screenshot'):
+                screenshot = await page.send("Page.captureScreenshot", format="png")
+        finally:
+            await page.close()
+            if cache_stats is not None:
+                self.cache_totals.merge(cache_stats)
+
+        png_bytes = base64.b64decode(screenshot['data'])
+        if self.dedup is not None:
+            with timer.phase('dedup'):
+                await asyncio.get_event_loop().run_in_executor(self.dedup_executor, self.dedup.checkImage,
+                                                               png_bytes, url)
+        with timer.phase('screenshot'):
+            boxes = [(result['left-top'], result['size']) for result in results] if self.draw_box else None
+            # submit在后处理积压时会阻塞，放到线程里调用以免卡住其它tab
+            await asyncio.get_event_loop().run_in_executor(None, self.screenshot_writer.submit, png_bytes,
+                                                           save_path, (self.width, self.height), boxes,
+                                                           self.box_color)
+        return readiness, results
+
+    async def crawl(self, urls, on_result, on_error=None):
+        """并发处理urls，同时最多打开max_tabs个tab
+
+        每处理完一个URL调用一次on_result(url, results, elapsed)，失败时调用on_error(url, exp, elapsed)，
+        elapsed为该URL从拿到tab开始的耗时(秒)，不包括排队等待tab的时间
+        """
+        semaphore = asyncio.Semaphore(self.max_tabs)
+        restart_lock = asyncio.Lock()
+
+        async def processOne(url):
+            async with semaphore:
+                start = time.monotonic()
+                generation = self.generation
+                try:
+                    if not self.alive:
+                        await self.recover(restart_lock, generation)
+                        generation = self.generation
+                    # 超过总时间预算时取消processURL，取消时会关闭tab，卡住的renderer随tab一起结束
+                    results = await asyncio.wait_for(self.processURL(url), self.url_budget)
+                except Exception as exp:
+                    if self.dedup is not None:
+                        # 页面没有保存，归还它在近似重复簇中占用的名额
+                        await asyncio.get_event_loop().run_in_executor(self.dedup_executor, self.dedup.release, url)
+                    if not self.alive:
+                        # 浏览器已经不可用，重启之后剩下的URL才能继续；当前URL记为失败
+                        try:
+                            await self.recover(restart_lock, generation)
+                        except Exception as restart_exp:
+                            self.log(f"failed to restart browser: {restart_exp}")
+                    if on_error is not None:
+                        on_error(url, exp, time.monotonic() - start)
+                    return
+                on_result(url, results, time.monotonic() - start)
+
+        def collect(done):
+            # on_result/on_error中的异常(例如写输出或进度日志失败)不能被吞掉
+            for task in done:
+                task.result()
+
+        pending = set()
+        for url in urls:
+            # 控制同时存在的task数量，避免一次性为所有URL创建task
+            if len(pending) >= self.max_tabs * 2:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                collect(done)
+            pending.add(asyncio.ensure_future(processOne(url)))
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            collect(done)
@@ -0,0 +1,211 @@
+"""多进程读取并过滤CDX
+
+CDX每一行的JSON中带有抓取时的状态码、MIME类型、语言等信息，原来只取出URL，
+404、重定向、PDF以及不需要的语言的页面都要占用一次浏览器。这里在读取CDX时就按这些字段过滤：
+* 主进程按块读取原始字节(支持gzip)，子进程负责解码、解析JSON和判断过滤条件，只把保留的行传回来
+* 每个过滤条件分别统计丢弃的行数，结束时给出每秒处理的行数
+输入可以是一个文件、一个目录(其中所有文件按文件名排序)或者一个glob模式，多个分片依次读取。
+结果的顺序与逐行读取完全一致，因此与seed相关的随机选择不受进程数影响。
+"""
+import glob
+import gzip
+import json
+import multiprocessing
+import os
+import re
+import time
+from collections import Counter
+
+from tqdm import tqdm
+
+from utils import parse_cdx_line
+
+BLOCK_BYTES = 4 << 20
+
+PREDICATES = ('parse', 'status', 'mime', 'language', 'url_exclude')
+
+
+class CDXFilter:
+    """CDX行的过滤条件，条件为空时不检查；check返回第一个不满足的条件名，全部满足时返回None"""
+
+    def __init__(self, statuses=None, mimes=None, languages=None, exclude_patterns=None):
+        self.statuses = set(statuses) if statuses else None
+        self.mimes = set(mimes) if mimes else None
+        self.languages = set(languages) if languages else None
+        self.exclude = re.compile('|'.join(f'(?:{pattern})' for pattern in exclude_patterns)) \
+            if exclude_patterns else None
+
+    @classmethod
+    def fromOptions(cls, statuses='', mimes='', languages='', exclude_file=None):
+        """由命令行参数构造，前三项为逗号分隔的列表，exclude_file中每行一个URL正则"""
+        def split(value):
+            return [item.strip() for item in value.split(',') if item.strip()]
+
+        exclude_patterns = None
+        if exclude_file:
+            with open(exclude_file, 'r', encoding='utf-8') as file:
+                exclude_patterns = [line.strip() for line in file if line.strip() and not line.startswith('#')]
+        return cls(split(statuses), split(mimes), split(languages), exclude_patterns)
+
+    @property
+    def enabled(self):
+        return any(value is not None for value in (self.statuses, self.mimes, self.languages, self.exclude))
+
+    def setting(self):
+        """可以写入JSON的过滤条件，用于判断已有的任务是否由相同的条件生成"""
+        return {"statuses": sorted(self.statuses) if self.statuses else None,
+                "mimes": sorted(self.mimes) if self.mimes else None,
+                "languages": sorted(self.languages) if self.languages else None,
+                "exclude": self.exclude.pattern if self.exclude else None}
+
+    def check(self, fields):
+        if self.statuses is not None and fields.get('status') not in self.statuses:
+            return 'status'
+        if self.mimes is not None:
+            # mime-detected 是根据内容识别的类型，比服务器声明的mime可靠
+            mime = fields.get('mime-detected') or fields.get('mime')
+            if mime not in self.mimes:
+                return 'mime'
+        if self.languages is not None:
+            # languages 形如 "eng,deu"，没有该字段的行也丢弃
+            if not self.languages.intersection(fields.get('languages', '').split(',')):
+                return 'language'
+        if self.exclude is not None and self.exclude.search(fields.get('url', '')):
+            return 'url_exclude'
+        return None
+
+
+class CDXStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lines = 0
+        self.kept = 0
+        self.dropped = Counter()
+        self.start = time.monotonic()
+        self.elapsed = 0
+
+    def update(self, lines, kept, dropped):
+        self.lines += lines
+        self.kept += kept
+        self.dropped.update(dropped)
+        self.elapsed = time.monotonic() - self.start
+
+    def report(self):
+        return {
+            "lines": self.lines,
+            "kept": self.kept,
+            "dropped": {name: self.dropped[name] for name in PREDICATES if self.dropped[name]},
+            "seconds": round(self.elapsed, 3),
+            "lines_per_s": round(self.lines / self.elapsed) if self.elapsed else 0,
+        }
+
+
+def expand_cdx_paths(cdx_path):
+    if os.path.isdir(cdx_path):
+        return sorted(os.path.join(cdx_path, name) for name in os.listdir(cdx_path)
+                      if os.path.isfile(os.path.join(cdx_path, name)))
+    if os.path.exists(cdx_path):
+        return [cdx_path]
+    paths = sorted(glob.glob(cdx_path))
+    if not paths:
+        raise FileNotFoundError(cdx_path)
+    return paths
+
+
+def iter_blocks(path, block_bytes=BLOCK_BYTES):
+    """按块读取文件的原始字节，每块都在换行处结束"""
+    with open(path, 'rb') as file:
+        magic = file.read(2)
+    opener = gzip.open if magic == b'\x1f\x8b' else open
+    with opener(path, 'rb') as file:
+        while True:
+            block = file.read(block_bytes)
+            if not block:
+                return
+            if not block.endswith(b'\n'):
+                block += file.readline()
+            yield block
+
+
+def filter_block(block, cdx_filter):
+    """解析一块CDX，返回 (保留的 (url, 行), 行数, 各条件丢弃的行数)"""
+    kept = []
+    dropped = Counter()
+    num_lines = 0
+    for line in block.decode('utf-8', errors='replace').splitlines(keepends=True):
+        if not line.strip():
+            continue
+        num_lines += 1
+        try:
+            fields = parse_cdx_line(line)[2]
+            url = fields['url']
+        except (ValueError, KeyError, TypeError):
+            dropped['parse'] += 1
+            continue
+        reason = cdx_filter.check(fields) if cdx_filter is not None else None
+        if reason is not None:
+            dropped[reason] += 1
+            continue
+        kept.append((url, line))
+    return kept, num_lines, dropped
+
+
+_worker_filter = None
+
+
+def _init_worker(cdx_filter):
+    global _worker_filter
+    _worker_filter = cdx_filter
+
+
+def _filter_block_in_worker(block):
+    return filter_block(block, _worker_filter)
+
+
+def iter_cdx_records(cdx_path, cdx_filter=None, num_procs=1, stats=None, block_bytes=BLOCK_BYTES):
+    """依次产生满足过滤条件的 (url, 原始行)；stats为CDXStats时把统计累加进去"""
+    if stats is None:
+        stats = CDXStats()
+    blocks = (block for path in expand_cdx_paths(cdx_path) for block in iter_blocks(path, block_bytes))
+    progress = tqdm(unit=' lines', unit_scale=True)
+    pool = None
+    if num_procs > 1:
+        pool = multiprocessing.Pool(processes=num_procs, initializer=_init_worker, initargs=(cdx_filter,))
+        # imap保持块的顺序；主进程只负责读取和解压
+        results = pool.imap(_filter_block_in_worker, blocks)
+    else:
+        results = (filter_block(block, cdx_filter) for block in blocks)
+    try:
+        for kept, num_lines, dropped in results:
+            stats.update(num_lines, len(kept), dropped)
+            progress.update(num_lines)
+            yield from kept
+    finally:
+        progress.close()
+        if pool is not None:
+            pool.terminate()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="按状态码、MIME、语言和URL正则过滤CDX，并统计各条件丢弃的行数")
+    parser.add_argument("--cdx_path", type=str, required=True, help="CDX文件、目录或glob模式，支持gzip")
+    parser.add_argument("--out_file", type=str, default=None, help="把保留的行写入该文件")
+    parser.add_argument("--status", type=str, default='200', help="逗号分隔的状态码，空字符串表示不过滤")
+    parser.add_argument("--mime", type=str, default='text/html', help="逗号分隔的MIME类型")
+    parser.add_argument("--languages", type=str, default='', help="逗号分隔的语言(ISO-639-3)，例如 eng,zho")
+    parser.add_argument("--exclude_file", type=str, default=None, help="每行一个要排除的URL正则")
+    parser.add_argument("--num_procs", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    cdx_filter = CDXFilter.fromOptions(args.status, args.mime, args.languages, args.exclude_file)
+    stats = CDXStats()
+    out_file = open(args.out_file, 'w', encoding='utf-8') if args.out_file else None
+    for _, line in iter_cdx_records(args.cdx_path, cdx_filter, args.num_procs, stats):
+        if out_file is not None:
+            out_file.write(line)
+    if out_file is not None:
+        out_file.close()
+    print(json.dumps(stats.report(), indent=2))
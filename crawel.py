@@ -5,32 +5,61 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from deprecated import deprecated
 
-from PIL import Image, ImageDraw
-
 import os
-import time
+import shutil
 
 import re
 import logging
 import traceback
 
 from utils import generate_url_hash
+from extractor import EXTRACT_ELEMENTS_JS, build_extract_options, clickable_records, hover_records
+from readiness import WAIT_FRAMES_JS, DomStableStrategy, ReadinessWaiter, SeleniumNetworkTracker, build_strategies
+from image_pipeline import ScreenshotWriter
+from resource_policy import BlockStats
+from metrics import PhaseTimer
+from near_dup import DOM_FINGERPRINT_JS, NearDuplicate
+from browser_cache import CacheStats, merge_feature_args, release_profile
+from browser_pool import DUPLICATE, ERROR, OK, classify_exception
 
 import argparse
 
 
+def parse_viewports(spec):
+    """解析逗号分隔的视口大小，例如 '1920x1080,1366x768'"""
+    viewports = []
+    for item in spec.split(','):
+        item = item.strip()
+        if item == '':
+            continue
+        width, height = item.lower().split('x')
+        viewports.append((int(width), int(height)))
+    return viewports
+
+
 class CrawlerBase:
-    def __init__(self, driver_path, width=1920, height=1080, wait_timeout=3, logger=None, nogui=False):
+    def __init__(self, driver_path, width=1920, height=1080, wait_timeout=3, logger=None, nogui=False,
+                 performance_log=False, chrome_args=None, page_load_strategy='normal', page_load_timeout=None,
+                 script_timeout=None, browser_cache=None):
         self.driver_path = driver_path
         self.width = width
         self.height = height
         self.wait_timeout = wait_timeout
         self.nogui = nogui
-        self.driver = self.buildDriver(driver_path, width, height, wait_timeout, nogui)
+        self.performance_log = performance_log  # 是否开启performance日志，用于读取Network事件
+        self.chrome_args = chrome_args or []  # 额外的Chrome启动参数
+        # normal等待load事件，eager只等到DOMContentLoaded，之后交给就绪检测
+        self.page_load_strategy = page_load_strategy
+        self.page_load_timeout = page_load_timeout  # driver.get的超时(秒)，None表示不限制
+        self.script_timeout = script_timeout  # execute_script的超时(秒)，None使用chromedriver的默认值
+        # browser_cache.BrowserCache，指定时每个浏览器的profile从预热的模板复制，None时由chromedriver创建临时profile
+        self.browser_cache = browser_cache
+        self.driver = self.newDriver()
         self.logger = logger
 
     @staticmethod
-    def buildDriver(driver_path, width, height, wait_timeout, nogui):
+    def buildDriver(driver_path, width, height, wait_timeout, nogui, performance_log=False, chrome_args=None,
+                    page_load_strategy='normal', page_load_timeout=None, script_timeout=None, user_data_dir=None):
         service = webdriver.chrome.service.Service(executable_path=driver_path)
         chrome_options = webdriver.ChromeOptions()
         if nogui:
@@ -39,15 +68,28 @@ class CrawlerBase:
             chrome_options.add_argument('--no-sandbox')  # 避免沙箱模式
             chrome_options.add_argument('--disable-dev-shm-usage')  # 禁用/dev/shm的使用
             chrome_options.add_argument('--charset=utf-8')  # 设置字符编码为 UTF-8
+        for arg in merge_feature_args(chrome_args or []):
+            chrome_options.add_argument(arg)
+        if user_data_dir is not None:
+            chrome_options.add_argument(f'--user-data-dir={user_data_dir}')
         # 设置文件下载目录
         chrome_options.add_experimental_option("prefs", {
             "download.default_directory": "./downloads"
         })
+        if performance_log:
+            chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+            chrome_options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
+        chrome_options.page_load_strategy = page_load_strategy
 
         driver = webdriver.Chrome(service=service, options=chrome_options)
         driver.set_window_size(width, height)
 
-        driver.implicitly_wait(wait_timeout)  # 设置隐式等待时间
+        # 不使用隐式等待：页面加载由WebDriverWait显式等待，隐式等待只会让没有结果的find_elements白白等满wait_timeout
+        driver.implicitly_wait(0)
+        if page_load_timeout is not None:
+            driver.set_page_load_timeout(page_load_timeout)
+        if script_timeout is not None:
+            driver.set_script_timeout(script_timeout)
         return driver
 
     def restart(self):
@@ -56,10 +98,36 @@ class CrawlerBase:
         else:
             print("restart driver")
         self.driver.quit()
-        self.driver = self.buildDriver(self.driver_path, self.width, self.height, self.wait_timeout, self.nogui)
+        release_profile(self.driver)
+        self.driver = self.newDriver()
+
+    def newDriver(self):
+        """按当前的配置启动一个新的浏览器"""
+        if self.browser_cache is None:
+            return self.buildDriver(self.driver_path, self.width, self.height, self.wait_timeout, self.nogui,
+                                    self.performance_log, self.chrome_args, self.page_load_strategy,
+                                    self.page_load_timeout, self.script_timeout)
+        profile_dir = self.browser_cache.newProfile()
+        try:
+            driver = self.buildDriver(self.driver_path, self.width, self.height, self.wait_timeout, self.nogui,
+                                      self.performance_log, self.chrome_args + self.browser_cache.chromeArgs(),
+                                      self.page_load_strategy, self.page_load_timeout, self.script_timeout,
+                                      profile_dir)
+        except Exception:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+            raise
+        # 浏览器退出后由release_profile删除
+        driver.profile_dir = profile_dir
+        return driver
+
+    def swapDriver(self, driver):
+        """换上一个新的浏览器，返回旧的浏览器，由调用方负责退出"""
+        old_driver, self.driver = self.driver, driver
+        return old_driver
 
     def quit(self):
         self.driver.quit()
+        release_profile(self.driver)
 
     def accessURL(self, url):
         if self.logger:
@@ -72,8 +140,26 @@ class CrawlerBase:
 class Crawler(CrawlerBase):
     def __init__(self, driver_path, img_dir, width, height, wait_timeout, logger=None, draw_box=False,
                  scrape_hover=False,
-                 nogui=False):
-        super().__init__(driver_path, width, height, wait_timeout, nogui=nogui, logger=logger)
+                 nogui=False, fast_extract=True, readiness='sleep', readiness_deadline=10, image_format='png',
+                 image_quality=90, image_workers=2, output=None, resource_policy=None, page_load_strategy='normal',
+                 page_load_timeout=None, script_timeout=None, metrics=None, element_log_every=100, viewports=None,
+                 settle_timeout=2, max_tiles=1, max_page_height=0, tile_overlap=200, dedup=None,
+                 browser_cache=None, network_idle_inflight=2, network_idle_ms=500):
+        self.additional_timeout = 2
+        # 页面加载后的就绪检测策略，默认'sleep'即固定等待additional_timeout秒
+        self.readiness = ReadinessWaiter(build_strategies(readiness, readiness_deadline, self.additional_timeout,
+                                                          network_idle_inflight, network_idle_ms),
+                                         deadline=readiness_deadline)
+        # 加载页面时拦截的资源，拦截统计需要从performance日志中读取
+        self.resource_policy = resource_policy if resource_policy is not None and resource_policy.enabled else None
+        # 使用预热的profile时从performance日志中统计缓存命中，cache_totals为所有页面的汇总
+        self.cache_totals = CacheStats()
+        super().__init__(driver_path, width, height, wait_timeout, nogui=nogui, logger=logger,
+                         performance_log=self.readiness.needs_network or self.resource_policy is not None
+                         or browser_cache is not None,
+                         chrome_args=self.resource_policy.chromeArgs() if self.resource_policy else None,
+                         page_load_strategy=page_load_strategy, page_load_timeout=page_load_timeout,
+                         script_timeout=script_timeout, browser_cache=browser_cache)
         self.driver_path = driver_path
         self.width = width
         self.height = height
@@ -81,10 +167,34 @@ class Crawler(CrawlerBase):
         self.img_dir = img_dir
         self.draw_box = draw_box  # 是否需要draw_box
         self.scrape_hover = scrape_hover  # 是否需要检测hover的元素
+        self.fast_extract = fast_extract  # 是否在页面内一次性提取所有元素
         os.makedirs(img_dir, exist_ok=True)
-        self.additional_timeout = 2
         self.box_color = (255, 0, 0)
         self.logger = logger
+        # 截图的缩放、画框和编码在后台完成；指定了output时由output决定图片保存的位置和方式
+        self.output = output
+        self.metrics = metrics  # CrawlMetrics，记录各阶段耗时，None表示不统计
+        self.screenshot_writer = ScreenshotWriter(image_format, image_quality, num_workers=image_workers,
+                                                  logger=logger, sink=output.writeImage if output else None,
+                                                  metrics=metrics)
+        # 逐元素的日志每element_log_every个元素才输出一条，并且只在debug级别输出
+        self.element_log_every = element_log_every
+        self.num_elements_seen = 0
+        self.sampled_results = []  # 当前页面中被抽样输出的元素，处理完后再输出完整的记录
+        # 一次加载之后依次在这些视口大小下提取元素并截图，默认只有浏览器窗口本身的大小
+        self.viewports = [tuple(viewport) for viewport in viewports] if viewports else [(width, height)]
+        # 改变视口大小之后等待页面重新布局
+        self.settle = ReadinessWaiter([DomStableStrategy(quiet_ms=200, timeout=settle_timeout)],
+                                      deadline=settle_timeout)
+        # 分块截图：max_tiles大于1时向下滚动页面，每一块单独截图并提取完整落在块内的元素
+        if max_tiles > 1 and not fast_extract:
+            raise ValueError("tiled capture requires fast_extract")
+        self.max_tiles = max_tiles
+        self.max_page_height = max_page_height  # 分块时最多截取到的页面高度，0表示不限制
+        self.tile_overlap = tile_overlap  # 相邻两块重叠的高度，跨越块边界的元素可以在下一块中完整出现
+        self.last_captures = []  # 最近一次processURL得到的截图 [(截图名, 图片路径)]
+        # near_dup.NearDupFilter，页面属于已满的近似重复簇时抛出NearDuplicate，None表示不检查
+        self.dedup = dedup
 
     def saveScreenshot(self, save_path):
         self.driver.save_screenshot(save_path)
@@ -132,7 +242,7 @@ class Crawler(CrawlerBase):
         not_hidden_elements = [element for element in elements if element.is_displayed()]
         return not_hidden_elements
 
-    def __processClickableElements(self):
+    def __processClickableElements(self, viewport):
         results = []
         signatures = set()
         elements = self.findAllClickableElements()
@@ -149,23 +259,19 @@ class Crawler(CrawlerBase):
                     continue
                 if width == 0 or height == 0:
                     continue
-                if right_bottom[0] >= self.width or right_bottom[1] >= self.height:
+                if right_bottom[0] >= viewport[0] or right_bottom[1] >= viewport[1]:
                     continue
                 signature = f'{left_top[0]}-{left_top[1]}-{width}-{height}'
                 if signature in signatures: continue
                 signatures.add(signature)
                 results.append({"left-top": left_top, "size": (width, height), "text": text, "type": "text"})
-                if self.logger:
-                    self.logger.info(
-                        f"location: ({left_top[0]}, {left_top[1]}), size: ({width}, {height}), text: {text}")
-                else:
-                    print(f"location: ({left_top[0]}, {left_top[1]}), size: ({width}, {height}), text: {text}")
+                self.__logElement(left_top, width, height, text)
             except Exception as exp:
                 traceback.print_exc()
                 continue
         return results
 
-    def __processHoverElementsV2(self):
+    def __processHoverElementsV2(self, viewport):
         results = []
         signatures = set()
         elements = self.findAllTitledElements()
@@ -180,7 +286,7 @@ class Crawler(CrawlerBase):
                     continue
                 if width == 0 or height == 0:
                     continue
-                if right_bottom[0] >= self.width or right_bottom[1] >= self.height:
+                if right_bottom[0] >= viewport[0] or right_bottom[1] >= viewport[1]:
                     continue
                 if text is None or text.strip() == '':
                     title = element.get_attribute("title")
@@ -189,16 +295,63 @@ class Crawler(CrawlerBase):
                     if signature in signatures: continue
                     signatures.add(signature)
                     results.append({"left-top": left_top, "size": (width, height), "text": title, "type": "hover"})
-                    if self.logger:
-                        self.logger.info(
-                            f"location: ({left_top[0]}, {left_top[1]}), size: ({width}, {height}), text: {title}")
-                    else:
-                        print(f"location: ({left_top[0]}, {left_top[1]}), size: ({width}, {height}), text: {title}")
+                    self.__logElement(left_top, width, height, title)
             except Exception as exp:
                 traceback.print_exc()
                 continue
         return results
 
+    def __sampleElementLog(self):
+        """逐元素的日志只抽样输出，避免日志本身成为热点"""
+        self.num_elements_seen += 1
+        if self.num_elements_seen % self.element_log_every != 0:
+            return False
+        return self.logger is None or self.logger.isEnabledFor(logging.DEBUG)
+
+    def __logElement(self, left_top, width, height, text):
+        """抽样输出元素，返回该元素是否被抽中"""
+        if not self.__sampleElementLog():
+            return False
+        if self.logger:
+            self.logger.debug(f"location: ({left_top[0]}, {left_top[1]}), size: ({width}, {height}), text: {text}")
+        else:
+            print(f"location: ({left_top[0]}, {left_top[1]}), size: ({width}, {height}), text: {text}")
+        return True
+
+    def __extractElementsInPage(self, viewport, tile_top=None, signatures=None):
+        """注入一次脚本，在页面内取回所有元素的位置、文本和可见性"""
+        width, height = viewport
+        if signatures is None:
+            signatures = {'clickable': set(), 'hover': set()}
+        options = build_extract_options(width, height, self.scrape_hover, tile_top)
+        extracted = self.driver.execute_script(EXTRACT_ELEMENTS_JS, options)
+        results = clickable_records(extracted['clickable'], width, height, signatures['clickable'], tile_top)
+        hovers = []
+        if self.scrape_hover:
+            hovers = hover_records(extracted['titled'], width, height, signatures['hover'], tile_top)
+        for result in results + hovers:
+            if self.__logElement(result['left-top'], result['size'][0], result['size'][1], result['text']):
+                self.sampled_results.append(result)
+        return results, hovers
+
+    def extractElements(self, viewport=None, tile_top=None, signatures=None):
+        """提取当前页面在viewport(默认为浏览器窗口大小)内的grounding元素，fast_extract为False时退回逐元素提取
+
+        分块截图时tile_top为当前块在页面中的位置，signatures为各块共用的去重集合
+        """
+        if viewport is None:
+            viewport = (self.width, self.height)
+        if self.fast_extract:
+            results, hovers = self.__extractElementsInPage(viewport, tile_top, signatures)
+        else:
+            results = self.__processClickableElements(viewport)
+            hovers = self.__processHoverElementsV2(viewport) if self.scrape_hover else []
+        if self.scrape_hover:
+            if self.logger:
+                self.logger.debug(f"hover elements: {len(hovers)}")
+            results.extend(hovers)
+        return results
+
     @deprecated(reason="use __processHoverElementsV2 instead")
     def __processHoverElements(self):
         elements = self.findAllNotHiddenElements()
@@ -251,50 +404,178 @@ class Crawler(CrawlerBase):
                 continue
         return results
 
+    def imagePath(self, key):
+        if self.output is not None:
+            return self.output.imagePath(key, self.screenshot_writer.extension)
+        return os.path.join(self.img_dir, key + self.screenshot_writer.extension)
+
+    def captureKeys(self, save_name):
+        """每个视口对应的截图名：第一个视口沿用save_name，其余视口加上大小作为后缀"""
+        return [save_name if i == 0 else f"{save_name}_{width}x{height}"
+                for i, (width, height) in enumerate(self.viewports)]
+
+    def splitCaptures(self, results):
+        """把processURL的结果按截图分组，返回 [(截图名, 记录)]；没有元素的截图对应空列表"""
+        return [(key, [result for result in results if result['image_path'] == save_path])
+                for key, save_path in self.last_captures]
+
+    def settleLayout(self):
+        """改变视口大小或滚动之后，等待重新布局(以及懒加载的内容)"""
+        self.driver.execute_async_script(WAIT_FRAMES_JS)
+        return self.settle.wait(self.driver)
+
+    def resizeViewport(self, viewport):
+        """在已经加载好的页面上改变视口大小，等待重新布局后返回就绪检测的结果"""
+        width, height = viewport
+        self.driver.execute_cdp_cmd('Emulation.setDeviceMetricsOverride',
+                                    {'width': width, 'height': height, 'deviceScaleFactor': 1, 'mobile': False})
+        return self.settleLayout()
+
+    def scrollTo(self, top):
+        """滚动到top，返回实际的滚动位置(到达页面底部时会小于top)和当前的页面高度"""
+        return self.driver.execute_script(
+            "window.scrollTo(0, arguments[0]);"
+            "var body = document.body ? document.body.scrollHeight : 0;"
+            "return [Math.round(window.pageYOffset), Math.max(document.documentElement.scrollHeight, body)];", top)
+
+    def __capture(self, key, viewport, timer, records, url):
+        # 最后截图，防止保存到空白的；缩放、画框(draw-box放到最后)和编码交给后台线程
+        save_path = self.imagePath(key)
+        with timer.phase('screenshot'):
+            png_bytes = self.driver.get_screenshot_as_png()
+        if self.dedup is not None and not self.last_captures:
+            # 只比较页面的第一张截图，其它视口和分块的截图随之保留或跳过
+            with timer.phase('dedup'):
+                self.dedup.checkImage(png_bytes, url)
+        with timer.phase('screenshot'):
+            boxes = [(result['left-top'], result['size']) for result in records] if self.draw_box else None
+            self.screenshot_writer.submit(png_bytes, save_path, viewport, boxes, self.box_color)
+        for result in records:
+            result['image_path'] = save_path
+            result['viewport'] = list(viewport)
+        self.last_captures.append((key, save_path))
+
+    def captureViewport(self, key, viewport, timer, url):
+        """在当前视口下提取元素并截图；开启分块时逐块向下滚动，第i块(i>0)的截图名加上 _t<i> 后缀"""
+        if self.max_tiles <= 1:
+            with timer.phase('extract'):
+                records = self.extractElements(viewport)
+            self.__capture(key, viewport, timer, records, url)
+            return records
+        results = []
+        signatures = {'clickable': set(), 'hover': set()}
+        step = max(1, viewport[1] - self.tile_overlap)
+        top = 0
+        for i in range(self.max_tiles):
+            with timer.phase('resize'):
+                tile_top, page_height = self.scrollTo(top)
+                if i > 0:
+                    self.settleLayout()
+            with timer.phase('extract'):
+                records = self.extractElements(viewport, tile_top, signatures)
+            self.__capture(key if i == 0 else f"{key}_t{i}", viewport, timer, records, url)
+            for result in records:
+                result['tile'] = {"index": i, "top": tile_top}
+            results.extend(records)
+            bottom = min(page_height, self.max_page_height) if self.max_page_height else page_height
+            if tile_top + viewport[1] >= bottom:
+                break
+            top = tile_top + step
+        self.scrollTo(0)
+        return results
+
     def processURL(self, url, save_name=None):
         if save_name is None:
             save_name = generate_url_hash(url)
-        save_path = os.path.join(self.img_dir, save_name + ".png")
-        self.accessURL(url)
-
-        # 等待第一个div加载结束
-        wait = WebDriverWait(self.driver, self.wait_timeout)  # 设置最长等待时间为10秒
-        wait.until(EC.presence_of_element_located((By.XPATH, "//div")))
-        # 再sleep 5s
-        time.sleep(self.additional_timeout)
-
-        # 缩放
-        width = self.width
-        height = self.height
-
-        results = self.__processClickableElements()
-        if self.scrape_hover:
-            hovers = self.__processHoverElementsV2()
-            print(f"hover elements: {hovers}")
-            results.extend(hovers)
-
-        # 最后保存截图，防止保存到空白的
-        self.saveScreenshot(save_path)
-        image = Image.open(save_path)
-        image = image.resize([width, height])
-
+        network = None
+        if self.performance_log:
+            network = SeleniumNetworkTracker(self.driver)
+            network.reset()
+        block_stats = None
+        if self.resource_policy is not None:
+            # 浏览器可能被换过，每个页面都重新设置一次
+            self.resource_policy.applySelenium(self.driver)
+            block_stats = BlockStats()
+            network.listeners.append(block_stats.onNetworkEvent)
+        cache_stats = None
+        if self.browser_cache is not None:
+            cache_stats = CacheStats()
+            network.listeners.append(cache_stats.onNetworkEvent)
+        timer = PhaseTimer(self.metrics)
+        self.sampled_results = []
+        outcome = ERROR
+        try:
+            readiness, results = self.__loadAndCapture(url, save_name, network, cache_stats, timer)
+            outcome = OK
+        except NearDuplicate:
+            outcome = DUPLICATE
+            raise
+        except Exception as exp:
+            outcome = classify_exception(exp)
+            raise
+        finally:
+            # 失败和超时的URL也要计入各阶段的耗时，否则直方图只反映成功的页面
+            timings = timer.finish(outcome)
+            if outcome != OK and self.dedup is not None:
+                # 页面没有保存，归还它在近似重复簇中占用的名额
+                self.dedup.release(url)
         for result in results:
             result['url'] = url
-            result['image_path'] = save_path
-            self.logger.info(result)
+            result['readiness'] = readiness
+            result['timings'] = timings
+            if block_stats is not None:
+                result['blocked'] = block_stats.report()
+            if cache_stats is not None:
+                result['cache'] = cache_stats.report()
+        # 提取时已经抽样过，这里输出被抽中元素的完整记录
+        for result in self.sampled_results:
+            if self.logger:
+                self.logger.debug(result)
+            else:
+                print(result)
 
-        if self.draw_box:  # draw-box放到最后
-            draw = ImageDraw.Draw(image)
-            for result in results:
-                left_top = result['left-top']
-                size = result['size']
-                draw.rectangle([left_top, (left_top[0] + size[0], left_top[1] + size[1])], outline=self.box_color,
-                               width=2)
+        return results
 
-        image.save(save_path)
-        image.close()
+    def __loadAndCapture(self, url, save_name, network, cache_stats, timer):
+        """导航、等待就绪并在每个视口下提取元素和截图，返回 (就绪检测的结果, 元素记录)"""
+        with timer.phase('navigate'):
+            self.accessURL(url)
+            # 等待第一个div加载结束
+            wait = WebDriverWait(self.driver, self.wait_timeout)  # 设置最长等待时间为10秒
+            wait.until(EC.presence_of_element_located((By.XPATH, "//div")))
+        # 再等待页面就绪
+        with timer.phase('readiness'):
+            readiness = self.readiness.wait(self.driver, network)
+            if network is not None:
+                network.drain()
+        if cache_stats is not None:
+            self.cache_totals.merge(cache_stats)
+        if self.logger:
+            self.logger.info(f"page ready: {readiness}")
+        if self.dedup is not None:
+            # 停放域名和模板页在提取和截图之前就跳过
+            with timer.phase('dedup'):
+                self.dedup.checkDom(self.driver.execute_script(DOM_FINGERPRINT_JS), url)
 
-        return results
+        # 一次加载，依次在每个视口下提取元素并截图；导航是最贵的操作，多个视口共用同一次加载
+        results = []
+        self.last_captures = []
+        current = (self.width, self.height)
+        try:
+            for key, viewport in zip(self.captureKeys(save_name), self.viewports):
+                if viewport != current:
+                    with timer.phase('resize'):
+                        self.resizeViewport(viewport)
+                    current = viewport
+                results.extend(self.captureViewport(key, viewport, timer, url))
+        finally:
+            if current != (self.width, self.height):
+                self.driver.execute_cdp_cmd('Emulation.clearDeviceMetricsOverride', {})
+        return readiness, results
+
+    def quit(self):
+        super().quit()
+        self.screenshot_writer.close()
 
     @staticmethod
     def isLeafElement(element):
@@ -324,10 +605,29 @@ if __name__ == "__main__":
     parser.add_argument("--draw_box", action="store_true")
     parser.add_argument("--scrape_hover", action="store_true")
     parser.add_argument("--nogui", action="store_true")
+    parser.add_argument("--slow_extract", action="store_true", help="逐元素调用webdriver提取(旧实现)")
+    parser.add_argument("--readiness", type=str, default="network_idle,dom_stable",
+                        help="逗号分隔的就绪检测策略: sleep, network_idle, dom_stable, resources")
+    parser.add_argument("--readiness_deadline", type=float, default=10)
+    parser.add_argument("--network_idle_inflight", type=int, default=2)
+    parser.add_argument("--network_idle_ms", type=int, default=500)
+    parser.add_argument("--image_format", type=str, default="png", choices=["png", "webp", "jpeg"])
+    parser.add_argument("--image_quality", type=int, default=90)
+    parser.add_argument("--page_load_strategy", type=str, default="normal", choices=["normal", "eager", "none"])
+    parser.add_argument("--page_load_timeout", type=float, default=None)
+    parser.add_argument("--viewports", type=str, default="", help="逗号分隔的视口大小，例如 1920x1080,1366x768")
+    parser.add_argument("--max_tiles", type=int, default=1, help="向下滚动分块截图的最大块数，1表示不分块")
+    parser.add_argument("--max_page_height", type=int, default=0)
     args = parser.parse_args()
 
     logger = logging.getLogger(__name__)
     crawler = Crawler(args.driver_path, args.img_dir, args.width, args.height, args.wait_timeout, logger,
-                      args.draw_box, args.scrape_hover, args.nogui)
+                      args.draw_box, args.scrape_hover, args.nogui, fast_extract=not args.slow_extract,
+                      readiness=args.readiness, readiness_deadline=args.readiness_deadline,
+                      network_idle_inflight=args.network_idle_inflight, network_idle_ms=args.network_idle_ms,
+                      image_format=args.image_format, image_quality=args.image_quality,
+                      page_load_strategy=args.page_load_strategy, page_load_timeout=args.page_load_timeout,
+                      viewports=parse_viewports(args.viewports), max_tiles=args.max_tiles,
+                      max_page_height=args.max_page_height)
     crawler.processURL(args.test_url)
     crawler.quit()
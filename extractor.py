@@ -0,0 +1,196 @@
+"""页面内元素提取：一次注入脚本取回所有可点击元素和带title元素的信息
+
+旧的实现对每个元素分别调用 .location / .size / .text / get_attribute / is_displayed，
+每次调用都是一次到chromedriver的HTTP请求。这里把这些信息在页面内一次算完，
+以JSON数组的形式返回，再在python侧做与旧实现一致的过滤和去重。
+
+分块截图(tile)时页面滚动到 opts.top，坐标相对于当前块的左上角；
+同时标记处于 position: fixed/sticky 容器中的元素(吸顶的导航栏等)，这些元素在每一块中位置都相同，
+去重时使用相对坐标，因此只会在第一次出现的块中输出。
+"""
+import json
+
+# 脚本以 arguments[0] 接收参数，既可以用 driver.execute_script 执行，
+# 也可以通过 build_extract_expression 包装后用CDP的 Runtime.evaluate 执行
+EXTRACT_ELEMENTS_JS = r"""
+var opts = arguments[0] || {};
+var maxX = opts.width, maxY = opts.height;
+var tileTop = opts.top || 0;
+var scrollX = window.pageXOffset, scrollY = window.pageYOffset;
+
+function snapshot(xpath) {
+    var nodes = [];
+    var res = document.evaluate(xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (var i = 0; i < res.snapshotLength; i++) nodes.push(res.snapshotItem(i));
+    return nodes;
+}
+
+function isDisplayed(el) {
+    if (el.tagName === 'INPUT' && (el.type || '').toLowerCase() === 'hidden') return false;
+    if (typeof el.checkVisibility === 'function') {
+        if (!el.checkVisibility({opacityProperty: true, visibilityProperty: true})) return false;
+    } else {
+        var style = window.getComputedStyle(el);
+        if (style.visibility === 'hidden' || style.visibility === 'collapse') return false;
+        for (var n = el; n && n.nodeType === 1; n = n.parentElement) {
+            var s = window.getComputedStyle(n);
+            if (s.display === 'none' || parseFloat(s.opacity) === 0) return false;
+        }
+    }
+    var r = el.getBoundingClientRect();
+    if (r.width > 0 && r.height > 0) return true;
+    // 与selenium一致：自身没有尺寸但有可见子元素时也算显示
+    for (var c = el.firstElementChild; c; c = c.nextElementSibling) {
+        var cr = c.getBoundingClientRect();
+        if (cr.width > 0 && cr.height > 0) return true;
+    }
+    return false;
+}
+
+function visibleText(el, displayed) {
+    if (!displayed) return '';
+    var text = el.innerText || '';
+    var lines = text.replace(/\u00a0/g, ' ').split('\n');
+    var out = [];
+    for (var i = 0; i < lines.length; i++) {
+        out.push(lines[i].replace(/[ \t\r\f\v\u200b]+/g, ' ').trim());
+    }
+    return out.join('\n').replace(/^\n+|\n+$/g, '');
+}
+
+function valueOf(el) {
+    var v = el.value;
+    if (v === undefined || v === null) v = el.getAttribute('value');
+    return v === undefined || v === null ? null : String(v);
+}
+
+function isFixed(el) {
+    for (var n = el; n && n.nodeType === 1; n = n.parentElement) {
+        var position = window.getComputedStyle(n).position;
+        if (position === 'fixed' || position === 'sticky') return true;
+    }
+    return false;
+}
+
+function measure(el) {
+    var r = el.getBoundingClientRect();
+    var x = r.left + scrollX, y = r.top + scrollY - tileTop;
+    if (r.width === 0 || r.height === 0) return null;
+    // 视口过滤：python侧对x/y取整后会再精确判断一次，这里只去掉一定会被过滤掉的元素
+    if (maxX !== undefined && x + r.width - 0.5 >= maxX) return null;
+    if (maxY !== undefined && y + r.height - 0.5 >= maxY) return null;
+    if (opts.tiled && y < -0.5) return null;  // 在当前块上方的元素
+    var m = {x: x, y: y, w: r.width, h: r.height};
+    if (opts.tiled && isFixed(el)) m.fixed = true;
+    return m;
+}
+
+var clickable = [];
+var elements = snapshot("//a | //button | //input[@type='submit'] | //*[@onclick]");
+for (var i = 0; i < elements.length; i++) {
+    var el = elements[i];
+    var m = measure(el);
+    if (m === null) continue;
+    m.text = visibleText(el, isDisplayed(el));
+    if (m.text === '') {
+        m.value = valueOf(el);
+        if (m.value === null || m.value === '') continue;
+    }
+    clickable.push(m);
+}
+
+var titled = [];
+if (opts.hover) {
+    elements = snapshot("//*[@title]");
+    for (var i = 0; i < elements.length; i++) {
+        var el = elements[i];
+        if (!isDisplayed(el)) continue;
+        var m = measure(el);
+        if (m === null) continue;
+        if (visibleText(el, true).trim() !== '') continue;
+        m.title = el.getAttribute('title');
+        if (m.title === null || m.title === '') continue;
+        titled.push(m);
+    }
+}
+return {clickable: clickable, titled: titled};
+"""
+
+
+def build_extract_expression(opts):
+    """把提取脚本包装成可以直接求值的表达式，供CDP的Runtime.evaluate使用"""
+    return "(function() {%s}).apply(null, [%s])" % (EXTRACT_ELEMENTS_JS, json.dumps(opts))
+
+
+def build_extract_options(width, height, scrape_hover, tile_top=None):
+    options = {"width": width, "height": height, "hover": bool(scrape_hover)}
+    if tile_top is not None:
+        options.update(top=tile_top, tiled=True)
+    return options
+
+
+def _geometry(item):
+    # 与selenium的 element.location 一致：坐标四舍五入，尺寸保持原值
+    left_top = (round(item['x']), round(item['y']))
+    width, height = item['w'], item['h']
+    return left_top, width, height
+
+
+def _signature(item, left_top, width, height, tile_top):
+    # 分块时用页面坐标去重，同一个元素出现在相邻两块的重叠部分时只输出一次；
+    # fixed/sticky的元素在每一块中相对位置不变，直接用相对坐标去重，加上前缀以免与页面坐标相同的普通元素混淆
+    if tile_top is None:
+        return f'{left_top[0]}-{left_top[1]}-{width}-{height}'
+    if item.get('fixed'):
+        return f'fixed-{left_top[0]}-{left_top[1]}-{width}-{height}'
+    return f'{left_top[0]}-{left_top[1] + tile_top}-{width}-{height}'
+
+
+def clickable_records(items, width, height, signatures=None, tile_top=None):
+    """根据页面内提取的结果生成可点击元素的记录，过滤和去重规则与逐元素提取一致
+
+    分块截图时传入各块共用的signatures以及当前块的tile_top，跨块去重
+    """
+    results = []
+    if signatures is None:
+        signatures = set()
+    for item in items:
+        left_top, w, h = _geometry(item)
+        text = item.get('text')
+        if text is None or text == '':
+            text = item.get('value')
+        if text is None or text == '':
+            continue
+        if w == 0 or h == 0:
+            continue
+        if left_top[0] + w >= width or left_top[1] + h >= height:
+            continue
+        if tile_top is not None and left_top[1] < 0:
+            continue
+        signature = _signature(item, left_top, w, h, tile_top)
+        if signature in signatures: continue
+        signatures.add(signature)
+        results.append({"left-top": left_top, "size": (w, h), "text": text, "type": "text"})
+    return results
+
+
+def hover_records(items, width, height, signatures=None, tile_top=None):
+    """根据页面内提取的结果生成hover元素(带title)的记录"""
+    results = []
+    if signatures is None:
+        signatures = set()
+    for item in items:
+        left_top, w, h = _geometry(item)
+        if w == 0 or h == 0:
+            continue
+        if left_top[0] + w >= width or left_top[1] + h >= height:
+            continue
+        if tile_top is not None and left_top[1] < 0:
+            continue
+        title = item.get('title')
+        if title is None or title == '': continue
+        signature = _signature(item, left_top, w, h, tile_top)
+        if signature in signatures: continue
+        signatures.add(signature)
+        results.append({"left-top": left_top, "size": (w, h), "text": title, "type": "hover"})
+    return results
@@ -0,0 +1,145 @@
+"""离线测试用的合成网站
+
+按参数生成一批静态页面(链接、按钮、带title元素的数量，DOM嵌套深度，图片的数量和大小)，
+用本地的http服务器提供访问，可以给每个请求加上人为的延迟来模拟真实网站；
+同时生成与之对应的假CDX文件，main.py可以直接把它当作输入。
+"""
+import functools
+import http.server
+import json
+import math
+import os
+import random
+import threading
+import time
+
+from PIL import Image
+
+
+def generate_page(page_num, num_links, num_buttons, num_titled, dom_depth=1, num_images=0, seed=0,
+                  edge_cases=False):
+    if dom_depth < 1:
+        # 爬虫要等到页面中出现<div>才开始提取
+        raise ValueError(f"dom_depth must be at least 1, got {dom_depth}")
+    rnd = random.Random(seed * 1000003 + page_num)
+    elements = []
+    for i in range(num_links):
+        if rnd.random() < 0.1:
+            elements.append(f'<a class="cell hidden" href="#h{i}">hidden link {i}</a>')
+        else:
+            elements.append(f'<a class="cell" href="page_{rnd.randrange(1 << 20)}.html">link {page_num}-{i}</a>')
+    for i in range(num_buttons):
+        if rnd.random() < 0.3:
+            elements.append(f'<input class="cell" type="submit" value="submit {i}">')
+        else:
+            elements.append(f'<button class="cell" onclick="void(0)">button {i}</button>')
+    for i in range(num_titled):
+        elements.append(f'<span class="cell" title="tip {i}" style="width:16px;height:16px;background:#ccc"></span>')
+    # 图片文件是共用的，加上不同的查询参数避免浏览器缓存
+    for i in range(num_images):
+        elements.append(f'<img class="cell" src="img_{i}.png?page={page_num}" width="64" height="64">')
+    rnd.shuffle(elements)
+    opening, closing = '<div>' * dom_depth, '</div>' * dom_depth
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>fixture</title>',
+             '<style>body{margin:8px;font-family:sans-serif} .hidden{display:none} '
+             '.cell{display:inline-block;margin:4px;padding:2px}</style></head><body>']
+    parts += [opening + element + closing for element in elements]
+    if edge_cases:
+        # 重复元素和视口外元素，用来检查去重和视口过滤
+        parts.append('<div>' + '<a class="cell" href="#dup" style="position:absolute;left:5px;top:5px">dup</a>' * 3
+                     + '<a href="#far" style="position:absolute;left:10px;top:5000px">far</a></div>')
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def write_images(site_dir, num_images, image_kb, seed=0):
+    """写入num_images张随机噪声PNG，噪声几乎无法压缩，文件大小约为image_kb"""
+    rnd = random.Random(seed)
+    side = max(1, int(math.sqrt(image_kb * 1024 / 3)))
+    for i in range(num_images):
+        num_bytes = side * side * 3
+        data = rnd.getrandbits(num_bytes * 8).to_bytes(num_bytes, 'big')
+        Image.frombytes('RGB', (side, side), data).save(os.path.join(site_dir, f'img_{i}.png'))
+
+
+def write_site(site_dir, num_pages, num_links=200, num_buttons=50, num_titled=50, dom_depth=1, num_images=0,
+               image_kb=0, seed=0, edge_cases=False):
+    os.makedirs(site_dir, exist_ok=True)
+    if num_images and image_kb:
+        write_images(site_dir, num_images, image_kb, seed)
+    else:
+        num_images = 0
+    names = []
+    for i in range(num_pages):
+        name = f'page_{i}.html'
+        with open(os.path.join(site_dir, name), 'w', encoding='utf-8') as file:
+            file.write(generate_page(i, num_links, num_buttons, num_titled, dom_depth, num_images, seed, edge_cases))
+        names.append(name)
+    return names
+
+
+def cdx_line(url, timestamp='20240101000000'):
+    """与Common Crawl CDX相同的格式：SURT 时间戳 JSON，utils.parse_url_from_cdx_line 可以解析"""
+    fields = {"url": url, "mime": "text/html", "status": "200"}
+    host_path = url.split('://', 1)[-1]
+    host, _, path = host_path.partition('/')
+    surt = ','.join(reversed(host.split(':')[0].split('.'))) + ')/' + path
+    return f"{surt} {timestamp} {json.dumps(fields)}\n"
+
+
+def write_fake_cdx(cdx_path, base_url, names):
+    with open(cdx_path, 'w', encoding='utf-8') as file:
+        for name in names:
+            file.write(cdx_line(base_url + name))
+
+
+class FixtureHandler(http.server.SimpleHTTPRequestHandler):
+    def __init__(self, *args, latency=0, **kwargs):
+        self.latency = latency  # 每个请求的人为延迟(秒)
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(site_dir, latency=0):
+    handler = functools.partial(FixtureHandler, directory=site_dir, latency=latency)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="生成合成网站和对应的假CDX文件，并在本地提供访问")
+    parser.add_argument("--site_dir", type=str, required=True)
+    parser.add_argument("--num_pages", type=int, default=100)
+    parser.add_argument("--num_links", type=int, default=200)
+    parser.add_argument("--num_buttons", type=int, default=50)
+    parser.add_argument("--num_titled", type=int, default=50)
+    parser.add_argument("--dom_depth", type=int, default=1)
+    parser.add_argument("--num_images", type=int, default=0)
+    parser.add_argument("--image_kb", type=int, default=0)
+    parser.add_argument("--latency_ms", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.dom_depth < 1:
+        parser.error("--dom_depth must be at least 1")
+    names = write_site(args.site_dir, args.num_pages, args.num_links, args.num_buttons, args.num_titled,
+                       args.dom_depth, args.num_images, args.image_kb, args.seed)
+    server = serve_directory(args.site_dir, args.latency_ms / 1000)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/'
+    write_fake_cdx(os.path.join(args.site_dir, 'fixture.cdx'), base_url, names)
+    print(f"serving {len(names)} pages at {base_url}, cdx: {os.path.join(args.site_dir, 'fixture.cdx')}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,136 @@
+"""截图的后处理流水线
+
+浏览器截图以PNG字节的形式直接交给后台线程池(或进程池)处理：缩放、画框、编码成指定格式后写盘，
+爬虫线程不必等待PNG的解码和重新编码就可以开始处理下一个URL。
+尺寸已经符合要求、不需要画框并且输出格式就是PNG时，直接把浏览器给出的字节写盘。
+"""
+import io
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+
+# 格式名 -> (PIL中的格式名, 文件扩展名)
+IMAGE_FORMATS = {
+    'png': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp'),
+    'jpeg': ('JPEG', '.jpg'),
+}
+
+
+def encode_screenshot(png_bytes, size, boxes=None, box_color=(255, 0, 0), image_format='png', quality=90):
+    """把截图缩放到size，画上boxes，并编码为image_format，返回编码后的字节"""
+    image = Image.open(io.BytesIO(png_bytes))  # 只解析文件头，此时还没有解码像素
+    need_resize = image.size != tuple(size)
+    if not need_resize and not boxes and image_format == 'png':
+        image.close()
+        return png_bytes
+    if need_resize:
+        image = image.resize(list(size))
+    if boxes:
+        draw = ImageDraw.Draw(image)
+        for left_top, box_size in boxes:
+            draw.rectangle([tuple(left_top), (left_top[0] + box_size[0], left_top[1] + box_size[1])],
+                           outline=box_color, width=2)
+    pil_format, _ = IMAGE_FORMATS[image_format]
+    if pil_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    if pil_format == 'PNG':
+        image.save(buffer, format=pil_format)
+    else:
+        image.save(buffer, format=pil_format, quality=quality)
+    image.close()
+    return buffer.getvalue()
+
+
+def encode_screenshot_timed(*args):
+    """在后台线程(或进程)中编码并计时，返回 (编码后的字节, 编码耗时)"""
+    start = time.monotonic()
+    data = encode_screenshot(*args)
+    return data, time.monotonic() - start
+
+
+def write_file(save_path, data):
+    with open(save_path, 'wb') as file:
+        file.write(data)
+
+
+class ScreenshotWriter:
+    def __init__(self, image_format='png', quality=90, num_workers=2, use_processes=False, max_pending=16,
+                 logger=None, sink=None, metrics=None):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"unsupported image format: {image_format}")
+        self.image_format = image_format
+        self.quality = quality
+        self.logger = logger
+        self.sink = sink or write_file  # sink(save_path, data)负责保存编码后的图片
+        self.metrics = metrics  # 记录编码和写入耗时的CrawlMetrics，None表示不统计
+        if use_processes:
+            self.executor = ProcessPoolExecutor(max_workers=num_workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="screenshot")
+        # 限制排队中的截图数量，后处理跟不上时让爬虫等待，避免截图在内存中堆积
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.num_pages = 0
+        self.num_bytes = 0
+        self.num_errors = 0
+
+    @property
+    def extension(self):
+        return IMAGE_FORMATS[self.image_format][1]
+
+    def submit(self, png_bytes, save_path, size, boxes=None, box_color=(255, 0, 0)):
+        """提交一张截图，返回future，其结果为 (编码后的图片, 编码耗时)"""
+        self.pending.acquire()
+        try:
+            future = self.executor.submit(encode_screenshot_timed, png_bytes, size, boxes, box_color, self.image_format,
+                                          self.quality)
+        except Exception:
+            self.pending.release()
+            raise
+        future.add_done_callback(lambda f: self.__onDone(f, save_path))
+        return future
+
+    def __onDone(self, future, save_path):
+        try:
+            error = future.exception()
+            if error is None:
+                data, encode_seconds = future.result()
+                start = time.monotonic()
+                self.sink(save_path, data)
+                if self.metrics is not None:
+                    self.metrics.observe('encode', encode_seconds)
+                    self.metrics.observe('write_image', time.monotonic() - start)
+        except Exception as exp:
+            error = exp
+        finally:
+            self.pending.release()
+        with self.lock:
+            if error is not None:
+                self.num_errors += 1
+                message = f"failed to save screenshot {save_path}: {error}"
+            else:
+                self.num_pages += 1
+                self.num_bytes += len(data)
+                message = f"save screenshot to {save_path} ({len(data)} bytes)"
+        if self.logger is None:
+            return
+        if error is None:
+            self.logger.debug(message)  # 每个页面一条，放到debug级别
+        else:
+            self.logger.error(message)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pages": self.num_pages,
+                "bytes": self.num_bytes,
+                "bytes_per_page": self.num_bytes / self.num_pages if self.num_pages else 0,
+                "errors": self.num_errors,
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
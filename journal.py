@@ -0,0 +1,81 @@
+"""断点续爬用的进度日志
+
+每个worker维护一个追加写入的日志文件，每处理完一个URL追加一行：
+    <url hash>\t<status>\t<attempts>
+重启时读入日志即可知道哪些URL已经完成、哪些已经失败了多少次，不需要重新扫描输出的JSONL文件。
+同一个URL可能有多行记录，以最后一行为准；compact() 只保留每个URL的最新状态。
+"""
+import os
+
+from utils import generate_url_hash
+
+DONE = 'done'
+FAILED = 'failed'
+
+
+class ProgressJournal:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # url hash -> (status, attempts)
+        self.num_lines = 0
+        if os.path.exists(path):
+            self.__load()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __load(self):
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != 3:
+                    continue  # 进程被杀时最后一行可能没有写完整
+                self.entries[fields[0]] = (fields[1], int(fields[2]))
+                self.num_lines += 1
+
+    def status(self, url):
+        return self.entries.get(generate_url_hash(url), (None, 0))
+
+    def shouldSkip(self, url, max_attempts):
+        status, attempts = self.status(url)
+        return status == DONE or attempts >= max_attempts
+
+    def __append(self, url_hash, status, attempts):
+        self.entries[url_hash] = (status, attempts)
+        self.file.write(f"{url_hash}\t{status}\t{attempts}\n")
+        self.file.flush()
+        self.num_lines += 1
+
+    def markDone(self, url):
+        self.markHashDone(generate_url_hash(url))
+
+    def markHashDone(self, url_hash):
+        _, attempts = self.entries.get(url_hash, (None, 0))
+        self.__append(url_hash, DONE, attempts + 1)
+
+    def markFailed(self, url):
+        url_hash = generate_url_hash(url)
+        _, attempts = self.entries.get(url_hash, (None, 0))
+        self.__append(url_hash, FAILED, attempts + 1)
+
+    def counts(self):
+        done = sum(1 for status, _ in self.entries.values() if status == DONE)
+        return {"done": done, "failed": len(self.entries) - done}
+
+    def compact(self):
+        """重写日志文件，每个URL只保留一行；先写临时文件再替换，中途被杀也不会损坏日志"""
+        self.file.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            for url_hash, (status, attempts) in self.entries.items():
+                file.write(f"{url_hash}\t{status}\t{attempts}\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+        self.num_lines = len(self.entries)
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def compactIfNeeded(self, ratio=2):
+        if self.num_lines > ratio * max(len(self.entries), 1):
+            self.compact()
+
+    def close(self):
+        self.file.close()
@@ -1,12 +1,25 @@
 import logging
 
-from crawel import Crawler
+from crawel import Crawler, parse_viewports
+import asyncio
 import os
 import multiprocessing
 import random
 import json
+import time
 import argparse
-from utils import extract_urls_from_cdx
+import functools
+from sharding import iter_cdx_urls, select_window, shard_cdx
+from cdx_reader import CDXFilter, CDXStats
+from task_queue import TaskQueue, default_queue_path
+from journal import ProgressJournal
+from output_writer import build_output
+from utils import generate_url_hash
+from browser_pool import DUPLICATE, KILLED, OK, BrowserManager, OutcomeLog, URLWatchdog, classify_exception, driver_pid
+from resource_policy import ResourcePolicy
+from metrics import get_metrics, start_metrics_server
+from near_dup import NearDupFilter, NearDupIndex, NearDuplicate
+from browser_cache import BrowserCache
 
 
 def configLogging(loglevel):
@@ -25,55 +38,377 @@ def configLogging(loglevel):
     logging.basicConfig(level=level, format="%(asctime)s [%(process)d] %(message)s")
 
 
-def split_task_files(cdx_file_path, out_dir, num_workers, url_st, num_urls):
-    urls = extract_urls_from_cdx(cdx_file_path)
-    random.shuffle(urls)
-    urls = urls[url_st:url_st + num_urls]  # 处理前1w个
-    num_urls = len(urls)
-    num_urls_per_worker = num_urls // num_workers
-    for i in range(num_workers):
-        start_index = i * num_urls_per_worker
-        end_index = (i + 1) * num_urls_per_worker
-        if i == num_workers - 1:
-            end_index = num_urls
-        with open(os.path.join(out_dir, f"{i}.txt"), 'w', encoding='utf-8') as file:
-            for j in range(start_index, end_index):
-                file.write(urls[j] + '\n')
+def save_cdx_stats(stats, out_dir):
+    """各过滤条件丢弃的行数和解析速度"""
+    print(f"cdx filter: {stats.report()}")
+    with open(os.path.join(out_dir, "cdx_filter_stats.json"), 'w', encoding='utf-8') as file:
+        json.dump(stats.report(), file)
+
+
+def build_preflight(out_dir, preflight_options):
+    """返回在写出分片或放入队列之前对URL做HTTP预检的函数，preflight_options为None时不预检"""
+    if preflight_options is None:
+        return None
+    from preflight import preflight_urls
+
+    return functools.partial(preflight_urls, out_dir=out_dir, **preflight_options)
+
+
+def save_preflight_setting(out_dir, preflight_options):
+    """记录生成任务时的预检设置，重新运行时与之比较"""
+    with open(os.path.join(out_dir, "preflight_setting.json"), 'w', encoding='utf-8') as file:
+        json.dump(preflight_options, file)
+
+
+def check_preflight_setting(out_dir, preflight_options):
+    """沿用已有的任务时，本次的预检设置不会生效，与生成任务时的设置不同时给出警告"""
+    path = os.path.join(out_dir, "preflight_setting.json")
+    previous = None
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            previous = json.load(file)
+    if previous != preflight_options:
+        print(f"WARNING: existing tasks in {out_dir} were generated with preflight {previous}, "
+              f"the current setting {preflight_options} is ignored; remove the task files to regenerate them")
+
+
+class TaskSettingMismatch(Exception):
+    """已有的任务由不同的参数生成"""
+
+
+def task_setting(cdx_file_path, url_st, num_urls, seed, cdx_filter=None, num_workers=None):
+    """生成任务所用的参数，决定了每个分片(或队列)中有哪些URL"""
+    return {"cdx_file_path": cdx_file_path, "num_workers": num_workers, "url_st": url_st, "num_urls": num_urls,
+            "seed": seed, "cdx_filter": cdx_filter.setting() if cdx_filter is not None else None}
+
+
+def check_task_setting(out_dir, setting, required):
+    """已有的任务由不同的参数生成时拒绝沿用，否则会静默地爬取另一批URL(或者只爬取其中一部分)；
+    required为True时已有任务但没有记录参数也拒绝"""
+    path = os.path.join(out_dir, "task_setting.json")
+    previous = None
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            previous = json.load(file)
+    elif not required:
+        return
+    if previous != setting:
+        raise TaskSettingMismatch(f"existing tasks in {out_dir} were generated with {previous}, which differs from "
+                                  f"the current setting {setting}; remove the task files or use another --out_root "
+                                  f"to regenerate them")
+
+
+def save_task_setting(out_dir, setting):
+    with open(os.path.join(out_dir, "task_setting.json"), 'w', encoding='utf-8') as file:
+        json.dump(setting, file)
+
+
+def split_task_files(cdx_file_path, out_dir, num_workers, url_st, num_urls, seed, cdx_filter=None, cdx_procs=1,
+                     preflight_options=None):
+    setting = task_setting(cdx_file_path, url_st, num_urls, seed, cdx_filter, num_workers)
+    reuse = all(os.path.exists(os.path.join(out_dir, f"{i}.txt")) for i in range(num_workers))
+    check_task_setting(out_dir, setting, required=reuse)
+    if reuse:
+        print(f"reuse existing task files in {out_dir}")  # 断点续爬时不需要重新扫描CDX
+        check_preflight_setting(out_dir, preflight_options)
+        return
+    # 流式地从CDX中取出随机排列后 [url_st, url_st + num_urls) 的URL，内存占用与CDX大小无关
+    stats = CDXStats()
+    shard_cdx(cdx_file_path, out_dir, num_workers, url_st, num_urls, seed, cdx_filter, cdx_procs, stats,
+              build_preflight(out_dir, preflight_options))
+    save_cdx_stats(stats, out_dir)
+    save_preflight_setting(out_dir, preflight_options)
+    save_task_setting(out_dir, setting)
+
+
+def build_task_queue(cdx_file_path, queue_path, url_st, num_urls, seed, queue_options, cdx_filter=None,
+                     cdx_procs=1, preflight_options=None):
+    """把本次要爬取的URL放入共享队列；队列已经有任务时(比如重新启动)直接沿用"""
+    out_dir = os.path.dirname(queue_path)
+    setting = task_setting(cdx_file_path, url_st, num_urls, seed, cdx_filter)
+    queue = TaskQueue(queue_path, **queue_options)
+    if queue.isEmpty():
+        stats = CDXStats()
+        urls = select_window(iter_cdx_urls(cdx_file_path, cdx_filter, cdx_procs, stats), seed, url_st, num_urls)
+        save_cdx_stats(stats, out_dir)
+        preflight = build_preflight(out_dir, preflight_options)
+        if preflight is not None:
+            urls = preflight(urls)
+        queue.addUrls(urls)
+        save_preflight_setting(out_dir, preflight_options)
+        save_task_setting(out_dir, setting)
+    else:
+        check_task_setting(out_dir, setting, required=True)
+        check_preflight_setting(out_dir, preflight_options)
+    print(f"task queue {queue_path}: {queue.stats()}")
+    queue.close()
+
+
+def build_dedup(dedup_options):
+    """根据参数打开共享的近似重复索引，dedup_options为None时不做检查"""
+    if dedup_options is None:
+        return None
+    dedup_options = dict(dedup_options)
+    index = NearDupIndex(dedup_options.pop('index_path'), dedup_options.pop('max_entries'))
+    return NearDupFilter(index, **dedup_options)
+
+
+def save_dedup_stats(dedup, in_dir, worker_num, logger):
+    if dedup is None:
+        return
+    logger.info(f"Worker {worker_num} near duplicates: {dedup.stats()}")
+    with open(os.path.join(in_dir, f"{worker_num}_dedup_stats.json"), 'w', encoding='utf-8') as file:
+        json.dump(dedup.stats(), file)
+    dedup.close()
+
+
+def save_cache_stats(cache_totals, browser_cache, in_dir, worker_num, logger):
+    """缓存命中的汇总以及复制profile模板的开销"""
+    stats = {**cache_totals.report(), **browser_cache.profileStats()}
+    logger.info(f"Worker {worker_num} browser cache: {stats}")
+    with open(os.path.join(in_dir, f"{worker_num}_cache_stats.json"), 'w', encoding='utf-8') as file:
+        json.dump(stats, file)
 
 
 # 定义一个函数，用于并行执行的任务
-def worker_function(args):
-    worker_num = args[0]
-    in_dir = args[1]
-    width = args[2]
-    height = args[3]
-    wait_timeout = args[4]
-    scrape_hover = args[5]
-    loglevel = args[6]
-    in_file = open(os.path.join(in_dir, f"{worker_num}.txt"), 'r', encoding='utf-8')
-    out_file = open(os.path.join(in_dir, f"{worker_num}_out.txt"), 'w', encoding='utf-8')
+def worker_function(options):
+    # options是按名称传入的字典，新增参数时不会影响其他参数
+    worker_num = options['worker_num']
+    in_dir = options['in_dir']
+    width = options['width']
+    height = options['height']
+    wait_timeout = options['wait_timeout']
+    scrape_hover = options['scrape_hover']
+    loglevel = options['loglevel']
+    engine = options['engine']
+    readiness = options['readiness']
+    readiness_deadline = options['readiness_deadline']
+    queue_options = options['queue_options']  # 为None时使用静态分片文件 {worker_num}.txt
+    max_attempts = options['max_attempts']
+    image_options = options['image_options']  # 截图的输出格式、质量以及后处理线程数
+    output_options = options['output_options']  # 输出方式：jsonl(每个URL一张图片) 或 tar(打包的分片)
+    browser_options = options['browser_options']  # 浏览器回收的阈值
+    resource_policy = ResourcePolicy.fromOptions(**options['resource_options'])  # 加载页面时拦截的资源
+    timeout_options = dict(options['timeout_options'])  # 页面加载策略、各类超时以及单个URL的总时间预算
+    url_budget = timeout_options.pop('url_budget')
+    # 开启了指标服务时各worker把指标写入共享目录，由主进程汇总
+    metrics = get_metrics() if options['metrics'] else None
+    viewports = options['viewports']  # 一次加载后依次截图的视口大小，空列表表示只用width x height
+    tile_options = options['tile_options']  # 向下滚动分块截图的块数和页面高度上限
+    dedup = build_dedup(options['dedup_options'])  # 近似重复检测，所有worker共用一个索引
+    # 浏览器profile的预热模板和磁盘缓存上限，None表示使用chromedriver默认的临时profile
+    cache_options = options['cache_options']
+    browser_cache = BrowserCache(**cache_options) if cache_options is not None else None
+    readiness_options = options['readiness_options']  # network_idle策略允许的未完成请求数和持续时间
+    if engine == 'cdp':
+        chrome_path = options['chrome_path']
+        tabs_per_worker = options['tabs_per_worker']
+        return cdp_worker_function(worker_num, in_dir, width, height, wait_timeout, scrape_hover, loglevel,
+                                   chrome_path, tabs_per_worker, readiness, readiness_deadline, max_attempts,
+                                   image_options, output_options, resource_policy,
+                                   timeout_options['page_load_timeout'], url_budget, metrics, dedup,
+                                   browser_cache, readiness_options)
+    # 已完成的URL记录在journal中，重启后跳过这些URL并在原输出文件后追加
+    journal = ProgressJournal(os.path.join(in_dir, f"{worker_num}_journal.txt"))
+    journal.compactIfNeeded()
     out_image_dir = os.path.join(in_dir, f"{worker_num}_images")
     driver_path = './chromedriver'
     configLogging(loglevel)
     logger = logging.getLogger(f"worker_{worker_num}")
+    logger.info(f"Worker {worker_num} resumes from journal: {journal.counts()}")
+    queue = None
+    if queue_options is not None:
+        queue_options = dict(queue_options)
+        batch_size = queue_options.pop('batch_size')
+        queue = TaskQueue(default_queue_path(in_dir), **queue_options)
+    pending_tasks = {}  # url hash -> 队列中的task_id
+    pending_captures = {}  # url hash -> 尚未落盘的截图数，多视口时一个URL对应多个样本
+
+    def onCommit(keys):
+        # 样本真正落盘后才记录为完成，进程中途退出时未落盘的URL会被重新爬取
+        for key in keys:
+            url_hash = key.split('_', 1)[0]  # 多视口、分块时截图名为 <url hash>_<width>x<height>_t<i>
+            remaining = pending_captures.pop(url_hash, 1) - 1
+            if remaining > 0:
+                pending_captures[url_hash] = remaining
+                continue
+            journal.markHashDone(url_hash)
+            task_id = pending_tasks.pop(url_hash, None)
+            if task_id is not None:
+                queue.complete(task_id)
+
+    output = build_output(out_dir=in_dir, worker_num=worker_num, on_commit=onCommit, **output_options)
     crawler = Crawler(driver_path, out_image_dir, width, height, wait_timeout, logger, draw_box=False,
                       scrape_hover=scrape_hover,
-                      nogui=True)
-    for i, url in enumerate(in_file):
+                      nogui=True, readiness=readiness, readiness_deadline=readiness_deadline, output=output,
+                      resource_policy=resource_policy, metrics=metrics, viewports=viewports, dedup=dedup,
+                      browser_cache=browser_cache,
+                      **readiness_options, **tile_options, **timeout_options, **image_options)
+    # 根据内存、崩溃和连续超时的情况回收浏览器，并保持一个预先启动的备用浏览器
+    browser_manager = BrowserManager(crawler, logger=logger, **browser_options)
+    # WebDriver调用卡住时由看门狗杀掉浏览器，每个URL的结果记录在outcomes文件中
+    watchdog = URLWatchdog(url_budget, logger=logger)
+    outcome_log = OutcomeLog(os.path.join(in_dir, f"{worker_num}_outcomes.jsonl"))
+    if queue is not None:
+        # 空闲时关闭当前的tar分片，提交其中的任务，否则最后一批任务的租约要等到超时才会释放
+        tasks = queue.iterTasks(f"worker_{worker_num}", batch_size, on_idle=output.flush)
+    else:
+        in_file = open(os.path.join(in_dir, f"{worker_num}.txt"), 'r', encoding='utf-8')
+        tasks = ((None, url.strip()) for url in in_file)
+    i = 0
+    for task_id, url in tasks:
+        if journal.shouldSkip(url, max_attempts):
+            if queue is not None and journal.status(url)[0] == 'done':
+                queue.complete(task_id)
+            elif queue is not None:
+                queue.fail(task_id, "attempts exhausted before restart")
+            continue
+        i += 1
+        start = time.monotonic()
+        watchdog.arm(driver_pid(crawler.driver))
         try:
-            results = crawler.processURL(url.strip())
+            results = crawler.processURL(url)
+            error = None
         except Exception as exp:
-            logger.error(f"Worker {worker_num} encountered an exception when processing {url}: {exp}")
+            results, error = None, exp
+        # 看门狗杀掉浏览器后，卡住的调用抛出的异常只是连接断开，结果统一记为killed；
+        # 超时恰好发生在processURL返回和disarm之间时，结果已经完整，仍按正常完成处理，只需要换一个浏览器
+        killed = watchdog.disarm()
+        if error is None:
+            outcome = OK
+        elif isinstance(error, NearDuplicate):
+            outcome = DUPLICATE
+        elif killed:
+            outcome = KILLED
+        else:
+            outcome = classify_exception(error)
+        elapsed = time.monotonic() - start
+        outcome_log.record(url, outcome, elapsed)
+        if metrics is not None:
+            metrics.urlDone(outcome, elapsed, len(results) if results else 0)
+        if outcome == DUPLICATE:
+            # 近似重复的页面不保存，但URL已经处理完，重启后不再重试
+            logger.debug(f"Worker {worker_num} skips {url}: {error}")
+            journal.markDone(url)
+            if queue is not None:
+                queue.complete(task_id)
+            browser_manager.afterURL(outcome, killed)
             continue
-        for result in results:
-            out_file.write(json.dumps(result) + '\n')
-        out_file.flush()
+        if error is not None:
+            logger.error(f"Worker {worker_num} encountered an exception when processing {url}: {error}")
+            journal.markFailed(url)
+            if queue is not None:
+                queue.fail(task_id, str(error))
+            browser_manager.afterURL(outcome, killed)
+            continue
+        key = generate_url_hash(url)
+        if queue is not None:
+            pending_tasks[key] = task_id
+        captures = crawler.splitCaptures(results)
+        pending_captures[key] = len(captures)
+        write_start = time.monotonic()
+        for capture_key, records in captures:
+            output.writeRecords(capture_key, records)
+        if metrics is not None:
+            metrics.observe('write_record', time.monotonic() - write_start)
+        browser_manager.afterURL(outcome, killed)
+
+        if i % 100 == 0:
+            logger.info(f"Worker {worker_num} has processed {i} urls, "
+                        f"screenshots: {crawler.screenshot_writer.stats()}, browser: {browser_manager.stats()}")
+    watchdog.close()
+    outcome_log.close()
+    browser_manager.close()
+    crawler.quit()  # 会等待所有截图处理完
+    logger.info(f"Worker {worker_num} screenshots: {crawler.screenshot_writer.stats()}")
+    logger.info(f"Worker {worker_num} browser: {browser_manager.stats()}")
+    with open(os.path.join(in_dir, f"{worker_num}_browser_stats.json"), 'w', encoding='utf-8') as file:
+        json.dump(browser_manager.stats(), file)
+    save_dedup_stats(dedup, in_dir, worker_num, logger)
+    if browser_cache is not None:
+        save_cache_stats(crawler.cache_totals, browser_cache, in_dir, worker_num, logger)
+    output.close()
+    journal.compact()
+    journal.close()
+    if queue is not None:
+        queue.close()
+
 
-        if i > 0 and i % 100 == 0:
-            logger.info(f"Worker {worker_num} has processed {i} urls")
-            crawler.restart()  # 重新启动一下browser，防止内存泄漏
-            logger.info(f"Worker {worker_num} has restarted the browser")
-    crawler.quit()
+def cdp_worker_function(worker_num, in_dir, width, height, wait_timeout, scrape_hover, loglevel, chrome_path,
+                        tabs_per_worker, readiness, readiness_deadline, max_attempts, image_options,
+                        output_options, resource_policy=None, page_load_timeout=None, url_budget=None,
+                        metrics=None, dedup=None, browser_cache=None, readiness_options=None):
+    """使用CDP引擎的worker：一个Chrome进程同时处理tabs_per_worker个页面"""
+    from cdp_crawler import AsyncCrawler
+
+    configLogging(loglevel)
+    logger = logging.getLogger(f"worker_{worker_num}")
+    journal = ProgressJournal(os.path.join(in_dir, f"{worker_num}_journal.txt"))
+    journal.compactIfNeeded()
+    logger.info(f"Worker {worker_num} resumes from journal: {journal.counts()}")
+    with open(os.path.join(in_dir, f"{worker_num}.txt"), 'r', encoding='utf-8') as in_file:
+        urls = [url.strip() for url in in_file if url.strip() and not journal.shouldSkip(url.strip(), max_attempts)]
+    out_image_dir = os.path.join(in_dir, f"{worker_num}_images")
+    outcome_log = OutcomeLog(os.path.join(in_dir, f"{worker_num}_outcomes.jsonl"))
+
+    async def run():
+        def onCommit(keys):
+            for key in keys:
+                journal.markHashDone(key)
+
+        output = build_output(out_dir=in_dir, worker_num=worker_num, on_commit=onCommit, **output_options)
+        crawler = AsyncCrawler(chrome_path, out_image_dir, width, height, wait_timeout, logger, draw_box=False,
+                               scrape_hover=scrape_hover, nogui=True, max_tabs=tabs_per_worker,
+                               readiness=readiness, readiness_deadline=readiness_deadline, output=output,
+                               resource_policy=resource_policy, page_load_timeout=page_load_timeout,
+                               url_budget=url_budget, metrics=metrics, dedup=dedup, browser_cache=browser_cache,
+                               **(readiness_options or {}), **image_options)
+        processed = 0
+
+        def onResult(url, results, elapsed):
+            nonlocal processed
+            outcome_log.record(url, OK, elapsed)
+            write_start = time.monotonic()
+            output.writeRecords(generate_url_hash(url), results)
+            if metrics is not None:
+                metrics.observe('write_record', time.monotonic() - write_start)
+                metrics.urlDone(OK, elapsed, len(results))
+            processed += 1
+            if processed % 100 == 0:
+                logger.info(f"Worker {worker_num} has processed {processed} urls, "
+                            f"screenshots: {crawler.screenshot_writer.stats()}")
+
+        def onError(url, exp, elapsed):
+            if isinstance(exp, NearDuplicate):
+                logger.debug(f"Worker {worker_num} skips {url}: {exp}")
+                outcome_log.record(url, DUPLICATE, elapsed)
+                if metrics is not None:
+                    metrics.urlDone(DUPLICATE, elapsed)
+                journal.markDone(url)
+                return
+            logger.error(f"Worker {worker_num} encountered an exception when processing {url}: {exp}")
+            outcome = 'timeout' if isinstance(exp, asyncio.TimeoutError) else 'error'
+            outcome_log.record(url, outcome, elapsed)
+            if metrics is not None:
+                metrics.urlDone(outcome, elapsed)
+            journal.markFailed(url)
+
+        await crawler.start()
+        try:
+            await crawler.crawl(urls, onResult, onError)
+        finally:
+            await crawler.quit()
+            logger.info(f"Worker {worker_num} screenshots: {crawler.screenshot_writer.stats()}, "
+                        f"browser restarts: {crawler.num_restarts}")
+            save_dedup_stats(dedup, in_dir, worker_num, logger)
+            if browser_cache is not None:
+                save_cache_stats(crawler.cache_totals, browser_cache, in_dir, worker_num, logger)
+            output.close()
+            outcome_log.close()
+            journal.compact()
+            journal.close()
+
+    asyncio.run(run())
 
 
 if __name__ == "__main__":
@@ -90,21 +425,161 @@ if __name__ == "__main__":
     parser.add_argument("--wait_timeout", type=int, default=10)
     parser.add_argument("--scrape_hover", action='store_true')
     parser.add_argument("--loglevel", type=str, default='INFO')
+    parser.add_argument("--cdx_status", type=str, default='',
+                        help="只爬取CDX中这些状态码的URL(逗号分隔)，例如 200，默认不过滤")
+    parser.add_argument("--cdx_mime", type=str, default='', help="只爬取这些MIME类型的URL(逗号分隔)，例如 text/html")
+    parser.add_argument("--cdx_languages", type=str, default='', help="只爬取这些语言的URL(逗号分隔，ISO-639-3)，例如 eng,zho")
+    parser.add_argument("--cdx_exclude_file", type=str, default=None, help="每行一个要排除的URL正则")
+    parser.add_argument("--cdx_procs", type=int, default=1, help="解析和过滤CDX的进程数")
+    parser.add_argument("--preflight", action='store_true',
+                        help="写出任务之前用HTTP请求预检URL，丢弃无法访问、非HTML和停放域名的URL，重定向替换为最终URL")
+    parser.add_argument("--preflight_mode", type=str, default='drop', choices=['drop', 'annotate'],
+                        help="drop: 只保留通过预检的URL；annotate: 保留所有URL，只记录预检结果")
+    parser.add_argument("--preflight_concurrency", type=int, default=200, help="预检的并发请求数")
+    parser.add_argument("--preflight_per_host", type=int, default=4, help="预检时每个host的并发请求数")
+    parser.add_argument("--preflight_timeout", type=float, default=10, help="预检单个URL的超时(秒)")
+    parser.add_argument("--engine", type=str, default='selenium', choices=['selenium', 'cdp'])
+    parser.add_argument("--chrome_path", type=str, default='google-chrome', help="cdp引擎使用的chrome可执行文件")
+    parser.add_argument("--tabs_per_worker", type=int, default=8, help="cdp引擎下每个worker同时打开的页面数")
+    parser.add_argument("--readiness", type=str, default='network_idle,dom_stable',
+                        help="逗号分隔的页面就绪检测策略: sleep, network_idle, dom_stable, resources")
+    parser.add_argument("--readiness_deadline", type=float, default=10, help="就绪检测的最长等待时间(秒)")
+    parser.add_argument("--network_idle_inflight", type=int, default=2,
+                        help="network_idle策略允许的未完成请求数，允许少量长连接(轮询、统计信标)，"
+                             "设为0时等待所有请求结束，有长连接的页面会一直等到--readiness_deadline")
+    parser.add_argument("--network_idle_ms", type=int, default=500, help="network_idle策略要求网络空闲持续的时间(毫秒)")
+    parser.add_argument("--scheduler", type=str, default='static', choices=['static', 'queue'],
+                        help="static: 预先切分成每个worker一个文件；queue: worker从共享的SQLite队列中动态领取任务")
+    parser.add_argument("--queue_batch_size", type=int, default=4, help="每次从队列中领取的URL数")
+    parser.add_argument("--max_per_host", type=int, default=1, help="每个host同时处理的URL数上限")
+    parser.add_argument("--host_interval", type=float, default=1.0, help="同一个host两次访问之间的最小间隔(秒)")
+    parser.add_argument("--max_attempts", type=int, default=3, help="每个URL的最大尝试次数")
+    parser.add_argument("--attach", action='store_true', help="加入一个已有的队列，不重新生成任务(用于中途增加worker)")
+    parser.add_argument("--image_format", type=str, default='png', choices=['png', 'webp', 'jpeg'],
+                        help="截图的保存格式，webp/jpeg可以显著减小存储")
+    parser.add_argument("--image_quality", type=int, default=90, help="webp/jpeg的编码质量")
+    parser.add_argument("--image_workers", type=int, default=2, help="每个worker中处理截图的后台线程数")
+    parser.add_argument("--output_format", type=str, default='jsonl', choices=['jsonl', 'tar'],
+                        help="jsonl: 每个URL一张图片加JSONL记录；tar: 截图和记录打包写入滚动的tar分片")
+    parser.add_argument("--shard_max_mb", type=int, default=1024, help="tar分片的大小上限(MB)")
+    parser.add_argument("--shard_max_samples", type=int, default=10000, help="tar分片的样本数上限")
+    parser.add_argument("--max_browser_rss_mb", type=int, default=2048, help="浏览器进程树的内存超过该值时回收浏览器")
+    parser.add_argument("--max_consecutive_timeouts", type=int, default=3, help="连续超时的URL数达到该值时回收浏览器")
+    parser.add_argument("--max_urls_per_browser", type=int, default=1000, help="单个浏览器最多处理的URL数，0表示不限制")
+    parser.add_argument("--no_spare_browser", action='store_true', help="不预先启动备用浏览器")
+    parser.add_argument("--block_types", type=str, default='',
+                        help="逗号分隔的拦截资源类型: media, font, ping, websocket")
+    parser.add_argument("--blocklist_file", type=str, default=None, help="要拦截的域名列表文件，每行一个域名")
+    parser.add_argument("--max_response_kb", type=int, default=0, help="丢弃超过该大小的响应(KB)，0表示不限制，仅cdp引擎支持")
+    parser.add_argument("--page_load_strategy", type=str, default='eager', choices=['normal', 'eager', 'none'],
+                        help="selenium的页面加载策略，eager只等到DOMContentLoaded，之后由就绪检测决定等待多久")
+    parser.add_argument("--page_load_timeout", type=float, default=30, help="页面导航的超时(秒)")
+    parser.add_argument("--script_timeout", type=float, default=30, help="页面内脚本的超时(秒)")
+    parser.add_argument("--url_budget", type=float, default=90,
+                        help="单个URL的总时间预算(秒)，超过后杀掉并重启浏览器")
+    parser.add_argument("--viewports", type=str, default='',
+                        help="逗号分隔的视口大小，例如 1920x1080,1366x768,1024x768；一次加载后在每个视口下分别截图，"
+                             "默认只用 width x height，仅selenium引擎支持")
+    parser.add_argument("--max_tiles", type=int, default=1,
+                        help="向下滚动分块截图的最大块数，每块单独截图并提取块内的元素，1表示不分块，仅selenium引擎支持")
+    parser.add_argument("--max_page_height", type=int, default=0, help="分块截图时最多截取的页面高度(像素)，0表示不限制")
+    parser.add_argument("--tile_overlap", type=int, default=200, help="相邻两块重叠的高度(像素)")
+    parser.add_argument("--dedup", action='store_true',
+                        help="跳过近似重复的页面(停放域名、模板页)：比较页面文本/DOM的simhash和截图的dHash")
+    parser.add_argument("--dedup_index", type=str, default=None,
+                        help="近似重复索引(SQLite)的路径，默认为 out_root/near_dup.sqlite，多次运行可以共用")
+    parser.add_argument("--dedup_max_per_cluster", type=int, default=1, help="每个近似重复簇最多保留的页面数")
+    parser.add_argument("--dedup_dom_distance", type=int, default=3, help="DOM simhash的汉明距离阈值(0-3)")
+    parser.add_argument("--dedup_image_distance", type=int, default=3, help="截图dHash的汉明距离阈值(0-3)")
+    parser.add_argument("--dedup_max_entries", type=int, default=1000000, help="索引中保留的指纹数上限")
+    parser.add_argument("--profile_template", type=str, default=None,
+                        help="预热的浏览器profile模板(由browser_cache.py生成)，每个浏览器启动时复制一份，带有常见CDN资源的缓存")
+    parser.add_argument("--disk_cache_mb", type=int, default=0, help="每个浏览器磁盘缓存的大小上限(MB)，0表示使用Chrome的默认值")
+    parser.add_argument("--metrics_port", type=int, default=0,
+                        help="在该端口上提供Prometheus指标(/metrics)，0表示不开启")
+    parser.add_argument("--worker_offset", type=int, default=0,
+                        help="worker编号的起始值，避免与已有worker的输出文件冲突，仅用于 --scheduler queue")
 
     args = parser.parse_args()
-    # 创建一个进程池，指定最大进程数
     num_workers = args.num_workers
-    pool = multiprocessing.Pool(processes=num_workers)
-
-    # 使用进程池并行执行任务
     cdx_file_path = args.cdx_file_path
     out_dir = os.path.join(args.out_root, f'tasks{args.worker_id}')
     url_st = args.worker_id * args.num_urls
     os.makedirs(out_dir, exist_ok=True)
+    if args.metrics_port:
+        # 必须在创建进程池之前设置好multiprocess目录，worker才能继承
+        start_metrics_server(args.metrics_port, os.path.join(out_dir, f'metrics_{args.worker_offset}'))
+    # 创建一个进程池，指定最大进程数
+    pool = multiprocessing.Pool(processes=num_workers)
+
+    # 使用进程池并行执行任务
     random.seed(args.seed)
-    split_task_files(cdx_file_path, out_dir, num_workers, url_st, args.num_urls)
-    args_list = [(i, out_dir, args.width, args.height, args.wait_timeout, args.scrape_hover, args.loglevel) for i in
-                 range(num_workers)]
+    output_options = {"kind": args.output_format}
+    if args.output_format == 'tar':
+        output_options.update(max_shard_bytes=args.shard_max_mb << 20, max_shard_samples=args.shard_max_samples)
+    viewports = parse_viewports(args.viewports)
+    if len(viewports) > 1 and args.engine != 'selenium':
+        parser.error("--viewports only supports the selenium engine")
+    if args.max_tiles > 1 and args.engine != 'selenium':
+        parser.error("--max_tiles only supports the selenium engine")
+    dedup_options = None
+    if args.dedup:
+        dedup_options = {"index_path": args.dedup_index or os.path.join(args.out_root, 'near_dup.sqlite'),
+                         "max_entries": args.dedup_max_entries, "dom_distance": args.dedup_dom_distance,
+                         "image_distance": args.dedup_image_distance,
+                         "max_per_cluster": args.dedup_max_per_cluster}
+    cdx_filter = CDXFilter.fromOptions(args.cdx_status, args.cdx_mime, args.cdx_languages, args.cdx_exclude_file)
+    preflight_options = None
+    if args.preflight:
+        preflight_options = {"mode": args.preflight_mode, "concurrency": args.preflight_concurrency,
+                             "per_host": args.preflight_per_host, "timeout": args.preflight_timeout}
+    cache_options = None
+    if args.profile_template or args.disk_cache_mb:
+        cache_options = {"profile_template": args.profile_template, "disk_cache_mb": args.disk_cache_mb}
+    if args.worker_offset and args.scheduler != 'queue':
+        # 静态分片只有 0..num_workers-1 这些文件
+        parser.error("--worker_offset only applies to --scheduler queue")
+    queue_options = None
+    if args.scheduler == 'queue':
+        if args.engine != 'selenium':
+            parser.error("--scheduler queue only supports the selenium engine")
+        queue_options = {"max_per_host": args.max_per_host, "host_interval": args.host_interval,
+                         "max_attempts": args.max_attempts}
+    try:
+        if queue_options is None:
+            split_task_files(cdx_file_path, out_dir, num_workers, url_st, args.num_urls, args.seed, cdx_filter,
+                             args.cdx_procs, preflight_options)
+        elif not args.attach:
+            build_task_queue(cdx_file_path, default_queue_path(out_dir), url_st, args.num_urls, args.seed,
+                             queue_options, cdx_filter, args.cdx_procs, preflight_options)
+    except TaskSettingMismatch as exp:
+        parser.error(str(exp))
+    if queue_options is not None:
+        queue_options["batch_size"] = args.queue_batch_size
+    args_list = [{"worker_num": i, "in_dir": out_dir, "width": args.width, "height": args.height,
+                  "wait_timeout": args.wait_timeout, "scrape_hover": args.scrape_hover, "loglevel": args.loglevel,
+                  "engine": args.engine, "chrome_path": args.chrome_path, "tabs_per_worker": args.tabs_per_worker,
+                  "readiness": args.readiness, "readiness_deadline": args.readiness_deadline,
+                  "queue_options": queue_options, "max_attempts": args.max_attempts,
+                  "image_options": {"image_format": args.image_format, "image_quality": args.image_quality,
+                                    "image_workers": args.image_workers},
+                  "output_options": output_options,
+                  "browser_options": {"max_rss_mb": args.max_browser_rss_mb,
+                                      "max_consecutive_timeouts": args.max_consecutive_timeouts,
+                                      "max_urls": args.max_urls_per_browser,
+                                      "keep_spare": not args.no_spare_browser},
+                  "resource_options": {"block_types": args.block_types, "blocklist_file": args.blocklist_file,
+                                       "max_response_kb": args.max_response_kb},
+                  "timeout_options": {"page_load_strategy": args.page_load_strategy,
+                                      "page_load_timeout": args.page_load_timeout,
+                                      "script_timeout": args.script_timeout, "url_budget": args.url_budget},
+                  "metrics": bool(args.metrics_port), "viewports": viewports,
+                  "tile_options": {"max_tiles": args.max_tiles, "max_page_height": args.max_page_height,
+                                   "tile_overlap": args.tile_overlap},
+                  "dedup_options": dedup_options, "cache_options": cache_options,
+                  "readiness_options": {"network_idle_inflight": args.network_idle_inflight,
+                                        "network_idle_ms": args.network_idle_ms}}
+                 for i in range(args.worker_offset, args.worker_offset + num_workers)]
     pool.map(worker_function, args_list)
     # 关闭进程池，等待所有进程完成
     pool.close()
@@ -0,0 +1,100 @@
+"""爬虫的分阶段计时和Prometheus指标
+
+processURL的每个阶段(导航、就绪等待、近似重复检查、切换视口、元素提取、截图、图片编码、写图片、写记录)的耗时记录到直方图中，
+按URL的结果(outcome)区分，失败的URL已经完成的阶段也会计入；另外统计各种结果的URL数和输出的元素数。阶段名必须是PHASES之一。
+
+各worker是multiprocessing的子进程，使用prometheus_client的multiprocess模式汇总：
+主进程在创建进程池之前调用 start_metrics_server，设置 PROMETHEUS_MULTIPROC_DIR 并在本地端口上提供 /metrics，
+子进程继承环境变量后各自把指标写入该目录下的文件，由主进程读取汇总。
+prometheus_client 在导入时根据环境变量决定是否使用multiprocess模式，因此只能在设置好环境变量之后导入。
+"""
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+PHASES = ('navigate', 'readiness', 'dedup', 'resize', 'extract', 'screenshot', 'encode', 'write_image',
+          'write_record')
+
+
+def check_phase(name):
+    if name not in PHASES:
+        raise ValueError(f"unknown phase: {name}")
+
+
+# 单个阶段的耗时从几毫秒(写输出)到几十秒(导航超时)不等
+PHASE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+
+def start_metrics_server(port, multiproc_dir):
+    """在主进程中启动 /metrics 服务，汇总所有worker写入multiproc_dir的指标"""
+    # 上一次运行留下的指标文件会被重复计入，需要先清空
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir)
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = multiproc_dir
+    from prometheus_client import CollectorRegistry, start_http_server
+    from prometheus_client import multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=multiproc_dir)
+    start_http_server(port, registry=registry)
+
+
+class CrawlMetrics:
+    def __init__(self):
+        from prometheus_client import Counter, Histogram
+
+        self.phase_seconds = Histogram('crawl_phase_seconds', 'Time spent in each phase of processing a URL',
+                                       ['phase', 'outcome'], buckets=PHASE_BUCKETS)
+        self.url_seconds = Histogram('crawl_url_seconds', 'Total time spent on a URL', buckets=PHASE_BUCKETS)
+        self.urls = Counter('crawl_urls_total', 'URLs processed, by outcome', ['outcome'])
+        self.elements = Counter('crawl_elements_total', 'Grounding elements emitted')
+
+    def observe(self, phase, seconds, outcome='ok'):
+        check_phase(phase)
+        self.phase_seconds.labels(phase, outcome).observe(seconds)
+
+    def urlDone(self, outcome, seconds=None, num_elements=0):
+        self.urls.labels(outcome).inc()
+        if seconds is not None:
+            self.url_seconds.observe(seconds)
+        if num_elements:
+            self.elements.inc(num_elements)
+
+
+_metrics = None
+
+
+def get_metrics():
+    """同一个进程中的指标只能注册一次，所有爬虫共用一个实例"""
+    global _metrics
+    if _metrics is None:
+        _metrics = CrawlMetrics()
+    return _metrics
+
+
+class PhaseTimer:
+    """记录一个URL各阶段的耗时；同一阶段可以分几段计时，finish时累加后写入指标(metrics为None时只记录)"""
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.timings = {}
+
+    @contextmanager
+    def phase(self, name):
+        check_phase(name)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.monotonic() - start
+
+    def finish(self, outcome='ok'):
+        """把各阶段耗时按URL的结果写入指标，返回写入输出记录的各阶段耗时(毫秒)
+
+        失败的URL也应该调用，超时和出错的页面往往正是耗时最长的
+        """
+        if self.metrics is not None:
+            for name, seconds in self.timings.items():
+                self.metrics.observe(name, seconds, outcome)
+        return {name: round(seconds * 1000) for name, seconds in self.timings.items()}
@@ -0,0 +1,326 @@
+"""近似重复页面的检测
+
+CDX按host去重之后仍然有大量停放域名、注册商的占位页和同一套CMS模板生成的页面，
+这些页面各自都要完整地爬一次、存一张截图，却几乎没有新的训练数据。
+这里在爬取过程中做两次检查：
+* 页面就绪后在页面内计算文本和DOM结构的64位simhash(DOM_FINGERPRINT_JS)，命中时直接跳过提取和截图
+* 截图之后计算64位的dHash，命中时不再编码和保存截图
+两种指纹都写入一个所有worker共享、持久化在磁盘上的SQLite索引，汉明距离不超过阈值的指纹归为同一个簇，
+每个簇最多保留max_per_cluster个样本，超过之后的页面被跳过。
+
+查找使用分段索引：64位指纹分成4段16位，汉明距离不超过3的两个指纹至少有一段完全相同，
+因此只需要比较至少一段相同的候选。索引的大小有上限，超过时淘汰最久没有命中的指纹以及不再有指纹的簇。
+每个页面的指纹都带有URL的hash和页面加入时在簇中的序号，同一个URL再次检查(超时重试、续爬)时沿用原来的结果，
+不会与自己上一次的指纹匹配而被当作重复。
+序号按簇中占用名额(kept)的页面计算：检查通过的页面先占一个名额，之后加载失败、超时或者被另一种指纹判为重复时，
+爬虫调用release删除它的指纹并归还名额，没有保存下来的页面不会挤掉同一模板中后来的正常页面。
+"""
+import io
+import sqlite3
+import time
+from collections import Counter
+
+from PIL import Image
+
+from utils import generate_url_hash
+
+NUM_BANDS = 4
+BAND_BITS = 64 // NUM_BANDS
+MAX_DISTANCE = NUM_BANDS - 1  # 分段索引能保证找到的最大汉明距离
+
+# 返回页面文本(3词shingle)和DOM结构(父子标签对)的64位simhash，十六进制字符串
+DOM_FINGERPRINT_JS = r"""
+var maxChars = 20000, maxElements = 3000;
+var counts = [];
+for (var b = 0; b < 64; b++) counts.push(0);
+
+function fnv(str, seed) {
+    var h = seed >>> 0;
+    for (var i = 0; i < str.length; i++) {
+        h ^= str.charCodeAt(i);
+        h = Math.imul(h, 16777619) >>> 0;
+    }
+    return h;
+}
+
+function add(token) {
+    var lo = fnv(token, 2166136261), hi = fnv(token, 3735928559);
+    for (var b = 0; b < 32; b++) {
+        counts[b] += (lo >>> b) & 1 ? 1 : -1;
+        counts[b + 32] += (hi >>> b) & 1 ? 1 : -1;
+    }
+}
+
+var text = document.body ? (document.body.innerText || '') : '';
+var words = text.slice(0, maxChars).toLowerCase().split(/\s+/).filter(function (w) { return w !== ''; });
+if (words.length < 3) {
+    for (var i = 0; i < words.length; i++) add(words[i]);
+} else {
+    for (var i = 0; i + 2 < words.length; i++) add(words[i] + ' ' + words[i + 1] + ' ' + words[i + 2]);
+}
+var elements = document.getElementsByTagName('*');
+var n = Math.min(elements.length, maxElements);
+for (var i = 0; i < n; i++) {
+    var el = elements[i];
+    add('<' + (el.parentElement ? el.parentElement.tagName : '') + '>' + el.tagName);
+}
+var hex = '';
+for (var b = 63; b >= 0; b -= 4) {
+    var nibble = 0;
+    for (var k = 0; k < 4; k++) nibble = (nibble << 1) | (counts[b - k] > 0 ? 1 : 0);
+    hex += nibble.toString(16);
+}
+return {simhash: hex, words: words.length, elements: elements.length};
+"""
+
+
+def build_fingerprint_expression():
+    """把指纹脚本包装成可以直接求值的表达式，供CDP的Runtime.evaluate使用"""
+    return "(function() {%s})()" % DOM_FINGERPRINT_JS
+
+
+def dhash(png_bytes, size=8):
+    """截图的差值哈希：缩小到 (size+1) x size 的灰度图，比较水平相邻像素的亮度"""
+    image = Image.open(io.BytesIO(png_bytes))
+    image = image.resize((size + 1, size), Image.BILINEAR, reducing_gap=2.0).convert('L')
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def to_signed(value):
+    # SQLite的INTEGER是有符号64位
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def bands(value):
+    return [(value >> (BAND_BITS * i)) & ((1 << BAND_BITS) - 1) for i in range(NUM_BANDS)]
+
+
+class NearDuplicate(Exception):
+    """页面属于一个已经达到样本上限的近似重复簇"""
+
+    def __init__(self, kind, cluster, size, example_url):
+        super().__init__(f"near duplicate ({kind}) of cluster {cluster} with {size} pages, e.g. {example_url}")
+        self.kind = kind
+        self.cluster = cluster
+        self.size = size
+
+
+class NearDupIndex:
+    def __init__(self, db_path, max_entries=1000000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.num_inserts = 0
+        # cdp引擎在事件循环之外的线程里查询索引
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS clusters (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL DEFAULT 0,
+                kept INTEGER NOT NULL DEFAULT 0,
+                skipped INTEGER NOT NULL DEFAULT 0,
+                example_url TEXT
+            );
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                hash INTEGER NOT NULL,
+                band0 INTEGER NOT NULL,
+                band1 INTEGER NOT NULL,
+                band2 INTEGER NOT NULL,
+                band3 INTEGER NOT NULL,
+                cluster INTEGER NOT NULL,
+                url_hash TEXT NOT NULL,
+                rank INTEGER NOT NULL,
+                kept INTEGER NOT NULL,
+                last_seen REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_fp_band0 ON fingerprints(kind, band0);
+            CREATE INDEX IF NOT EXISTS idx_fp_band1 ON fingerprints(kind, band1);
+            CREATE INDEX IF NOT EXISTS idx_fp_band2 ON fingerprints(kind, band2);
+            CREATE INDEX IF NOT EXISTS idx_fp_band3 ON fingerprints(kind, band3);
+            CREATE INDEX IF NOT EXISTS idx_fp_last_seen ON fingerprints(last_seen);
+            CREATE INDEX IF NOT EXISTS idx_fp_url ON fingerprints(kind, url_hash);
+            CREATE INDEX IF NOT EXISTS idx_fp_cluster ON fingerprints(cluster);
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __nearest(self, kind, value, max_distance):
+        parts = bands(value)
+        rows = self.conn.execute(
+            "SELECT id, hash, cluster FROM fingerprints WHERE kind = ? "
+            "AND (band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?)", (kind, *parts)).fetchall()
+        best = None
+        for row_id, other, cluster in rows:
+            distance = bin(value ^ to_unsigned(other)).count('1')
+            if distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, row_id, cluster)
+        return best
+
+    def add(self, kind, value, url, max_distance, max_per_cluster):
+        """把指纹加入索引，返回 (簇id, 该页面在簇中的序号, 簇的大小, 簇中第一个页面的URL)
+
+        序号不超过max_per_cluster的页面在簇中占一个名额(kept)，页面最终没有保存时需要调用release归还；
+        同一个URL已经在索引中时不重复计数，返回它第一次加入时的结果
+        """
+        now = time.time()
+        url_hash = generate_url_hash(url)
+        # BEGIN IMMEDIATE 保证多个worker同时加入相似的指纹时不会各自新建一个簇
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            seen = self.conn.execute("SELECT id, cluster, rank FROM fingerprints WHERE kind = ? AND url_hash = ?",
+                                     (kind, url_hash)).fetchone()
+            if seen is not None:
+                row_id, cluster, rank = seen
+                self.conn.execute("UPDATE fingerprints SET last_seen = ? WHERE id = ?", (now, row_id))
+                size, example_url = self.conn.execute("SELECT size, example_url FROM clusters WHERE id = ?",
+                                                      (cluster,)).fetchone()
+                self.conn.execute("COMMIT")
+                return cluster, rank, size, example_url
+            best = self.__nearest(kind, value, max_distance)
+            if best is not None:
+                _, row_id, cluster = best
+                self.conn.execute("UPDATE fingerprints SET last_seen = ? WHERE id = ?", (now, row_id))
+                size, kept, example_url = self.conn.execute(
+                    "SELECT size, kept, example_url FROM clusters WHERE id = ?", (cluster,)).fetchone()
+                rank = kept + 1
+            else:
+                cluster = self.conn.execute("INSERT INTO clusters (kind, example_url) VALUES (?, ?)",
+                                            (kind, url)).lastrowid
+                size, rank, example_url = 0, 1, url
+            kept = 1 if rank <= max_per_cluster else 0
+            self.conn.execute("UPDATE clusters SET size = size + 1, kept = kept + ? WHERE id = ?", (kept, cluster))
+            self.conn.execute("INSERT INTO fingerprints (kind, hash, band0, band1, band2, band3, cluster, url_hash, "
+                              "rank, kept, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                              (kind, to_signed(value), *bands(value), cluster, url_hash, rank, kept, now))
+            self.num_inserts += 1
+            if self.num_inserts % 1000 == 0:
+                self.__evict()
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return cluster, rank, size + 1, example_url
+
+    def release(self, url):
+        """页面没有保存(加载失败、超时或者另一种指纹判为重复)时，删除它占用名额的指纹并归还名额，
+        簇中后来的页面不会因为一个没有保存下来的页面而被跳过；重试时重新检查"""
+        url_hash = generate_url_hash(url)
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self.conn.execute("SELECT id, cluster FROM fingerprints WHERE url_hash = ? AND kept = 1",
+                                     (url_hash,)).fetchall()
+            for row_id, cluster in rows:
+                self.conn.execute("DELETE FROM fingerprints WHERE id = ?", (row_id,))
+                self.conn.execute("UPDATE clusters SET size = size - 1, kept = kept - 1 WHERE id = ?", (cluster,))
+                self.conn.execute("DELETE FROM clusters WHERE id = ? AND NOT EXISTS "
+                                  "(SELECT 1 FROM fingerprints WHERE cluster = ?)", (cluster, cluster))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def __evict(self):
+        count = self.conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute("DELETE FROM fingerprints WHERE id IN "
+                              "(SELECT id FROM fingerprints ORDER BY last_seen LIMIT ?)", (count - self.max_entries,))
+            # 所有指纹都被淘汰的簇不会再被匹配到
+            self.conn.execute("DELETE FROM clusters WHERE NOT EXISTS "
+                              "(SELECT 1 FROM fingerprints WHERE fingerprints.cluster = clusters.id)")
+
+    def markSkipped(self, cluster):
+        self.conn.execute("UPDATE clusters SET skipped = skipped + 1 WHERE id = ?", (cluster,))
+
+    def clusterSizes(self, kind=None):
+        """簇大小的分布：{簇大小: 簇的个数}"""
+        query = "SELECT size, COUNT(*) FROM clusters"
+        params = ()
+        if kind is not None:
+            query += " WHERE kind = ?"
+            params = (kind,)
+        return dict(self.conn.execute(query + " GROUP BY size ORDER BY size", params).fetchall())
+
+    def largestClusters(self, limit=20):
+        return self.conn.execute("SELECT id, kind, size, skipped, example_url FROM clusters "
+                                 "ORDER BY size DESC LIMIT ?", (limit,)).fetchall()
+
+
+class NearDupFilter:
+    """爬虫中使用的过滤器：检查页面的两种指纹，超过簇的样本上限时抛出NearDuplicate"""
+
+    def __init__(self, index, dom_distance=3, image_distance=3, max_per_cluster=1):
+        for distance in (dom_distance, image_distance):
+            if distance > MAX_DISTANCE:
+                raise ValueError(f"max hamming distance is {MAX_DISTANCE}, got {distance}")
+        self.index = index
+        self.max_distance = {'dom': dom_distance, 'image': image_distance}
+        self.max_per_cluster = max_per_cluster
+        self.checked = Counter()
+        self.skipped = Counter()
+        self.skipped_cluster_sizes = Counter()  # 被跳过时所在簇的大小
+        self.released = 0
+
+    def check(self, kind, value, url):
+        self.checked[kind] += 1
+        cluster, rank, size, example_url = self.index.add(kind, value, url, self.max_distance[kind],
+                                                          self.max_per_cluster)
+        if rank > self.max_per_cluster:
+            self.index.markSkipped(cluster)
+            self.skipped[kind] += 1
+            self.skipped_cluster_sizes[size] += 1
+            raise NearDuplicate(kind, cluster, size, example_url)
+
+    def checkDom(self, fingerprint, url):
+        """fingerprint为DOM_FINGERPRINT_JS的返回值"""
+        self.check('dom', int(fingerprint['simhash'], 16), url)
+
+    def checkImage(self, png_bytes, url):
+        self.check('image', dhash(png_bytes), url)
+
+    def release(self, url):
+        """页面检查通过之后没有保存下来时调用，归还它在簇中占用的名额"""
+        if self.index.release(url):
+            self.released += 1
+
+    def stats(self):
+        return {
+            "checked": dict(self.checked),
+            "skipped": dict(self.skipped),
+            "skipped_cluster_sizes": {str(size): count for size, count in sorted(self.skipped_cluster_sizes.items())},
+            "released": self.released,
+        }
+
+    def close(self):
+        self.index.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="查看近似重复索引中簇的大小分布，用于调整阈值")
+    parser.add_argument("--index", type=str, required=True)
+    parser.add_argument("--top", type=int, default=20, help="列出最大的若干个簇")
+    args = parser.parse_args()
+    index = NearDupIndex(args.index)
+    for kind in ('dom', 'image'):
+        print(f"{kind} cluster sizes: {index.clusterSizes(kind)}")
+    for cluster, kind, size, skipped, example_url in index.largestClusters(args.top):
+        print(f"cluster {cluster} ({kind}): size={size} skipped={skipped} e.g. {example_url}")
+    index.close()
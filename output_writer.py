@@ -0,0 +1,223 @@
+"""爬取结果的输出方式
+
+* JsonlPngOutput: 原来的布局，每个URL一张图片 {worker}_images/<md5>.<ext>，元素记录逐行写入 {worker}_out.txt；
+  元素记录先保存在内存中，图片写盘之后才写入 {worker}_out.txt 并提交
+* TarShardOutput: 把截图和该页面的元素记录打包写入滚动的tar分片(WebDataset风格)，
+  每个样本在tar中是 <md5>.<ext> 和 <md5>.json 两个成员；分片达到大小或样本数上限时关闭并开始新分片。
+  分片先写成 .tar.tmp，关闭时fsync后原子地重命名为 .tar，同时在索引文件中追加每个样本的位置，
+  因此读取方只会看到完整的分片。
+
+截图由后台线程编码(见image_pipeline)，通过 writeImage 交给输出；元素记录由爬虫线程通过 writeRecords 写入。
+样本真正落盘(对tar来说是分片关闭)之后才会调用 on_commit(keys)，调用方可以据此更新进度日志。
+没有新样本写入时(例如队列中暂时没有任务)，调用方应定期调用 flush()，让已经写入的样本及时落盘并提交。
+"""
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+
+
+class JsonlPngOutput:
+    def __init__(self, out_dir, worker_num, on_commit=None):
+        self.image_dir = os.path.join(out_dir, f"{worker_num}_images")
+        os.makedirs(self.image_dir, exist_ok=True)
+        self.out_file = open(os.path.join(out_dir, f"{worker_num}_out.txt"), 'a', encoding='utf-8')
+        self.on_commit = on_commit
+        self.lock = threading.Lock()
+        self.images = set()  # 已经写盘的图片，由后台线程加入
+        self.records = {}  # key -> records，等待图片写盘后再写入out_file
+        self.num_dropped = 0
+
+    def imagePath(self, key, extension):
+        return os.path.join(self.image_dir, key + extension)
+
+    def writeImage(self, image_path, data):
+        with open(image_path, 'wb') as file:
+            file.write(data)
+        with self.lock:
+            self.images.add(os.path.splitext(os.path.basename(image_path))[0])
+
+    def writeRecords(self, key, records):
+        with self.lock:
+            self.records[key] = records
+        self.__commitReady()
+
+    def __commitReady(self):
+        # 图片在后台线程中写完，记录的写入和提交放在调用writeRecords/flush的线程里，调用方不需要处理多线程；
+        # 图片落盘之前记录只保存在内存中，崩溃后重爬不会在out_file中留下重复的记录
+        with self.lock:
+            ready = [key for key in self.records if key in self.images]
+            samples = [(key, self.records.pop(key)) for key in ready]
+            self.images.difference_update(ready)
+        if not samples:
+            return
+        for _, records in samples:
+            for record in records:
+                self.out_file.write(json.dumps(record) + '\n')
+        self.out_file.flush()
+        if self.on_commit is not None:
+            self.on_commit(ready)
+
+    def flush(self):
+        self.__commitReady()
+
+    def close(self):
+        self.__commitReady()
+        with self.lock:
+            # 截图编码失败或者页面没有写入记录，无法组成完整的样本
+            self.num_dropped += len(self.images) + len(self.records)
+            self.images.clear()
+            self.records.clear()
+        self.out_file.close()
+
+
+class TarShardOutput:
+    def __init__(self, out_dir, worker_num, max_shard_bytes=1 << 30, max_shard_samples=10000, max_shard_seconds=300,
+                 on_commit=None):
+        self.shard_dir = os.path.join(out_dir, f"{worker_num}_shards")
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self.prefix = str(worker_num)
+        self.max_shard_bytes = max_shard_bytes
+        self.max_shard_samples = max_shard_samples
+        self.max_shard_seconds = max_shard_seconds  # 分片打开的最长时间，保证样本能及时落盘并提交
+        self.on_commit = on_commit
+        self.index_file = open(os.path.join(self.shard_dir, f"{self.prefix}.index.jsonl"), 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.images = {}  # key -> (member name, bytes)，由后台线程写入
+        self.records = {}  # key -> records，等待对应的截图
+        self.num_dropped = 0
+        self.seq = self.__nextSeq()
+        self.tar = None
+        self.shard_name = None
+        self.shard_opened_at = 0
+        self.shard_samples = []
+
+    def __nextSeq(self):
+        # 续爬时接着已有的分片编号；上次没有正常关闭的 .tmp 分片直接丢弃
+        seq = 0
+        for name in os.listdir(self.shard_dir):
+            if name.endswith('.tar.tmp'):
+                os.remove(os.path.join(self.shard_dir, name))
+            elif name.startswith(self.prefix + '-') and name.endswith('.tar'):
+                seq = max(seq, int(name[len(self.prefix) + 1:-4]) + 1)
+        return seq
+
+    def imagePath(self, key, extension):
+        # tar中的成员名，同时作为记录中的image_path
+        return key + extension
+
+    def writeImage(self, image_path, data):
+        key = os.path.splitext(image_path)[0]
+        with self.lock:
+            self.images[key] = (image_path, data)
+
+    def writeRecords(self, key, records):
+        with self.lock:
+            self.records[key] = records
+        self.__drain()
+
+    def __drain(self):
+        with self.lock:
+            ready = [key for key in self.records if key in self.images]
+            samples = [(key, self.images.pop(key), self.records.pop(key)) for key in ready]
+        for key, (image_name, data), records in samples:
+            self.__writeSample(key, image_name, data, records)
+
+    def __addMember(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self.tar.addfile(info, io.BytesIO(data))
+        # 写模式下tarfile不会设置offset_data；数据紧跟在头部之后，按块补齐到512字节，
+        # 从写完后的位置往回推算，长文件名的扩展头也不影响结果
+        blocks = (info.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+        return self.tar.offset - blocks * tarfile.BLOCKSIZE, info.size
+
+    def __writeSample(self, key, image_name, data, records):
+        if self.tar is None:
+            self.shard_name = f"{self.prefix}-{self.seq:06d}.tar"
+            self.tar = tarfile.open(os.path.join(self.shard_dir, self.shard_name + '.tmp'), 'w')
+            self.shard_opened_at = time.monotonic()
+            self.shard_samples = []
+        image = self.__addMember(image_name, data)
+        annotation = self.__addMember(key + '.json', json.dumps(records).encode('utf-8'))
+        self.shard_samples.append({"key": key, "shard": self.shard_name, "image": [image_name, *image],
+                                   "json": [key + '.json', *annotation]})
+        if (len(self.shard_samples) >= self.max_shard_samples or self.tar.offset >= self.max_shard_bytes
+                or time.monotonic() - self.shard_opened_at >= self.max_shard_seconds):
+            self.rotate()
+
+    def flush(self):
+        """写入已经配对的样本并关闭当前分片，在空闲时调用"""
+        self.__drain()
+        self.rotate()
+
+    def rotate(self):
+        """关闭当前分片：fsync后原子重命名，再把样本写入索引"""
+        if self.tar is None:
+            return
+        self.tar.close()
+        tmp_path = os.path.join(self.shard_dir, self.shard_name + '.tmp')
+        with open(tmp_path, 'rb') as file:
+            os.fsync(file.fileno())
+        os.replace(tmp_path, os.path.join(self.shard_dir, self.shard_name))
+        for sample in self.shard_samples:
+            self.index_file.write(json.dumps(sample) + '\n')
+        self.index_file.flush()
+        self.tar = None
+        self.seq += 1
+        if self.on_commit is not None:
+            self.on_commit([sample['key'] for sample in self.shard_samples])
+        self.shard_samples = []
+
+    def close(self):
+        self.__drain()
+        with self.lock:
+            # 截图编码失败或者页面没有写入记录，无法组成完整的样本
+            self.num_dropped += len(self.images) + len(self.records)
+            self.images.clear()
+            self.records.clear()
+        self.rotate()
+        self.index_file.close()
+
+
+def build_output(kind, out_dir, worker_num, on_commit=None, **options):
+    if kind == 'jsonl':
+        return JsonlPngOutput(out_dir, worker_num, on_commit=on_commit)
+    if kind == 'tar':
+        return TarShardOutput(out_dir, worker_num, on_commit=on_commit, **options)
+    raise ValueError(f"unknown output format: {kind}")
+
+
+def iter_shard_samples(shard_dir):
+    """依次读取shard_dir中所有完整分片的样本，产出 (key, 图片成员名, 图片字节, 元素记录)"""
+    for name in sorted(os.listdir(shard_dir)):
+        if not name.endswith('.tar'):
+            continue
+        with tarfile.open(os.path.join(shard_dir, name), 'r') as tar:
+            image = None
+            for member in tar:
+                data = tar.extractfile(member).read()
+                if member.name.endswith('.json'):
+                    key = member.name[:-5]
+                    if image is not None and os.path.splitext(image[0])[0] == key:
+                        yield key, image[0], image[1], json.loads(data)
+                    image = None
+                else:
+                    image = (member.name, data)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="统计tar分片中的样本数和元素数")
+    parser.add_argument('--shard_dir', type=str, required=True)
+    args = parser.parse_args()
+    num_samples = num_records = num_bytes = 0
+    for _, _, image_bytes, records in iter_shard_samples(args.shard_dir):
+        num_samples += 1
+        num_records += len(records)
+        num_bytes += len(image_bytes)
+    print(f"samples: {num_samples}, records: {num_records}, image bytes: {num_bytes}")
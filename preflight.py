@@ -0,0 +1,200 @@
+"""浏览器之前的HTTP预检
+
+CDX中相当一部分URL已经无法访问、DNS解析超时、跳转到停放域名或者返回的不是HTML，
+每一个都要占用一次浏览器直到超时。这里在写出分片(或放入任务队列)之前用aiohttp并发地请求一遍：
+* 一个连接池，带DNS缓存，总并发数和每个host的并发数都有上限
+* 跟随重定向，保留的URL替换为最终的URL，跳转到停放域名服务的URL被丢弃
+* 用HEAD请求只读取响应头，根据状态码和Content-Type判断是否为可以爬取的HTML页面；
+  HEAD返回错误状态码(>=400，不少服务器不支持或拒绝HEAD)时改用GET并只读取有限的响应体，连接都能放回连接池复用
+每个URL的结果写入 preflight.jsonl，统计写入 preflight_stats.json，与分片文件放在同一个目录。
+"""
+import asyncio
+import json
+import os
+import socket
+import time
+from collections import Counter
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+
+OK = 'ok'
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# GET时最多读取的响应体，读完的连接才能复用；更大的响应体只能关闭连接
+MAX_BODY_BYTES = 64 << 10
+
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+
+# 浏览器中有可能正常打开的状态码(反爬、限流)，预检时不丢弃
+SOFT_STATUSES = (401, 403, 429, 503)
+
+# 常见的域名停放服务，跳转到这些域名的页面没有内容
+PARKING_HOSTS = ('sedoparking.com', 'parkingcrew.net', 'bodis.com', 'above.com', 'hugedomains.com', 'dan.com',
+                 'afternic.com', 'undeveloped.com', 'parklogic.com', 'domainmarket.com', 'sav.com')
+
+USER_AGENT = ("Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+              "Chrome/119.0.0.0 Safari/537.36")
+
+
+def is_parked(url, parking_hosts=PARKING_HOSTS):
+    host = (urlparse(url).hostname or '').lower()
+    return any(host == parked or host.endswith('.' + parked) for parked in parking_hosts)
+
+
+def classify_error(exp):
+    if isinstance(exp, asyncio.TimeoutError):
+        return 'timeout'
+    if isinstance(exp, (aiohttp.ClientConnectorCertificateError, aiohttp.ClientSSLError)):
+        return 'ssl'
+    if isinstance(exp, aiohttp.ClientConnectorError):
+        if isinstance(exp.os_error, socket.gaierror):
+            return 'dns'
+        return 'connect'
+    return 'error'
+
+
+class Preflight:
+    def __init__(self, concurrency=200, per_host=4, timeout=10, max_redirects=10, dns_ttl=300,
+                 soft_statuses=SOFT_STATUSES, parking_hosts=PARKING_HOSTS):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout  # 单个URL的总超时(秒)，包括DNS、连接和所有重定向
+        self.max_redirects = max_redirects
+        self.dns_ttl = dns_ttl
+        self.soft_statuses = set(soft_statuses)
+        self.parking_hosts = parking_hosts
+
+    async def probe(self, session, url):
+        """请求url并返回结果；outcome为OK时final_url为重定向之后的URL"""
+        result = {"url": url, "final_url": None, "status": None, "mime": None, "redirects": 0, "outcome": None}
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self.follow(session, url, result), self.timeout)
+        except Exception as exp:
+            result['outcome'] = classify_error(exp)
+        result['elapsed_ms'] = round((time.monotonic() - start) * 1000)
+        return result
+
+    async def request(self, session, url):
+        """请求url的响应头，返回 (状态码, Content-Type, Location)"""
+        async with session.head(url, allow_redirects=False) as response:
+            # 很多服务器对HEAD返回400/403/404/405/501等错误，GET却正常，出错时都用GET再确认一次
+            if response.status < 400:
+                return response.status, response.content_type, response.headers.get('Location')
+        async with session.get(url, allow_redirects=False) as response:
+            await response.content.read(MAX_BODY_BYTES)
+            response.release()
+            return response.status, response.content_type, response.headers.get('Location')
+
+    async def follow(self, session, url, result):
+        # 手动跟随重定向，跳转到停放域名时不必再请求停放页面本身
+        current = url
+        for _ in range(self.max_redirects + 1):
+            status, mime, location = await self.request(session, current)
+            if status not in REDIRECT_STATUSES or location is None:
+                result['status'] = status
+                result['mime'] = mime
+                result['final_url'] = current
+                result['outcome'] = self.judge(status, mime, current)
+                return
+            current = urljoin(current, location)
+            result['redirects'] += 1
+            if is_parked(current, self.parking_hosts):
+                result['final_url'] = current
+                result['outcome'] = 'parked'
+                return
+        result['outcome'] = 'redirects'
+
+    def judge(self, status, mime, final_url):
+        if status >= 400 and status not in self.soft_statuses:
+            return 'http_status'
+        if is_parked(final_url, self.parking_hosts):
+            return 'parked'
+        # 没有Content-Type时aiohttp给出application/octet-stream，交给浏览器判断
+        if mime not in HTML_TYPES and mime != 'application/octet-stream':
+            return 'non_html'
+        return OK
+
+    async def run(self, urls, on_result):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host,
+                                         use_dns_cache=True, ttl_dns_cache=self.dns_ttl)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers={"User-Agent": USER_AGENT}) as session:
+            async def probeOne(index, url):
+                on_result(index, await self.probe(session, url))
+
+            pending = set()
+            for index, url in enumerate(urls):
+                # 与连接池的上限配合，控制同时存在的task数量
+                if len(pending) >= self.concurrency * 2:
+                    _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.add(asyncio.ensure_future(probeOne(index, url)))
+            if pending:
+                await asyncio.wait(pending)
+
+    def check(self, urls):
+        """同步接口：返回与urls一一对应的结果"""
+        urls = list(urls)
+        results = [None] * len(urls)
+
+        def onResult(index, result):
+            results[index] = result
+
+        asyncio.run(self.run(urls, onResult))
+        return results
+
+
+def summarize(results, kept, elapsed):
+    outcomes = Counter(result['outcome'] for result in results)
+    return {
+        "urls": len(results),
+        "kept": len(kept),
+        "outcomes": dict(outcomes),
+        "redirected": sum(1 for result in results if result['redirects']),
+        "seconds": round(elapsed, 3),
+        "urls_per_s": round(len(results) / elapsed, 1) if elapsed else 0,
+    }
+
+
+def preflight_urls(urls, out_dir, mode='drop', **options):
+    """预检urls，返回交给浏览器的URL列表，并在out_dir中写出每个URL的结果和统计
+
+    mode为drop时只保留通过预检的URL(替换为重定向后的URL并去重)，annotate时保留所有原始URL、只记录结果
+    """
+    start = time.monotonic()
+    results = Preflight(**options).check(urls)
+    if mode == 'annotate':
+        kept = [result['url'] for result in results]
+    else:
+        kept = list(dict.fromkeys(result['final_url'] for result in results if result['outcome'] == OK))
+    stats = summarize(results, kept, time.monotonic() - start)
+    with open(os.path.join(out_dir, 'preflight.jsonl'), 'w', encoding='utf-8') as file:
+        for result in results:
+            file.write(json.dumps(result, ensure_ascii=False) + '\n')
+    with open(os.path.join(out_dir, 'preflight_stats.json'), 'w', encoding='utf-8') as file:
+        json.dump(stats, file)
+    print(f"preflight: {stats}")
+    return kept
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="对URL列表做HTTP预检，输出每个URL的结果和统计")
+    parser.add_argument("--url_file", type=str, required=True, help="每行一个URL")
+    parser.add_argument("--out_dir", type=str, required=True)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--per_host", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=10)
+    args = parser.parse_args()
+    with open(args.url_file, 'r', encoding='utf-8') as url_file:
+        urls = [line.strip() for line in url_file if line.strip()]
+    os.makedirs(args.out_dir, exist_ok=True)
+    kept = preflight_urls(urls, args.out_dir, concurrency=args.concurrency, per_host=args.per_host,
+                          timeout=args.timeout)
+    with open(os.path.join(args.out_dir, 'preflight_urls.txt'), 'w', encoding='utf-8') as out_file:
+        for url in kept:
+            out_file.write(url + '\n')
@@ -1,8 +1,14 @@
 from tqdm import tqdm
 from urllib.parse import urlparse
+import multiprocessing
+import os
 import random
+import shutil
+import tempfile
+import zlib
 import argparse
-from utils import parse_url_from_cdx_line
+import json
+from cdx_reader import CDXFilter, CDXStats, iter_cdx_records
 
 
 
@@ -15,22 +21,114 @@ def get_host_from_url(url):
         return None
 
 
-def distinct_urls_from_cdx(cdx_file_path, unique_cdx_file_path):
+def distinct_urls_from_cdx(cdx_file_path, unique_cdx_file_path, cdx_filter=None, num_procs=1, stats=None):
     domain_dict = {}
-    with open(cdx_file_path, 'r', encoding='utf-8') as in_file:
-        for line in tqdm(in_file):
-            url = parse_url_from_cdx_line(line)
-            host = get_host_from_url(url)
-            if host in domain_dict:
-                domain_dict[host].append(line)
-            else:
-                domain_dict[host] = [line]
+    for url, line in iter_cdx_records(cdx_file_path, cdx_filter, num_procs, stats):
+        host = get_host_from_url(url)
+        if host in domain_dict:
+            domain_dict[host].append(line)
+        else:
+            domain_dict[host] = [line]
     with open(unique_cdx_file_path, 'w', encoding='utf-8') as out_file:
         for host in tqdm(domain_dict):
             line = random.choice(domain_dict[host])
             out_file.write(line)
 
 
+def choose_line_per_host(cdx_file_path, rng=random, max_hosts=None, cdx_filter=None, num_procs=1, stats=None):
+    """每个host只保留一行，内存占用为O(hosts)
+
+    第一遍统计每个host的行数，按host首次出现的顺序为每个host抽取一个下标，
+    与 distinct_urls_from_cdx 中 random.choice 消耗随机数的方式完全一致，因此相同seed下结果相同；
+    第二遍取出被选中的行。host数超过max_hosts时返回None。
+    """
+    remaining = {}
+    for url, _ in iter_cdx_records(cdx_file_path, cdx_filter, num_procs, stats):
+        host = get_host_from_url(url)
+        remaining[host] = remaining.get(host, 0) + 1
+        if max_hosts is not None and len(remaining) > max_hosts:
+            return None
+    for host in remaining:
+        remaining[host] = rng.choice(range(remaining[host]))
+
+    chosen = dict.fromkeys(remaining)
+    # 第二遍的过滤结果与第一遍相同，不再重复统计
+    for url, line in iter_cdx_records(cdx_file_path, cdx_filter, num_procs):
+        host = get_host_from_url(url)
+        if remaining[host] == 0:
+            chosen[host] = line
+        remaining[host] -= 1
+    return chosen
+
+
+def write_chosen_lines(chosen, unique_cdx_file_path):
+    with open(unique_cdx_file_path, 'w', encoding='utf-8') as out_file:
+        for line in chosen.values():
+            out_file.write(line)
+
+
+def host_partition(host, num_partitions):
+    # 使用稳定的hash，保证不同进程、不同次运行的划分一致
+    return zlib.crc32((host or '').encode('utf-8')) % num_partitions
+
+
+def partition_cdx_by_host(cdx_file_path, tmp_dir, num_partitions, cdx_filter=None, num_procs=1, stats=None):
+    """把CDX按host的hash拆分到num_partitions个文件中，同一个host的行一定落在同一个文件；过滤在拆分时完成"""
+    paths = [os.path.join(tmp_dir, f"part_{i}") for i in range(num_partitions)]
+    files = [open(path, 'w', encoding='utf-8') for path in paths]
+    try:
+        for url, line in iter_cdx_records(cdx_file_path, cdx_filter, num_procs, stats):
+            host = get_host_from_url(url)
+            files[host_partition(host, num_partitions)].write(line)
+    finally:
+        for file in files:
+            file.close()
+    return paths
+
+
+def dedup_partition(args):
+    part_path, seed, index = args
+    out_path = part_path + '.unique'
+    chosen = choose_line_per_host(part_path, random.Random(f"{seed}-{index}"))
+    write_chosen_lines(chosen, out_path)
+    os.remove(part_path)
+    return out_path
+
+
+def distinct_urls_partitioned(cdx_file_path, unique_cdx_file_path, seed, num_partitions, num_procs, tmp_dir=None,
+                              cdx_filter=None, stats=None):
+    """外存去重：先按host拆分到磁盘，再逐个(或多进程并行)对每个分区去重，最后按分区顺序合并"""
+    work_dir = tempfile.mkdtemp(prefix='cdx_dedup_', dir=tmp_dir)
+    try:
+        part_paths = partition_cdx_by_host(cdx_file_path, work_dir, num_partitions, cdx_filter, num_procs, stats)
+        tasks = [(path, seed, i) for i, path in enumerate(part_paths)]
+        if num_procs > 1:
+            with multiprocessing.Pool(processes=num_procs) as pool:
+                out_paths = pool.map(dedup_partition, tasks)
+        else:
+            out_paths = [dedup_partition(task) for task in tasks]
+        with open(unique_cdx_file_path, 'w', encoding='utf-8') as out_file:
+            for path in out_paths:
+                with open(path, 'r', encoding='utf-8') as part_file:
+                    shutil.copyfileobj(part_file, out_file)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def distinct_urls_streaming(cdx_file_path, unique_cdx_file_path, seed, max_hosts, num_partitions, num_procs,
+                            tmp_dir=None, cdx_filter=None, parse_procs=1, stats=None):
+    if num_procs <= 1:
+        chosen = choose_line_per_host(cdx_file_path, random, max_hosts, cdx_filter, parse_procs, stats)
+        if chosen is not None:
+            write_chosen_lines(chosen, unique_cdx_file_path)
+            return
+        print(f"more than {max_hosts} hosts, spill to disk with {num_partitions} partitions")
+        if stats is not None:
+            stats.reset()  # 第一遍中途放弃了，统计以拆分时的一遍为准
+    distinct_urls_partitioned(cdx_file_path, unique_cdx_file_path, seed, num_partitions, num_procs, tmp_dir,
+                              cdx_filter, stats)
+
+
 def main(args):
     random.seed(args.seed)
     cdx_file_path = args.cdx_file_path
@@ -38,7 +136,15 @@ def main(args):
         unique_cdx_file_path = cdx_file_path + '-unique'
     else:
         unique_cdx_file_path = args.unique_cdx_file_path
-    distinct_urls_from_cdx(cdx_file_path, unique_cdx_file_path)
+    cdx_filter = CDXFilter.fromOptions(args.status, args.mime, args.languages, args.exclude_file)
+    stats = CDXStats()
+    if args.mode == 'memory':
+        distinct_urls_from_cdx(cdx_file_path, unique_cdx_file_path, cdx_filter, args.parse_procs, stats)
+    else:
+        distinct_urls_streaming(cdx_file_path, unique_cdx_file_path, args.seed, args.max_hosts_in_memory,
+                                args.num_partitions, args.num_procs, args.tmp_dir, cdx_filter, args.parse_procs,
+                                stats)
+    print(f"cdx filter: {json.dumps(stats.report())}")
 
 
 if __name__ == '__main__':
@@ -46,5 +152,18 @@ if __name__ == '__main__':
     parser.add_argument('--cdx_file_path', type=str, default='/cpfs01/user/chengkanzhi/url-base/cdx-merged')
     parser.add_argument('--unique_cdx_file_path', type=str, default=None)
     parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--mode', type=str, default='stream', choices=['stream', 'memory'],
+                        help="stream: 每个host只保留一行，内存为O(hosts)；memory: 原来的实现，保存所有行")
+    parser.add_argument('--max_hosts_in_memory', type=int, default=50000000,
+                        help="host数超过该值时按host拆分到磁盘上处理")
+    parser.add_argument('--num_partitions', type=int, default=64)
+    parser.add_argument('--num_procs', type=int, default=1, help="大于1时按host的hash分区并多进程去重")
+    parser.add_argument('--tmp_dir', type=str, default=None)
+    parser.add_argument('--status', type=str, default='', help="只保留这些状态码的行(逗号分隔)，例如 200")
+    parser.add_argument('--mime', type=str, default='', help="只保留这些MIME类型的行(逗号分隔)，例如 text/html")
+    parser.add_argument('--languages', type=str, default='',
+                        help="只保留这些语言的行(逗号分隔，ISO-639-3)，例如 eng,zho")
+    parser.add_argument('--exclude_file', type=str, default=None, help="每行一个要排除的URL正则")
+    parser.add_argument('--parse_procs', type=int, default=1, help="解析和过滤CDX的进程数")
     args = parser.parse_args()
     main(args)
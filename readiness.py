@@ -0,0 +1,244 @@
+"""页面就绪检测：代替页面加载后固定sleep的等待方式
+
+每种策略根据一次轮询得到的页面快照(snapshot)判断页面是否已经就绪，每种策略都有自己的硬性超时。
+ReadinessWaiter 组合多个策略，所有策略都就绪(或超时)后结束等待，并给出每个策略的耗时，
+最终决定等待时长的那个策略记为 fired，写入输出记录方便分析。
+
+快照由两部分组成：
+* 页面内注入的脚本(READINESS_PROBE_JS)给出的DOM变化、字体和图片的加载情况
+* NetworkTracker 根据 Network 事件统计出的 in-flight 请求数
+selenium引擎从performance日志中读取Network事件，cdp引擎直接订阅Network事件。
+"""
+import json
+import time
+
+# 第一次执行时安装MutationObserver，之后每次执行返回距上次DOM变化的时间以及资源加载情况
+READINESS_PROBE_JS = r"""
+var state = window.__seeclickReadiness;
+if (!state) {
+    state = window.__seeclickReadiness = {lastMutation: performance.now()};
+    new MutationObserver(function () {
+        state.lastMutation = performance.now();
+    }).observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+}
+var pending = 0;
+var images = document.images;
+for (var i = 0; i < images.length; i++) {
+    if (!images[i].complete) pending++;
+}
+return {
+    sinceMutation: performance.now() - state.lastMutation,
+    readyState: document.readyState,
+    fontsReady: !document.fonts || document.fonts.status === 'loaded',
+    imagesPending: pending
+};
+"""
+
+
+# 等待两帧，保证改变视口大小之后的重新布局和绘制已经完成(用于execute_async_script)
+WAIT_FRAMES_JS = r"""
+var done = arguments[arguments.length - 1];
+requestAnimationFrame(function () {
+    requestAnimationFrame(function () { done(true); });
+});
+"""
+
+
+def build_probe_expression():
+    """把探测脚本包装成可以直接求值的表达式，供CDP的Runtime.evaluate使用"""
+    return "(function() {%s})()" % READINESS_PROBE_JS
+
+
+class NetworkTracker:
+    """根据Network事件跟踪当前未完成的请求"""
+
+    def __init__(self):
+        self.inflight = set()
+        self.listeners = []  # 其它需要Network事件的模块(例如资源拦截的统计)，listener(method, params)
+
+    def reset(self):
+        self.inflight.clear()
+
+    def onEvent(self, method, params):
+        for listener in self.listeners:
+            listener(method, params)
+        if method == 'Network.requestWillBeSent':
+            self.inflight.add(params.get('requestId'))
+        elif method in ('Network.loadingFinished', 'Network.loadingFailed'):
+            self.inflight.discard(params.get('requestId'))
+
+    @property
+    def count(self):
+        return len(self.inflight)
+
+
+class SeleniumNetworkTracker(NetworkTracker):
+    """从chromedriver的performance日志中读取Network事件，需要在启动driver时开启performance日志"""
+
+    def __init__(self, driver):
+        super().__init__()
+        self.driver = driver
+
+    def reset(self):
+        # 丢弃上一个页面残留的日志
+        self.driver.get_log('performance')
+        super().reset()
+
+    def drain(self):
+        for entry in self.driver.get_log('performance'):
+            message = json.loads(entry['message'])['message']
+            self.onEvent(message.get('method'), message.get('params', {}))
+
+
+class ReadinessStrategy:
+    name = 'base'
+    needs_network = False
+
+    def __init__(self, timeout):
+        self.timeout = timeout  # 单个策略的硬性超时(秒)
+
+    def reset(self):
+        pass
+
+    def isReady(self, snapshot, elapsed):
+        raise NotImplementedError
+
+
+class FixedSleepStrategy(ReadinessStrategy):
+    """原来的行为：固定等待一段时间"""
+    name = 'sleep'
+
+    def __init__(self, seconds=2):
+        super().__init__(seconds)
+        self.seconds = seconds
+
+    def isReady(self, snapshot, elapsed):
+        return elapsed >= self.seconds
+
+
+class NetworkIdleStrategy(ReadinessStrategy):
+    """未完成的请求数不超过max_inflight并持续idle_ms毫秒
+
+    很多页面有一直不结束的请求(长轮询、统计信标、流媒体)，max_inflight为0时这些页面总是等到超时，
+    默认允许2个未完成的请求
+    """
+    name = 'network_idle'
+    needs_network = True
+
+    def __init__(self, max_inflight=2, idle_ms=500, timeout=10):
+        super().__init__(timeout)
+        self.max_inflight = max_inflight
+        self.idle_ms = idle_ms
+        self.idle_since = None
+
+    def reset(self):
+        self.idle_since = None
+
+    def isReady(self, snapshot, elapsed):
+        if snapshot['inflight'] > self.max_inflight:
+            self.idle_since = None
+            return False
+        if self.idle_since is None:
+            self.idle_since = elapsed
+        return (elapsed - self.idle_since) * 1000 >= self.idle_ms
+
+
+class DomStableStrategy(ReadinessStrategy):
+    """MutationObserver在quiet_ms毫秒内没有观察到DOM变化"""
+    name = 'dom_stable'
+
+    def __init__(self, quiet_ms=500, timeout=10):
+        super().__init__(timeout)
+        self.quiet_ms = quiet_ms
+
+    def isReady(self, snapshot, elapsed):
+        return snapshot['sinceMutation'] >= self.quiet_ms
+
+
+class ResourcesLoadedStrategy(ReadinessStrategy):
+    """文档加载完成，字体和图片都已加载"""
+    name = 'resources'
+
+    def isReady(self, snapshot, elapsed):
+        return snapshot['readyState'] == 'complete' and snapshot['fontsReady'] and snapshot['imagesPending'] == 0
+
+
+def build_strategies(spec, deadline=10, sleep_seconds=2, max_inflight=2, idle_ms=500):
+    """根据逗号分隔的策略名构造策略列表，例如 'network_idle,dom_stable'
+
+    max_inflight、idle_ms为network_idle的参数：未完成的请求不超过max_inflight个并持续idle_ms毫秒
+    """
+    strategies = []
+    for name in spec.split(','):
+        name = name.strip()
+        if name == '':
+            continue
+        if name == 'sleep':
+            strategies.append(FixedSleepStrategy(sleep_seconds))
+        elif name == 'network_idle':
+            strategies.append(NetworkIdleStrategy(max_inflight, idle_ms, timeout=deadline))
+        elif name == 'dom_stable':
+            strategies.append(DomStableStrategy(timeout=deadline))
+        elif name == 'resources':
+            strategies.append(ResourcesLoadedStrategy(timeout=deadline))
+        else:
+            raise ValueError(f"unknown readiness strategy: {name}")
+    return strategies
+
+
+class ReadinessWaiter:
+    def __init__(self, strategies, deadline=10, poll_interval=0.1):
+        self.strategies = strategies
+        self.deadline = deadline  # 整体的硬性超时(秒)
+        self.poll_interval = poll_interval
+        self.needs_network = any(strategy.needs_network for strategy in strategies)
+        self.start = None
+        self.status = {}
+
+    def begin(self):
+        self.start = time.monotonic()
+        self.status = {}
+        for strategy in self.strategies:
+            strategy.reset()
+
+    def poll(self, snapshot):
+        """根据一次快照更新各策略的状态，全部结束时返回True"""
+        elapsed = time.monotonic() - self.start
+        for strategy in self.strategies:
+            if strategy.name in self.status:
+                continue
+            if strategy.isReady(snapshot, elapsed):
+                self.status[strategy.name] = ('ready', elapsed)
+            elif elapsed >= strategy.timeout:
+                self.status[strategy.name] = ('deadline', elapsed)
+        if len(self.status) == len(self.strategies):
+            return True
+        if elapsed >= self.deadline:
+            for strategy in self.strategies:
+                self.status.setdefault(strategy.name, ('deadline', elapsed))
+            return True
+        return False
+
+    def report(self):
+        elapsed = time.monotonic() - self.start
+        fired = None
+        if self.status:
+            fired = max(self.status, key=lambda name: self.status[name][1])
+        return {
+            "fired": fired,
+            "elapsed_ms": round(elapsed * 1000),
+            "strategies": {name: {"status": status, "ms": round(at * 1000)}
+                           for name, (status, at) in self.status.items()},
+        }
+
+    def wait(self, driver, network=None):
+        """selenium引擎下的同步等待，network为SeleniumNetworkTracker"""
+        self.begin()
+        while True:
+            snapshot = driver.execute_script(READINESS_PROBE_JS)
+            if network is not None:
+                network.drain()
+                snapshot['inflight'] = network.count
+            if self.poll(snapshot):
+                return self.report()
+            time.sleep(self.poll_interval)
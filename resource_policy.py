@@ -0,0 +1,146 @@
+"""页面加载时的资源拦截策略
+
+视频、音频、网页字体、统计信标和广告等资源占了大部分加载时间和带宽，但对grounding截图没有帮助。
+ResourcePolicy 描述要拦截哪些请求：
+* 按资源类型拦截(media, font, ping, websocket)
+* 按域名拦截，域名列表从文件读取，每行一个域名，会同时拦截其子域名
+* 单个响应的大小上限(仅cdp引擎支持，需要在响应阶段拦截)
+
+selenium引擎通过 Network.setBlockedURLs 按URL模式拦截，资源类型只能根据扩展名近似判断，
+ping通过Chrome的 --no-pings 参数关闭；被拦截的请求在performance日志中表现为带blockedReason的loadingFailed事件。
+cdp引擎通过 Fetch 域按资源类型精确拦截，并可以根据Content-Length丢弃过大的响应
+(只在响应阶段暂停SIZE_CAPPED_TYPES中的子资源，主文档不受影响)。
+请求阶段被拦截的资源还没有响应，节省的字节数按TYPICAL_BYTES中各类型的典型大小估算，
+响应阶段丢弃的资源按Content-Length计算，两者在统计中分开给出。
+"""
+from collections import Counter
+
+# 资源类型 -> (CDP中的ResourceType, 用于Network.setBlockedURLs的URL模式)
+RESOURCE_TYPES = {
+    'media': ('Media', ['*.mp4', '*.webm', '*.ogg', '*.ogv', '*.mp3', '*.wav', '*.m4a', '*.m4v', '*.mov', '*.avi',
+                        '*.flac', '*.m3u8', '*.mpd']),
+    'font': ('Font', ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot']),
+    'ping': ('Ping', []),
+    'websocket': ('WebSocket', ['ws://*', 'wss://*']),
+}
+
+# 响应大小上限适用的资源类型(CDP中的ResourceType)，不包括主文档和iframe的文档
+SIZE_CAPPED_TYPES = ('Image', 'Media', 'Font', 'Stylesheet', 'Script', 'XHR', 'Fetch', 'Other')
+
+# 在请求阶段被拦截的资源的典型传输大小(字节)，用于估算节省的流量；信标和websocket几乎没有响应体
+TYPICAL_BYTES = {
+    'Media': 512 << 10,
+    'Font': 30 << 10,
+    'Script': 20 << 10,
+    'Image': 15 << 10,
+    'Stylesheet': 10 << 10,
+    'XHR': 2 << 10,
+    'Fetch': 2 << 10,
+    'Ping': 0,
+    'WebSocket': 0,
+}
+DEFAULT_TYPICAL_BYTES = 5 << 10
+
+
+def load_blocklist(blocklist_file):
+    domains = []
+    with open(blocklist_file, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            # 兼容hosts文件的格式，例如 "0.0.0.0 ads.example.com"
+            domains.append(line.split()[-1].lower())
+    return domains
+
+
+class ResourcePolicy:
+    def __init__(self, block_types=(), blocklist_file=None, max_response_bytes=0):
+        for block_type in block_types:
+            if block_type not in RESOURCE_TYPES:
+                raise ValueError(f"unknown resource type: {block_type}")
+        self.block_types = list(block_types)
+        self.blocked_domains = load_blocklist(blocklist_file) if blocklist_file else []
+        self.max_response_bytes = max_response_bytes
+
+    @classmethod
+    def fromOptions(cls, block_types='', blocklist_file=None, max_response_kb=0):
+        block_types = [name.strip() for name in block_types.split(',') if name.strip()]
+        return cls(block_types, blocklist_file, max_response_kb << 10)
+
+    @property
+    def enabled(self):
+        return bool(self.block_types or self.blocked_domains or self.max_response_bytes)
+
+    def chromeArgs(self):
+        return ['--no-pings'] if 'ping' in self.block_types else []
+
+    def domainPatterns(self):
+        patterns = []
+        for domain in self.blocked_domains:
+            patterns += [f'*://{domain}/*', f'*://*.{domain}/*']
+        return patterns
+
+    def urlPatterns(self):
+        """selenium引擎使用的URL模式：按扩展名近似的资源类型加上域名黑名单"""
+        patterns = []
+        for block_type in self.block_types:
+            patterns += RESOURCE_TYPES[block_type][1]
+        return patterns + self.domainPatterns()
+
+    def applySelenium(self, driver):
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.urlPatterns()})
+
+    def fetchPatterns(self):
+        """cdp引擎中Fetch.enable的拦截模式：只暂停需要拦截的资源类型，其余请求不受影响"""
+        patterns = [{'resourceType': RESOURCE_TYPES[block_type][0], 'requestStage': 'Request'}
+                    for block_type in self.block_types]
+        if self.max_response_bytes:
+            # 在请求阶段已经拦截的类型不会有响应
+            blocked = {RESOURCE_TYPES[block_type][0] for block_type in self.block_types}
+            patterns += [{'resourceType': resource_type, 'requestStage': 'Response'}
+                         for resource_type in SIZE_CAPPED_TYPES if resource_type not in blocked]
+        return patterns
+
+    def responseTooLarge(self, headers):
+        """根据响应头判断是否超过大小上限，返回响应的大小(超过上限时)或None"""
+        if not self.max_response_bytes:
+            return None
+        for header in headers or []:
+            if header.get('name', '').lower() == 'content-length':
+                try:
+                    length = int(header.get('value', ''))
+                except ValueError:
+                    return None
+                return length if length > self.max_response_bytes else None
+        return None
+
+
+class BlockStats:
+    """单个页面的拦截统计，写入输出记录"""
+
+    def __init__(self):
+        self.by_type = Counter()
+        self.bytes_measured = 0  # 响应阶段丢弃的响应，按Content-Length
+        self.bytes_estimated = 0  # 请求阶段拦截的请求，按类型的典型大小估算
+
+    def add(self, resource_type, bytes_saved=None):
+        """记录一个被拦截的请求，bytes_saved为None时按资源类型估算"""
+        resource_type = resource_type or 'Other'
+        self.by_type[resource_type] += 1
+        if bytes_saved is None:
+            self.bytes_estimated += TYPICAL_BYTES.get(resource_type, DEFAULT_TYPICAL_BYTES)
+        else:
+            self.bytes_measured += bytes_saved
+
+    def onNetworkEvent(self, method, params):
+        # Network.setBlockedURLs拦截的请求会产生blockedReason为inspector的loadingFailed事件；
+        # Fetch拦截的请求在requestPaused时已经计数，这里不再重复统计
+        if method == 'Network.loadingFailed' and params.get('blockedReason') == 'inspector':
+            self.add(params.get('type'))
+
+    def report(self):
+        return {"requests": sum(self.by_type.values()), "by_type": dict(self.by_type),
+                "bytes_saved": self.bytes_measured + self.bytes_estimated,
+                "bytes_saved_estimated": self.bytes_estimated}
@@ -0,0 +1,64 @@
+"""流式的URL分片
+
+原来的做法是把CDX中所有URL读进内存，shuffle之后取 [url_st, url_st + num_urls) 一段。
+这里给每个URL计算一个由seed决定的伪随机key，按key排序就是一个确定的随机排列；
+扫描一遍CDX，只用一个大小为 url_st + num_urls 的堆保留key最小的那些URL，
+内存只和要取的窗口位置有关，与CDX文件的大小无关。
+"""
+import hashlib
+import heapq
+import os
+
+from cdx_reader import iter_cdx_records
+
+
+def url_sort_key(url, seed):
+    """URL在随机排列中的位置由 (seed, url) 唯一确定"""
+    digest = hashlib.blake2b(url.encode('utf-8'), digest_size=8, key=str(seed).encode('utf-8')).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def select_window(urls, seed, url_st, num_urls):
+    """返回urls按seed随机排列后 [url_st, url_st + num_urls) 范围内的URL"""
+    end = url_st + num_urls
+    if end <= 0:
+        return []
+    heap = []  # 大顶堆(key取负)，保留当前key最小的end个URL
+    for url in urls:
+        item = (-url_sort_key(url, seed), url)
+        if len(heap) < end:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    selected = sorted(heap, reverse=True)
+    return [url for _, url in selected[url_st:end]]
+
+
+def iter_cdx_urls(cdx_file_path, cdx_filter=None, num_procs=1, stats=None):
+    """CDX中满足过滤条件(cdx_reader.CDXFilter)的URL，num_procs大于1时多进程解析"""
+    for url, _ in iter_cdx_records(cdx_file_path, cdx_filter, num_procs, stats):
+        yield url
+
+
+def write_shards(urls, out_dir, num_workers):
+    """把urls尽量平均地写到 {i}.txt 中，最后一个worker拿走余下的部分"""
+    num_urls = len(urls)
+    num_urls_per_worker = num_urls // num_workers
+    for i in range(num_workers):
+        start_index = i * num_urls_per_worker
+        end_index = (i + 1) * num_urls_per_worker
+        if i == num_workers - 1:
+            end_index = num_urls
+        with open(os.path.join(out_dir, f"{i}.txt"), 'w', encoding='utf-8') as file:
+            for j in range(start_index, end_index):
+                file.write(urls[j] + '\n')
+
+
+def shard_cdx(cdx_file_path, out_dir, num_workers, url_st, num_urls, seed, cdx_filter=None, num_procs=1,
+              stats=None, url_filter=None):
+    """url_filter(urls)在写出分片之前处理选出的URL，例如HTTP预检"""
+    urls = select_window(iter_cdx_urls(cdx_file_path, cdx_filter, num_procs, stats), seed, url_st, num_urls)
+    if url_filter is not None:
+        urls = url_filter(urls)
+    write_shards(urls, out_dir, num_workers)
+    return len(urls)
@@ -0,0 +1,173 @@
+"""基于SQLite的共享任务队列
+
+所有worker从同一个队列中按小批量领取URL，处理得快的worker自然会领取更多任务，
+不会出现某个worker的分片里卡住几个慢网站、其它核心却已经空闲的情况。
+队列在磁盘上，运行中途可以随时增加或减少worker：新worker直接连到同一个队列，
+退出或被杀掉的worker领取的任务在租约(lease)过期后会重新回到队列中。
+
+同时实现了按host的礼貌性限制(每个host同时最多处理max_per_host个URL，两次访问之间至少间隔host_interval秒)
+以及失败后的指数退避重试。
+"""
+import os
+import sqlite3
+import time
+from urllib.parse import urlparse
+
+PENDING = 0
+LEASED = 1
+DONE = 2
+FAILED = 3
+
+
+class TaskQueue:
+    def __init__(self, db_path, max_per_host=1, host_interval=1.0, max_attempts=3, backoff_base=30,
+                 lease_timeout=900):
+        self.db_path = db_path
+        self.max_per_host = max_per_host
+        self.host_interval = host_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base  # 第n次失败后等待 backoff_base * 2^(n-1) 秒再重试
+        self.lease_timeout = lease_timeout
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                host TEXT NOT NULL,
+                status INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_at REAL NOT NULL DEFAULT 0,
+                worker TEXT,
+                leased_at REAL,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, next_at);
+            CREATE TABLE IF NOT EXISTS hosts (
+                host TEXT PRIMARY KEY,
+                inflight INTEGER NOT NULL DEFAULT 0,
+                last_access REAL NOT NULL DEFAULT 0
+            );
+        """)
+
+    def close(self):
+        self.conn.close()
+
+    def __transaction(self):
+        # BEGIN IMMEDIATE 在事务开始时就拿到写锁，避免多个worker领取到同一个任务
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def isEmpty(self):
+        return self.conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0] == 0
+
+    def addUrls(self, urls):
+        rows = [(url, urlparse(url).hostname or '') for url in urls]
+        self.__transaction()
+        try:
+            self.conn.executemany("INSERT INTO tasks (url, host) VALUES (?, ?)", rows)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def __reclaimExpired(self, now):
+        # 租约过期通常意味着worker在处理这个URL时被杀掉或卡死，同样计为一次尝试，
+        # 否则一个总能让worker崩溃的URL会被无限次重试
+        expired = self.conn.execute("SELECT id, host, attempts FROM tasks WHERE status = ? AND leased_at < ?",
+                                    (LEASED, now - self.lease_timeout)).fetchall()
+        for task_id, host, attempts in expired:
+            status = PENDING if attempts + 1 < self.max_attempts else FAILED
+            self.conn.execute("UPDATE tasks SET status = ?, attempts = attempts + 1, worker = NULL, "
+                              "error = 'lease expired' WHERE id = ?", (status, task_id))
+            self.conn.execute("UPDATE hosts SET inflight = MAX(inflight - 1, 0) WHERE host = ?", (host,))
+
+    def claim(self, worker, batch_size):
+        """领取最多batch_size个任务，返回[(task_id, url)]；同一批次中每个host最多一个URL"""
+        now = time.time()
+        self.__transaction()
+        try:
+            self.__reclaimExpired(now)
+            candidates = self.conn.execute(
+                "SELECT t.id, t.url, t.host FROM tasks t LEFT JOIN hosts h ON t.host = h.host "
+                "WHERE t.status = ? AND t.next_at <= ? "
+                "AND (h.host IS NULL OR (h.inflight < ? AND h.last_access <= ?)) "
+                "ORDER BY t.id LIMIT ?",
+                (PENDING, now, self.max_per_host, now - self.host_interval, batch_size * 8)).fetchall()
+            batch = []
+            hosts = set()
+            for task_id, url, host in candidates:
+                if host in hosts:
+                    continue
+                hosts.add(host)
+                batch.append((task_id, url))
+                self.conn.execute("UPDATE tasks SET status = ?, worker = ?, leased_at = ? WHERE id = ?",
+                                  (LEASED, worker, now, task_id))
+                self.conn.execute("INSERT INTO hosts (host, inflight, last_access) VALUES (?, 1, ?) "
+                                  "ON CONFLICT(host) DO UPDATE SET inflight = inflight + 1, last_access = ?",
+                                  (host, now, now))
+                if len(batch) >= batch_size:
+                    break
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return batch
+
+    def __finish(self, task_id, status, attempts_inc, next_at, error):
+        now = time.time()
+        self.__transaction()
+        try:
+            row = self.conn.execute("SELECT host FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            self.conn.execute("UPDATE tasks SET status = ?, attempts = attempts + ?, next_at = ?, error = ?, "
+                              "worker = NULL WHERE id = ?", (status, attempts_inc, next_at, error, task_id))
+            if row is not None:
+                self.conn.execute("UPDATE hosts SET inflight = MAX(inflight - 1, 0), last_access = ? WHERE host = ?",
+                                  (now, row[0]))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def complete(self, task_id):
+        self.__finish(task_id, DONE, 0, 0, None)
+
+    def fail(self, task_id, error=None):
+        """记录一次失败，未达到max_attempts时按指数退避重新放回队列"""
+        attempts = self.conn.execute("SELECT attempts FROM tasks WHERE id = ?", (task_id,)).fetchone()[0] + 1
+        if attempts < self.max_attempts:
+            next_at = time.time() + self.backoff_base * 2 ** (attempts - 1)
+            self.__finish(task_id, PENDING, 1, next_at, error)
+        else:
+            self.__finish(task_id, FAILED, 1, 0, error)
+
+    def stats(self):
+        names = {PENDING: 'pending', LEASED: 'leased', DONE: 'done', FAILED: 'failed'}
+        counts = {name: 0 for name in names.values()}
+        for status, count in self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status"):
+            counts[names[status]] = count
+        return counts
+
+    def iterTasks(self, worker, batch_size=4, poll_interval=5, on_idle=None):
+        """不断领取任务直到队列中没有未完成的任务，逐个产出(task_id, url)
+
+        领取不到任务时先调用on_idle()，调用方可以借此提交已经处理完、但还没有落盘的任务，
+        否则这些任务一直处于租约中，要等lease_timeout之后被重新领取。
+        """
+        while True:
+            batch = self.claim(worker, batch_size)
+            if batch:
+                yield from batch
+                continue
+            if on_idle is not None:
+                on_idle()
+            stats = self.stats()
+            if stats['pending'] == 0 and stats['leased'] == 0:
+                return
+            # 剩下的任务在退避中、被礼貌性限制挡住或被其它worker持有，稍后再试
+            time.sleep(poll_interval)
+
+
+def default_queue_path(out_dir):
+    return os.path.join(out_dir, "queue.db")
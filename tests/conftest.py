@@ -0,0 +1,33 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+# 仓库的模块都在顶层目录
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def find_chrome():
+    for name in (os.environ.get('CHROME_PATH'), 'google-chrome', 'chromium', 'chromium-browser'):
+        if name and shutil.which(name):
+            return shutil.which(name)
+    return None
+
+
+@pytest.fixture
+def chrome_path():
+    """本机的Chrome，找不到时跳过需要真实浏览器的测试"""
+    path = find_chrome()
+    if path is None:
+        pytest.skip("chrome not found")
+    return path
+
+
+@pytest.fixture
+def chromedriver_path(chrome_path):
+    """selenium引擎使用的chromedriver，找不到时跳过"""
+    path = os.environ.get('CHROMEDRIVER_PATH') or shutil.which('chromedriver')
+    if path is None:
+        pytest.skip("chromedriver not found")
+    return path
@@ -0,0 +1,22 @@
+from extractor import clickable_records
+
+
+def item(text, x, y, fixed=False):
+    return {'text': text, 'x': x, 'y': y, 'w': 100, 'h': 20, 'fixed': fixed}
+
+
+def test_tiles_dedup_by_page_position():
+    signatures = set()
+    first = clickable_records([item('nav', 0, 0, fixed=True), item('overlap', 10, 700)], 800, 1000, signatures, 0)
+    # 第二块从页面的600处开始，overlap在块内的位置是100
+    second = clickable_records([item('nav', 0, 0, fixed=True), item('overlap', 10, 100)], 800, 1000, signatures, 600)
+    assert [record['text'] for record in first] == ['nav', 'overlap']
+    assert second == []
+
+
+def test_fixed_element_does_not_hide_in_flow_element():
+    signatures = set()
+    clickable_records([item('nav', 0, 0, fixed=True)], 800, 1000, signatures, 0)
+    # 第一块中页面坐标为(0, 0)的普通元素与吸顶导航栏的相对坐标相同，但不是同一个元素
+    records = clickable_records([item('logo', 0, 0)], 800, 1000, signatures, 0)
+    assert [record['text'] for record in records] == ['logo']
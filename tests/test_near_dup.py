@@ -0,0 +1,58 @@
+import io
+
+import pytest
+from PIL import Image
+
+from near_dup import NearDupFilter, NearDupIndex, NearDuplicate
+
+TEMPLATE = {'simhash': '00000000000000ff'}
+
+
+@pytest.fixture
+def dedup(tmp_path):
+    dedup = NearDupFilter(NearDupIndex(str(tmp_path / 'near_dup.sqlite')), max_per_cluster=1)
+    yield dedup
+    dedup.close()
+
+
+def test_failed_page_releases_its_slot(dedup):
+    dedup.checkDom(TEMPLATE, 'http://a.example/')
+    # a加载失败没有保存，b仍然可以作为这个模板的样本
+    dedup.release('http://a.example/')
+    dedup.checkDom(TEMPLATE, 'http://b.example/')
+    with pytest.raises(NearDuplicate):
+        dedup.checkDom(TEMPLATE, 'http://c.example/')
+    assert dedup.stats()['released'] == 1
+
+
+def test_retry_keeps_first_answer(dedup):
+    dedup.checkDom(TEMPLATE, 'http://a.example/')
+    dedup.checkDom(TEMPLATE, 'http://a.example/')
+    with pytest.raises(NearDuplicate):
+        dedup.checkDom(TEMPLATE, 'http://b.example/')
+    # 被跳过的页面不占名额，释放后重试仍然是重复
+    dedup.release('http://b.example/')
+    with pytest.raises(NearDuplicate) as info:
+        dedup.checkDom(TEMPLATE, 'http://b.example/')
+    assert info.value.size == 2
+    assert dedup.index.clusterSizes('dom') == {2: 1}
+
+
+def png(color):
+    image = Image.new('RGB', (64, 32), color)
+    image.paste((255, 255, 255), (0, 0, 32, 32))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_image_duplicate_releases_dom_slot(dedup):
+    dedup.checkImage(png((0, 0, 0)), 'http://x.example/')
+    dedup.checkDom(TEMPLATE, 'http://a.example/')
+    with pytest.raises(NearDuplicate):
+        dedup.checkImage(png((0, 0, 0)), 'http://a.example/')
+    # a的截图是重复的，没有保存，它的DOM指纹不能占用名额
+    dedup.release('http://a.example/')
+    dedup.checkDom(TEMPLATE, 'http://b.example/')
+    assert dedup.index.clusterSizes('dom') == {1: 1}
+    assert dedup.index.clusterSizes('image') == {2: 1}
@@ -0,0 +1,52 @@
+import json
+import os
+
+from output_writer import JsonlPngOutput, TarShardOutput, iter_shard_samples
+
+
+def test_tar_index_offsets(tmp_path):
+    committed = []
+    output = TarShardOutput(str(tmp_path), 0, on_commit=committed.extend)
+    samples = {f'{i:032x}': (bytes([i]) * (700 + i * 300), [{'text': f'element {i}'}]) for i in range(3)}
+    for key, (data, records) in samples.items():
+        output.writeImage(output.imagePath(key, '.png'), data)
+        output.writeRecords(key, records)
+    output.close()
+    assert committed == list(samples)
+
+    shard_dir = tmp_path / '0_shards'
+    with open(shard_dir / '0.index.jsonl', encoding='utf-8') as file:
+        index = [json.loads(line) for line in file]
+    assert [entry['key'] for entry in index] == list(samples)
+    for entry in index:
+        data, records = samples[entry['key']]
+        # 按索引中的偏移和长度直接读取分片，不需要解析tar
+        with open(shard_dir / entry['shard'], 'rb') as file:
+            name, offset, size = entry['image']
+            assert offset > 0 and size == len(data)
+            file.seek(offset)
+            assert file.read(size) == data
+            name, offset, size = entry['json']
+            file.seek(offset)
+            assert json.loads(file.read(size)) == records
+    assert [(key, records) for key, _, _, records in iter_shard_samples(str(shard_dir))] == \
+        [(key, records) for key, (_, records) in samples.items()]
+    assert not any(name.endswith('.tmp') for name in os.listdir(shard_dir))
+
+
+def test_jsonl_records_wait_for_image(tmp_path):
+    committed = []
+    output = JsonlPngOutput(str(tmp_path), 0, on_commit=committed.extend)
+    out_path = tmp_path / '0_out.txt'
+    output.writeRecords('a', [{'text': 'a1'}, {'text': 'a2'}])
+    output.writeRecords('b', [{'text': 'b1'}])
+    # 图片还没有写盘，记录不能出现在out_file中，否则崩溃后重爬会重复写入
+    assert out_path.read_text(encoding='utf-8') == '' and committed == []
+    output.writeImage(output.imagePath('a', '.png'), b'png-a')
+    output.flush()
+    assert committed == ['a']
+    assert [json.loads(line) for line in out_path.read_text(encoding='utf-8').splitlines()] == \
+        [{'text': 'a1'}, {'text': 'a2'}]
+    output.close()
+    assert committed == ['a'] and output.num_dropped == 1
+    assert (tmp_path / '0_images' / 'a.png').read_bytes() == b'png-a'
@@ -0,0 +1,235 @@
+"""就绪检测的测试：本地http服务器按请求参数延迟返回资源
+
+不需要浏览器的测试用线程请求资源并产生Network事件，模拟页面加载时的请求；
+找到Chrome(以及websockets、selenium和chromedriver)时，再用两种引擎端到端地加载一个引用了慢资源的页面。
+"""
+import asyncio
+import http.server
+import json
+import queue
+import threading
+import time
+import urllib.request
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from readiness import (DomStableStrategy, FixedSleepStrategy, NetworkIdleStrategy, NetworkTracker,
+                       ReadinessWaiter, SeleniumNetworkTracker, build_strategies)
+
+# 慢资源在load事件之后才请求，导航结束时还没有返回，只能由就绪检测等待
+PAGE = """<!DOCTYPE html><html><head><meta charset="utf-8"><title>readiness</title></head>
+<body><div><a href="#a">link</a></div>
+<script>window.addEventListener('load', function () {{ fetch('/slow?ms={ms}'); }});</script></body></html>"""
+
+
+class DelayedHandler(http.server.BaseHTTPRequestHandler):
+    """/slow?ms=N 在N毫秒之后返回一张1x1的gif，/page?ms=N 返回加载完成后再请求该资源的页面"""
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        ms = int(parse_qs(parsed.query).get('ms', ['0'])[0])
+        if parsed.path == '/page':
+            body, content_type = PAGE.format(ms=ms).encode('utf-8'), 'text/html; charset=utf-8'
+        else:
+            time.sleep(ms / 1000)
+            body, content_type = b'GIF89a\x01\x00\x01\x00\x00\x00\x00;', 'image/gif'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server_url():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), DelayedHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+class ThreadedTracker(NetworkTracker):
+    """后台线程把Network事件放进队列，轮询时取出，与SeleniumNetworkTracker读取performance日志的方式相同"""
+
+    def __init__(self):
+        super().__init__()
+        self.events = queue.Queue()
+
+    def fetch(self, request_id, url):
+        def run():
+            try:
+                urllib.request.urlopen(url, timeout=30).read()
+                self.events.put(('Network.loadingFinished', {'requestId': request_id}))
+            except Exception:
+                self.events.put(('Network.loadingFailed', {'requestId': request_id}))
+
+        # 请求在开始等待之前发出，与页面导航之后资源已经开始加载的情况一致
+        self.events.put(('Network.requestWillBeSent', {'requestId': request_id}))
+        threading.Thread(target=run, daemon=True).start()
+
+    def drain(self):
+        while not self.events.empty():
+            self.onEvent(*self.events.get())
+
+
+def wait(waiter, tracker):
+    waiter.begin()
+    while True:
+        tracker.drain()
+        snapshot = {'inflight': tracker.count, 'sinceMutation': 1e9, 'readyState': 'complete',
+                    'fontsReady': True, 'imagesPending': 0}
+        if waiter.poll(snapshot):
+            return waiter.report()
+        time.sleep(waiter.poll_interval)
+
+
+def test_network_idle_waits_for_delayed_resource(server_url):
+    tracker = ThreadedTracker()
+    tracker.fetch('fast', f'{server_url}/slow?ms=0')
+    tracker.fetch('slow', f'{server_url}/slow?ms=800')
+    waiter = ReadinessWaiter([NetworkIdleStrategy(max_inflight=0, idle_ms=200, timeout=5)], deadline=5,
+                             poll_interval=0.02)
+    report = wait(waiter, tracker)
+    strategy = report['strategies']['network_idle']
+    assert strategy['status'] == 'ready'
+    # 慢资源返回之后还要再空闲200ms
+    assert strategy['ms'] >= 950
+    assert strategy['ms'] < 3000
+
+
+def test_network_idle_tolerates_long_requests(server_url):
+    tracker = ThreadedTracker()
+    tracker.fetch('fast', f'{server_url}/slow?ms=50')
+    tracker.fetch('hanging', f'{server_url}/slow?ms=5000')
+    strategies = build_strategies('network_idle', deadline=4, max_inflight=1, idle_ms=200)
+    report = wait(ReadinessWaiter(strategies, deadline=4, poll_interval=0.02), tracker)
+    strategy = report['strategies']['network_idle']
+    assert strategy['status'] == 'ready'
+    assert strategy['ms'] < 2000
+
+
+def test_network_idle_hits_deadline(server_url):
+    tracker = ThreadedTracker()
+    tracker.fetch('hanging', f'{server_url}/slow?ms=3000')
+    waiter = ReadinessWaiter(build_strategies('network_idle', deadline=1, max_inflight=0, idle_ms=200), deadline=1,
+                             poll_interval=0.02)
+    report = wait(waiter, tracker)
+    assert report['fired'] == 'network_idle'
+    assert report['strategies']['network_idle']['status'] == 'deadline'
+    assert 1000 <= report['elapsed_ms'] < 2500
+
+
+def test_network_idle_default_ignores_beacons(server_url):
+    # 默认允许2个未完成的请求，统计信标和长轮询不会让页面等到deadline
+    tracker = ThreadedTracker()
+    tracker.fetch('beacon', f'{server_url}/slow?ms=5000')
+    tracker.fetch('poll', f'{server_url}/slow?ms=5000')
+    report = wait(ReadinessWaiter(build_strategies('network_idle', deadline=4, idle_ms=200), deadline=4,
+                                  poll_interval=0.02), tracker)
+    assert report['strategies']['network_idle']['status'] == 'ready'
+    assert report['elapsed_ms'] < 2000
+
+
+def test_selenium_tracker_reads_performance_log():
+    class FakeDriver:
+        # chromedriver的performance日志：每条的message是JSON字符串，外层还有webview字段
+        def __init__(self, batches):
+            self.batches = batches
+
+        def get_log(self, name):
+            assert name == 'performance'
+            return self.batches.pop(0) if self.batches else []
+
+    def entry(method, **params):
+        return {'level': 'INFO', 'timestamp': 0,
+                'message': json.dumps({'message': {'method': method, 'params': params}, 'webview': 'page'})}
+
+    driver = FakeDriver([[entry('Network.requestWillBeSent', requestId='stale')],
+                         [entry('Network.requestWillBeSent', requestId='1'),
+                          entry('Network.requestWillBeSent', requestId='2'),
+                          entry('Page.frameNavigated', frame={}),
+                          entry('Network.loadingFinished', requestId='1')],
+                         [entry('Network.loadingFailed', requestId='2', blockedReason='inspector')]])
+    tracker = SeleniumNetworkTracker(driver)
+    events = []
+    tracker.listeners.append(lambda method, params: events.append(method))
+    tracker.reset()  # 上一个页面残留的日志被丢弃
+    tracker.drain()
+    assert tracker.inflight == {'2'}
+    tracker.drain()
+    assert tracker.count == 0
+    assert events == ['Network.requestWillBeSent', 'Network.requestWillBeSent', 'Page.frameNavigated',
+                      'Network.loadingFinished', 'Network.loadingFailed']
+
+
+def test_build_strategies_network_idle_options():
+    sleep, idle, dom = build_strategies('sleep, network_idle,dom_stable', deadline=7, sleep_seconds=3,
+                                        max_inflight=2, idle_ms=300)
+    assert isinstance(sleep, FixedSleepStrategy) and sleep.seconds == 3
+    assert isinstance(idle, NetworkIdleStrategy)
+    assert (idle.max_inflight, idle.idle_ms, idle.timeout) == (2, 300, 7)
+    idle, = build_strategies('network_idle', max_inflight=0)
+    assert idle.max_inflight == 0
+    assert isinstance(dom, DomStableStrategy) and dom.timeout == 7
+    with pytest.raises(ValueError):
+        build_strategies('network_idle,unknown')
+
+
+def test_fired_is_slowest_strategy():
+    waiter = ReadinessWaiter([DomStableStrategy(quiet_ms=500), FixedSleepStrategy(0.2)], deadline=5,
+                             poll_interval=0.02)
+    waiter.begin()
+    assert not waiter.poll({'sinceMutation': 100})
+    time.sleep(0.25)
+    assert not waiter.poll({'sinceMutation': 100})
+    assert waiter.poll({'sinceMutation': 600})
+    report = waiter.report()
+    assert report['fired'] == 'dom_stable'
+    assert set(report['strategies']) == {'dom_stable', 'sleep'}
+
+
+def test_cdp_page_waits_for_delayed_request(server_url, tmp_path, chrome_path):
+    pytest.importorskip('websockets')
+    from cdp_crawler import AsyncCrawler
+
+    crawler = AsyncCrawler(chrome_path, str(tmp_path), 800, 600, wait_timeout=5, max_tabs=1,
+                           readiness='network_idle', readiness_deadline=10, network_idle_inflight=0,
+                           network_idle_ms=300)
+    results = []
+
+    async def run():
+        await crawler.start()
+        try:
+            await crawler.crawl([f'{server_url}/page?ms=1500'], lambda url, records, elapsed: results.extend(records))
+        finally:
+            await crawler.quit()
+
+    asyncio.run(run())
+    assert results
+    readiness = results[0]['readiness']['strategies']['network_idle']
+    assert readiness['status'] == 'ready'
+    assert readiness['ms'] >= 1000
+
+
+def test_selenium_page_waits_for_delayed_request(server_url, tmp_path, chromedriver_path):
+    pytest.importorskip('selenium')
+    from crawel import Crawler
+
+    # 默认的引擎和默认的策略组合，慢资源在load事件之后才请求
+    crawler = Crawler(chromedriver_path, str(tmp_path), 800, 600, wait_timeout=5, nogui=True,
+                      readiness='network_idle,dom_stable', readiness_deadline=6, network_idle_inflight=0,
+                      network_idle_ms=300)
+    try:
+        results = crawler.processURL(f'{server_url}/page?ms=1500')
+    finally:
+        crawler.quit()
+    assert results
+    readiness = results[0]['readiness']
+    assert readiness['fired'] == 'network_idle'
+    assert readiness['strategies']['network_idle']['status'] == 'ready'
+    assert 1000 <= readiness['elapsed_ms'] < 6000
@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from fixture_site import serve_directory, write_site
+from resource_policy import DEFAULT_TYPICAL_BYTES, SIZE_CAPPED_TYPES, TYPICAL_BYTES, BlockStats, ResourcePolicy
+
+
+@pytest.fixture
+def blocklist(tmp_path):
+    path = tmp_path / 'blocklist.txt'
+    path.write_text("# ads\nads.example.com\n0.0.0.0 Tracker.Example.NET\n\n", encoding='utf-8')
+    return str(path)
+
+
+def test_from_options(blocklist):
+    policy = ResourcePolicy.fromOptions(' media, font ,', blocklist, 64)
+    assert policy.block_types == ['media', 'font']
+    assert policy.blocked_domains == ['ads.example.com', 'tracker.example.net']
+    assert policy.max_response_bytes == 64 << 10
+    assert policy.enabled
+    assert not ResourcePolicy.fromOptions().enabled
+    with pytest.raises(ValueError):
+        ResourcePolicy.fromOptions('video')
+
+
+def test_url_patterns(blocklist):
+    policy = ResourcePolicy(['font', 'ping'], blocklist)
+    patterns = policy.urlPatterns()
+    assert '*.woff2' in patterns
+    assert '*://ads.example.com/*' in patterns and '*://*.ads.example.com/*' in patterns
+    assert policy.chromeArgs() == ['--no-pings']
+    assert ResourcePolicy(['font']).chromeArgs() == []
+
+
+def test_fetch_patterns_skip_documents():
+    policy = ResourcePolicy(['media'], max_response_bytes=1 << 20)
+    patterns = policy.fetchPatterns()
+    assert {'resourceType': 'Media', 'requestStage': 'Request'} in patterns
+    response_types = {pattern['resourceType'] for pattern in patterns if pattern['requestStage'] == 'Response'}
+    # 主文档不在响应阶段暂停，请求阶段已经拦截的类型也不需要
+    assert 'Document' not in response_types
+    assert 'Media' not in response_types
+    assert response_types == set(SIZE_CAPPED_TYPES) - {'Media'}
+    assert all('urlPattern' not in pattern for pattern in patterns)
+    assert ResourcePolicy(['font']).fetchPatterns() == [{'resourceType': 'Font', 'requestStage': 'Request'}]
+
+
+def test_response_too_large():
+    policy = ResourcePolicy(max_response_bytes=1000)
+    assert policy.responseTooLarge([{'name': 'Content-Length', 'value': '5000'}]) == 5000
+    assert policy.responseTooLarge([{'name': 'content-length', 'value': '999'}]) is None
+    assert policy.responseTooLarge([{'name': 'Content-Length', 'value': 'abc'}]) is None
+    assert policy.responseTooLarge([]) is None
+    assert ResourcePolicy().responseTooLarge([{'name': 'Content-Length', 'value': '5000'}]) is None
+
+
+def test_block_stats_bytes_saved():
+    stats = BlockStats()
+    stats.add('Font')  # 请求阶段拦截，按典型大小估算
+    stats.add('Media', 2 << 20)  # 响应阶段按Content-Length丢弃
+    # Network.setBlockedURLs拦截的请求
+    stats.onNetworkEvent('Network.loadingFailed', {'blockedReason': 'inspector', 'type': 'Script'})
+    stats.onNetworkEvent('Network.loadingFailed', {'blockedReason': 'inspector'})
+    stats.onNetworkEvent('Network.loadingFailed', {'errorText': 'net::ERR_FAILED', 'type': 'Image'})
+    stats.onNetworkEvent('Network.loadingFinished', {'blockedReason': 'inspector'})
+    report = stats.report()
+    estimated = TYPICAL_BYTES['Font'] + TYPICAL_BYTES['Script'] + DEFAULT_TYPICAL_BYTES
+    assert report['requests'] == 4
+    assert report['by_type'] == {'Font': 1, 'Media': 1, 'Script': 1, 'Other': 1}
+    assert report['bytes_saved_estimated'] == estimated
+    assert report['bytes_saved'] == estimated + (2 << 20)
+
+
+def crawl_fixture_page(chrome_path, img_dir, url, policy):
+    from cdp_crawler import AsyncCrawler
+
+    crawler = AsyncCrawler(chrome_path, img_dir, 800, 600, wait_timeout=5, max_tabs=1, readiness='network_idle',
+                           readiness_deadline=10, network_idle_ms=300, resource_policy=policy)
+    results = []
+
+    async def run():
+        await crawler.start()
+        try:
+            await crawler.crawl([url], lambda url, records, elapsed: results.append((records, elapsed)))
+        finally:
+            await crawler.quit()
+
+    asyncio.run(run())
+    assert len(results) == 1
+    return results[0]
+
+
+def test_cdp_blocks_slow_font_and_media(tmp_path, chrome_path):
+    pytest.importorskip('websockets')
+    # 字体和视频放在每个请求延迟2秒的另一个服务器上，页面本身没有延迟
+    asset_dir = tmp_path / 'assets'
+    asset_dir.mkdir()
+    (asset_dir / 'slow.woff2').write_bytes(b'\0' * 4096)
+    (asset_dir / 'clip.mp4').write_bytes(b'\0' * 4096)
+    site_dir = tmp_path / 'site'
+    name, = write_site(str(site_dir), 1, num_links=5, num_buttons=2, num_titled=2)
+    asset_server = serve_directory(str(asset_dir), latency=2)
+    site_server = serve_directory(str(site_dir))
+    try:
+        asset_url = f'http://127.0.0.1:{asset_server.server_address[1]}'
+        page_path = site_dir / name
+        page = page_path.read_text(encoding='utf-8')
+        page = page.replace('</head>', f"<style>@font-face{{font-family:slow;src:url('{asset_url}/slow.woff2')}} "
+                                       f"body{{font-family:slow,sans-serif}}</style></head>")
+        page = page.replace('</body>', f'<video src="{asset_url}/clip.mp4" preload="auto"></video></body>')
+        page_path.write_text(page, encoding='utf-8')
+        url = f'http://127.0.0.1:{site_server.server_address[1]}/{name}'
+
+        records, unblocked_elapsed = crawl_fixture_page(chrome_path, str(tmp_path / 'unblocked'), url, None)
+        assert records and 'blocked' not in records[0]
+        records, blocked_elapsed = crawl_fixture_page(chrome_path, str(tmp_path / 'blocked'), url,
+                                                      ResourcePolicy.fromOptions('font,media'))
+    finally:
+        asset_server.shutdown()
+        site_server.shutdown()
+    assert records
+    blocked = records[0]['blocked']
+    assert blocked['by_type'].get('Font', 0) >= 1 and blocked['by_type'].get('Media', 0) >= 1
+    assert blocked['requests'] == sum(blocked['by_type'].values())
+    assert blocked['bytes_saved_estimated'] >= TYPICAL_BYTES['Font'] + TYPICAL_BYTES['Media']
+    assert all(record['blocked'] == blocked for record in records)
+    # 不拦截时就绪检测要等慢资源返回
+    assert unblocked_elapsed >= 2
+    assert blocked_elapsed < unblocked_elapsed - 1
@@ -1,19 +1,32 @@
 from tqdm import tqdm
+import gzip
 import hashlib
+import json
 
 
-def parse_url_from_cdx_line(line):
-    # 将每一行分割成字段
-    fields = line.strip().split(' ')
+def open_cdx(cdx_file_path):
+    """以文本方式打开CDX文件，支持gzip压缩的文件"""
+    with open(cdx_file_path, 'rb') as file:
+        magic = file.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(cdx_file_path, 'rt', encoding='utf-8')
+    return open(cdx_file_path, 'r', encoding='utf-8')
+
 
-    url = fields[3][1:-2]
+def parse_cdx_line(line):
+    """CDX的每一行为 SURT 时间戳 JSON，返回 (surt, timestamp, JSON中的字段)"""
+    # 只在前两个空格处切分，JSON中的空格不受影响
+    surt, timestamp, payload = line.strip().split(' ', 2)
+    return surt, timestamp, json.loads(payload)
 
-    return url
+
+def parse_url_from_cdx_line(line):
+    return parse_cdx_line(line)[2]['url']
 
 
 def extract_urls_from_cdx(cdx_file_path):
     urls = []
-    with open(cdx_file_path, 'r', encoding='utf-8') as file:
+    with open_cdx(cdx_file_path) as file:
         for line in tqdm(file):
             url = parse_url_from_cdx_line(line)
             urls.append(url)